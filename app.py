@@ -2,6 +2,7 @@ import asyncio
 import datetime
 import logging
 import os
+import signal
 import sys
 import time
 from logging.handlers import TimedRotatingFileHandler
@@ -17,7 +18,10 @@ from omicron.dal.cache import cache
 from data_fix.download_days import redownload_bars1d_for_target_day
 from data_fix.download_mins import redownload_bars_mins_for_target_day
 from data_fix.download_week import redownload_bars1w_for_target_day
-from datascan.validate_data_in_week import reverse_scanner_handler
+from datascan.validate_data_in_week import (
+    local_scanner_handler,
+    reverse_scanner_handler,
+)
 from download_bars.day_handler import scanner_handler_day
 from download_bars.week_handler import month_download_handler, week_download_handler
 from fetchers.abstract_quotes_fetcher import AbstractQuotesFetcher
@@ -27,10 +31,13 @@ from influx_tools import (
     remove_allsecs_in_bars1d,
     remove_sec_in_bars1d,
 )
+from job_report import run_job_with_report
 from pack_data.pack_bars import pack_data_from_db
 from pricestats.sum_history import sum_price_stats
-from rapidscan.main import get_cache_keyname
+from rapidscan.main import get_cache_keyname, scanner_handler_minutes
 from rebuild_minio.build_min_data import rebuild_minio_for_min
+from scheduler import Job, Scheduler, request_shutdown
+from warm_start import refresh_snapshot, warm_start
 
 logger = logging.getLogger(__name__)
 
@@ -76,15 +83,42 @@ def init_logger(filename: str, loglevel: int):
     )
 
 
+def get_scheduled_jobs():
+    # 和check_running_conditions一致，避开凌晨2:00-3:30和开盘前8:00-9:32
+    fetch_windows = [
+        (datetime.time(0, 0, 0), datetime.time(2, 0, 0)),
+        (datetime.time(3, 30, 0), datetime.time(8, 0, 0)),
+        (datetime.time(9, 32, 0), datetime.time.max),
+    ]
+    scan_windows = [(datetime.time(10, 0, 0), datetime.time(23, 0, 0))]
+
+    return [
+        Job("bars:1d", scanner_handler_day, windows=fetch_windows),
+        Job(
+            "bars:1m",
+            scanner_handler_minutes,
+            (FrameType.MIN1, False),
+            windows=fetch_windows,
+        ),
+        # 周线和月线由日线合成，不消耗quota
+        Job("bars:1w", week_download_handler, windows=fetch_windows, need_quota=False),
+        Job("bars:1M", month_download_handler, windows=fetch_windows, need_quota=False),
+        Job("reverse_scan", reverse_scanner_handler, (0,), windows=scan_windows),
+        Job(
+            "local_scan", local_scanner_handler, windows=scan_windows, need_quota=False
+        ),
+    ]
+
+
 class Omega(object):
     def __init__(self, fetcher_impl: str, **kwargs):
         self.fetcher_impl = fetcher_impl
         self.params = kwargs
 
-    async def init(self, *args):
-        logger.info("init %s", self.__class__.__name__)
-
+    async def init_omicron(self):
         await omicron.cache.init()
+        # redis为空或者响应太慢时，先从本地快照恢复交易日历和证券列表
+        await warm_start()
         try:
             await omicron.init()
         except Exception as e:
@@ -92,6 +126,33 @@ class Omega(object):
             time.sleep(5)
             os._exit(1)
 
+        await refresh_snapshot()
+
+    async def serve(self):
+        # 常驻运行，由调度器按时间段和quota启动各个任务，收到SIGINT/SIGTERM后退出
+        logger.info("serve %s", self.__class__.__name__)
+        await self.init_omicron()
+
+        await AbstractQuotesFetcher.create_instance(self.fetcher_impl, **self.params)
+
+        scheduler = Scheduler()
+        for job in get_scheduled_jobs():
+            scheduler.register(job)
+
+        loop = asyncio.get_event_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, request_shutdown)
+
+        await scheduler.run()
+
+        logger.info("all jobs stopped.")
+        await omicron.close()
+
+    async def init(self, *args):
+        logger.info("init %s", self.__class__.__name__)
+
+        await self.init_omicron()
+
         logger.info("<<< init %s process done", self.__class__.__name__)
 
         try:
@@ -104,7 +165,7 @@ class Omega(object):
             # await remove_sec_in_bars1d("000985.XSHG", datetime.date(2022,1,1), datetime.date(2023,3,1))
 
             # pack history data into pickle file
-            await pack_data_from_db()
+            await run_job_with_report("pack_data", pack_data_from_db)
 
             # await AbstractQuotesFetcher.create_instance(self.fetcher_impl, **self.params)
 
@@ -120,7 +181,7 @@ class Omega(object):
             # await redownload_bars1d_for_target_day()
             # await redownload_bars_mins_for_target_day()
 
-            # await rebuild_minio_for_min()
+            # await run_job_with_report("rebuild_minio", rebuild_minio_for_min)
         except Exception as e:
             logger.exception(e)
             logger.info("failed to execution: %s", e)
@@ -152,7 +213,10 @@ def start():
     omega = Omega(impl, account=account, password=password)
 
     loop = asyncio.get_event_loop()
-    loop.run_until_complete(omega.init())
+    if len(sys.argv) > 1 and sys.argv[1] == "daemon":
+        loop.run_until_complete(omega.serve())
+    else:
+        loop.run_until_complete(omega.init())
     # loop.run_forever()
 
 
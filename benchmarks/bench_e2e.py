@@ -0,0 +1,148 @@
+"""端到端的基准测试：下载日线、全量校验、重建minio分钟线文件
+
+influxdb、redis、minio和远程行情服务都替换为进程内的替身（见fake_*.py），
+只需要本项目的依赖，不需要任何外部服务。
+
+用法（在项目根目录）:
+    python -m benchmarks.bench_e2e --date 2022-07-15 --latency 0.05
+"""
+import argparse
+import asyncio
+import datetime
+import logging
+import sys
+import time
+
+import arrow
+import cfg4py
+from coretypes import FrameType
+from omicron.models.stock import Stock
+from omicron.models.timeframe import TimeFrame
+
+from app import get_config_dir
+from benchmarks.fake_influx import install_fake_influx
+from benchmarks.fake_services import (
+    clear_universe_cache,
+    install_fake_cache,
+    install_memory_storage,
+    prime_universe_cache,
+)
+from fetchers.abstract_quotes_fetcher import AbstractQuotesFetcher
+
+logger = logging.getLogger(__name__)
+
+MINUTE_FRAMES = (
+    FrameType.MIN1,
+    FrameType.MIN5,
+    FrameType.MIN15,
+    FrameType.MIN30,
+    FrameType.MIN60,
+)
+
+
+async def init_services(args):
+    cfg4py.init(get_config_dir(), False)
+
+    # 交易日历使用omicron自带的离线数据
+    TimeFrame.service_degrade()
+
+    services = {
+        "influx": install_fake_influx(),
+        "cache": install_fake_cache(),
+        "dfs": install_memory_storage(),
+    }
+    services["fetcher"] = await AbstractQuotesFetcher.create_instance(
+        "benchmarks.fake_fetcher",
+        latency=args.latency,
+        error_rate=args.error_rate,
+        n_stocks=args.stocks,
+        n_indexes=args.indexes,
+    )
+    return services
+
+
+async def prepare_security_list(fetcher, target_date: datetime.date):
+    secs = await fetcher.get_security_list(target_date)
+    stocks = [x[0] for x in secs if x[5] == "stock"]
+    indexes = [x[0] for x in secs if x[5] == "index"]
+
+    clear_universe_cache()
+    prime_universe_cache(target_date, (stocks, indexes))
+    return stocks, indexes
+
+
+async def prepare_minute_bars(fetcher, secs, target_date: datetime.date):
+    # 校验和重建minio都读取库中的分钟线，先写入一天的数据
+    end = datetime.datetime.combine(target_date, datetime.time(15, 0))
+    for ft in MINUTE_FRAMES:
+        n_bars = 240 // int(ft.value[:-1])
+        for i in range(0, len(secs), 1000):
+            bars = await fetcher.get_bars_batch(secs[i : i + 1000], end, n_bars, ft)
+            await Stock.persist_bars(ft, bars)
+
+
+async def timed(results: dict, name: str, coro):
+    t0 = time.perf_counter()
+    rc = await coro
+    results[name] = {"seconds": time.perf_counter() - t0, "rc": rc}
+    logger.info("%-20s %9.3fs rc=%s", name, results[name]["seconds"], rc)
+    return rc
+
+
+async def run(args):
+    # 放在这里导入，保证cfg4py已经初始化
+    from datascan.validate_data_in_week import validate_data_all
+    from download_bars.get_days import retrieve_bars_1d
+    from rebuild_minio.build_min_data import generate_minio_for_min
+
+    services = await init_services(args)
+    fetcher = services["fetcher"]
+    target_date = arrow.get(args.date).date()
+
+    stocks, indexes = await prepare_security_list(fetcher, target_date)
+    await prepare_minute_bars(fetcher, stocks + indexes, target_date)
+
+    results = {}
+    await timed(
+        results,
+        "retrieve_bars_1d",
+        retrieve_bars_1d(target_date, stocks, indexes),
+    )
+    await timed(results, "validate_data_all", validate_data_all(target_date))
+    for ft in MINUTE_FRAMES:
+        await timed(
+            results,
+            f"rebuild_minio_{ft.value}",
+            generate_minio_for_min(target_date, ft),
+        )
+
+    logger.info(
+        "fetcher requests: %d, quota used: %d",
+        fetcher.requests,
+        fetcher.total - fetcher.spare,
+    )
+    logger.info("influx: %s", services["influx"].get_stats())
+    logger.info(
+        "dfs: %d files, %d bytes",
+        len(services["dfs"].files),
+        services["dfs"].bytes_written,
+    )
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="end-to-end benchmark with fakes")
+    parser.add_argument("--date", default="2022-07-15")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--stocks", type=int, default=5000)
+    parser.add_argument("--indexes", type=int, default=500)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    results = asyncio.run(run(args))
+    return 0 if all([x["rc"] for x in results.values()]) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,258 @@
+"""热点代码的基准测试，使用合成的全市场数据，不需要数据库和远程服务
+
+用法（在项目根目录）:
+    python -m benchmarks.bench_hot_paths             # 和基准比较，退化时返回1
+    python -m benchmarks.bench_hot_paths --save      # 保存为新的基准
+"""
+import argparse
+import json
+import logging
+import os
+import pickle
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from coretypes import FrameType
+
+from benchmarks.synthetic import generate_market_day
+from code_table import decode_codes, encode_codes
+from datascan.bars_resample import resample_bars
+from datascan.cross_frame_check import (
+    aggregate_minute_bars_to_day,
+    compare_bars_vectorized,
+)
+from datascan.scanner_utils import _compare_secs, compare_sec_data_full
+from pack_data.pack_bars import filter_secs
+from rebuild_minio.build_min_data import (
+    convert_data_format,
+    convert_data_format_for_line,
+)
+
+logger = logging.getLogger(__name__)
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+# 逐行处理的用例只取部分证券，吞吐量按行计算，和全量用例可以直接比较
+ROW_LOOP_SECS = 500
+
+
+def bench_compare_rows(market):
+    bars = market["bars_1d"]
+    other = bars.copy()
+    return len(bars), lambda: [compare_sec_data_full(x, y) for x, y in zip(bars, other)]
+
+
+def bench_compare_vectorized(market):
+    bars_1m = market["bars_1m"]
+    expected = resample_bars(bars_1m, FrameType.MIN5)
+    actual = {k: v.copy() for k, v in expected.items()}
+    rows = sum([len(x) for x in expected.values()])
+    return rows, lambda: compare_bars_vectorized(expected, actual)
+
+
+def bench_group_rows(market):
+    # build_min_data.get_security_minutes_bars中逐行按证券分组的方式
+    codes = market["stocks"][:ROW_LOOP_SECS]
+    records = market["records_1m"]
+    records = records[np.isin(records["code"], encode_codes(codes))]
+
+    rows = np.empty(
+        len(records),
+        dtype=[
+            ("frame", "O"),
+            ("code", "O"),
+            ("open", "f4"),
+            ("high", "f4"),
+            ("low", "f4"),
+            ("close", "f4"),
+            ("volume", "f8"),
+            ("amount", "f8"),
+            ("factor", "f4"),
+        ],
+    )
+    rows["frame"] = records["_time"].astype("datetime64[s]").tolist()
+    # influxdb返回的代码是字符串
+    rows["code"] = decode_codes(records["code"]).tolist()
+    for col in ("open", "high", "low", "close", "volume"):
+        rows[col] = records[col]
+    rows["amount"] = 0
+    rows["factor"] = 1.0
+
+    def run():
+        by_sec = {}
+        for sec_data in rows:
+            by_sec.setdefault(sec_data["code"], []).append(
+                convert_data_format_for_line(sec_data)
+            )
+        return {k: convert_data_format(v) for k, v in by_sec.items()}
+
+    return len(rows), run
+
+
+def bench_group_vectorized(market):
+    records = market["records_1m"]
+    order = np.argsort(records["code"], kind="stable")
+    data = records[order]
+
+    def run():
+        codes = data["code"]
+        splits = np.flatnonzero(codes[1:] != codes[:-1]) + 1
+        return dict(zip(codes[np.append(0, splits)], np.split(data, splits)))
+
+    return len(records), run
+
+
+def bench_pickle_dict(market):
+    bars_1m = market["bars_1m"]
+    rows = sum([len(x) for x in bars_1m.values()])
+    return rows, lambda: pickle.loads(pickle.dumps(bars_1m, protocol=4))
+
+
+def bench_pickle_packed(market):
+    packed = market["packed_1m"]
+    return len(packed), lambda: pickle.loads(pickle.dumps(packed, protocol=4))
+
+
+def bench_set_difference(market):
+    secs_in_db = set(market["stocks"] + market["indexes"])
+    secs_in_jq = set(list(secs_in_db)[100:])
+    return len(secs_in_db), lambda: _compare_secs(secs_in_db, secs_in_jq)
+
+
+def bench_filter_rows(market):
+    # pack_bars.generate_pickle_data中逐行过滤指数的方式
+    bars = market["bars_1d"]
+    all_index = set(market["indexes"])
+    whitelist = set(market["indexes"][:50])
+
+    def run():
+        return [x for x in bars if filter_secs(x["code"].item(), all_index, whitelist)]
+
+    return len(bars), run
+
+
+def bench_resample(market):
+    bars_1m = market["bars_1m"]
+    rows = sum([len(x) for x in bars_1m.values()])
+    return rows, lambda: resample_bars(bars_1m, FrameType.MIN5)
+
+
+def bench_aggregate_day(market):
+    bars_1m = market["bars_1m"]
+    rows = sum([len(x) for x in bars_1m.values()])
+    return rows, lambda: aggregate_minute_bars_to_day(bars_1m)
+
+
+CASES = {
+    "compare_rows": bench_compare_rows,
+    "compare_vectorized": bench_compare_vectorized,
+    "group_rows": bench_group_rows,
+    "group_vectorized": bench_group_vectorized,
+    "pickle_dict": bench_pickle_dict,
+    "pickle_packed": bench_pickle_packed,
+    "set_difference": bench_set_difference,
+    "filter_rows": bench_filter_rows,
+    "resample_5m": bench_resample,
+    "aggregate_1d": bench_aggregate_day,
+}
+
+
+def run_case(func, rows: int, repeat: int):
+    # 第一次运行记录内存峰值，之后取最快的一次计算吞吐量
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    elapsed = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        elapsed.append(time.perf_counter() - t0)
+
+    best = min(elapsed)
+    return {
+        "rows": rows,
+        "seconds": best,
+        "rows_per_sec": rows / best if best > 0 else 0.0,
+        "peak_mb": peak / 2**20,
+    }
+
+
+def run_benchmarks(names=None, repeat: int = 3):
+    market = generate_market_day()
+
+    results = {}
+    for name, case in CASES.items():
+        if names and name not in names:
+            continue
+
+        rows, func = case(market)
+        logging.disable(logging.ERROR)  # 比较函数会输出大量的不一致日志
+        try:
+            results[name] = run_case(func, rows, repeat)
+        finally:
+            logging.disable(logging.NOTSET)
+
+        logger.info(
+            "%-20s %10d rows %9.4fs %12.0f rows/s %8.1f MB",
+            name,
+            rows,
+            results[name]["seconds"],
+            results[name]["rows_per_sec"],
+            results[name]["peak_mb"],
+        )
+
+    return results
+
+
+def find_regressions(results: dict, baseline: dict, threshold: float):
+    # 耗时或者内存峰值比基准高出threshold（比例）以上的用例
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+
+        for key in ("seconds", "peak_mb"):
+            base = baseline[name][key]
+            if base > 0 and result[key] > base * (1 + threshold):
+                regressions.append((name, key, base, result[key]))
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="benchmark hot paths")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save", action="store_true", help="save results as baseline")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("cases", nargs="*", help=", ".join(CASES.keys()))
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    results = run_benchmarks(args.cases, args.repeat)
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        logger.info("baseline saved: %s", args.baseline)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        logger.info("no baseline found: %s", args.baseline)
+        return 0
+
+    with open(args.baseline, "r") as f:
+        baseline = json.load(f)
+
+    regressions = find_regressions(results, baseline, args.threshold)
+    for name, key, base, value in regressions:
+        logger.error("REGRESSION %s %s: %.4f -> %.4f", name, key, base, value)
+    return 1 if len(regressions) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+"""本地的行情服务替身，用合成数据模拟远程账号，用于端到端的基准测试
+
+和真实的实现一样通过AbstractQuotesFetcher.create_instance加载:
+    await AbstractQuotesFetcher.create_instance(
+        "benchmarks.fake_fetcher", latency=0.2, quota=1000 * 10000
+    )
+"""
+import asyncio
+import datetime
+import math
+import random
+import zlib
+from collections import OrderedDict
+from typing import Dict, List, Union
+
+import arrow
+import numpy as np
+from coretypes import Frame, FrameType
+from omicron.models.timeframe import TimeFrame
+
+from benchmarks.synthetic import generate_codes, generate_minute_bars
+from datascan.bars_resample import RESAMPLE_MINUTES, aggregate_day_bars, resample_bars
+from datascan.cross_frame_check import aggregate_minute_bars_to_day
+from fetchers.quotes_fetcher import QuotesFetcher
+
+security_list_dtype = [
+    ("code", "O"),
+    ("display_name", "O"),
+    ("name", "O"),
+    ("start_date", "O"),
+    ("end_date", "O"),
+    ("type", "O"),
+]
+
+price_limits_dtype = [
+    ("frame", "O"),
+    ("code", "O"),
+    ("high_limit", "f4"),
+    ("low_limit", "f4"),
+]
+
+
+class FakeQuotesFetcher(QuotesFetcher):
+    """返回确定的合成数据：同一只证券同一天的1分钟线总是相同的，其它周期都由1分钟线合成，
+    因此和本地的合成、校验逻辑结果一致
+
+    Args:
+        latency: 每次请求的延迟（秒）
+        quota: 账号的总quota，每次请求按n_bars * len(secs)扣除
+        error_rate: 请求随机失败的概率
+        n_stocks, n_indexes: 证券列表的大小
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.1,
+        quota: int = 2000 * 10000,
+        error_rate: float = 0.0,
+        n_stocks: int = 5000,
+        n_indexes: int = 500,
+        cache_days: int = 8,
+    ):
+        self.latency = latency
+        self.total = quota
+        self.spare = quota
+        self.error_rate = error_rate
+        self.stocks, self.indexes = generate_codes(n_stocks, n_indexes)
+        self.cache_days = cache_days
+        self._days = OrderedDict()
+        self.requests = 0
+
+    async def _request(self, cost: int):
+        await asyncio.sleep(self.latency)
+        self.requests += 1
+
+        if self.error_rate > 0 and random.random() < self.error_rate:
+            raise ConnectionError("fake fetcher: request failed")
+        if cost > self.spare:
+            raise ValueError("fake fetcher: quota exhausted")
+        self.spare -= cost
+
+    def _get_minutes(self, code: str, day: datetime.date) -> np.ndarray:
+        if day not in self._days:
+            self._days[day] = {}
+            if len(self._days) > self.cache_days:
+                self._days.popitem(last=False)
+
+        bars = self._days[day]
+        if code not in bars:
+            seed = zlib.crc32(f"{code}{day}".encode("utf-8"))
+            bars[code] = generate_minute_bars([code], day, seed)[code]
+        return bars[code]
+
+    def _get_days(self, code: str, days: List[datetime.date]) -> np.ndarray:
+        bars = aggregate_minute_bars_to_day(
+            {code: np.concatenate([self._get_minutes(code, d) for d in days])}
+        )
+        return bars[code]
+
+    def _get_bars(self, code: str, end: datetime.datetime, n_bars: int, ft: FrameType):
+        end_day = end.date()
+        if ft == FrameType.MIN1 or ft in RESAMPLE_MINUTES:
+            per_day = 240 // RESAMPLE_MINUTES.get(ft, 1)
+            days = TimeFrame.get_frames_by_count(
+                end_day, math.ceil(n_bars / per_day) + 1, FrameType.DAY
+            )
+            bars = {
+                code: np.concatenate(
+                    [self._get_minutes(code, TimeFrame.int2date(x)) for x in days]
+                )
+            }
+            if ft != FrameType.MIN1:
+                bars = resample_bars(bars, ft)
+            bars = bars[code]
+            bars = bars[bars["frame"] <= np.datetime64(end, "s")]
+        elif ft == FrameType.DAY:
+            days = TimeFrame.get_frames_by_count(end_day, n_bars, FrameType.DAY)
+            bars = self._get_days(code, [TimeFrame.int2date(x) for x in days])
+        else:
+            last = TimeFrame.ceiling(end_day, ft)
+            first = TimeFrame.get_frames_by_count(last, n_bars + 1, ft)[0]
+            days = TimeFrame.get_frames(
+                TimeFrame.int2date(first), end_day, FrameType.DAY
+            )
+            days = [TimeFrame.int2date(x) for x in days][1:]
+            daily = self._get_days(code, days)
+            bars = aggregate_day_bars({code: daily}, ft, end_day)[code]
+
+        return bars[-n_bars:]
+
+    async def get_quota(self):
+        await asyncio.sleep(self.latency)
+        return {"total": self.total, "spare": self.spare}
+
+    async def get_bars_batch(
+        self,
+        secs: List[str],
+        end: Frame,
+        n_bars: int,
+        frame_type: Union[FrameType, str],
+        include_unclosed=True,
+        fq_ref_enabled=False,
+    ) -> Dict[str, np.ndarray]:
+        await self._request(n_bars * len(secs))
+
+        ft = FrameType(getattr(frame_type, "value", frame_type))
+        end = arrow.get(end).naive
+        return {code: self._get_bars(code, end, n_bars, ft) for code in secs}
+
+    async def get_trade_price_limits(
+        self, sec: Union[List, str], dt: Union[str, Frame]
+    ) -> np.ndarray:
+        secs = [sec] if isinstance(sec, str) else list(sec)
+        await self._request(len(secs))
+
+        day = arrow.get(dt).date()
+        limits = np.empty(len(secs), dtype=price_limits_dtype)
+        for i, code in enumerate(secs):
+            open_ = self._get_minutes(code, day)["open"][0]
+            limits[i] = (day, code, round(open_ * 1.1, 2), round(open_ * 0.9, 2))
+        return limits
+
+    async def get_security_list(self, date: datetime.date = None) -> np.ndarray:
+        await self._request(0)
+
+        start = datetime.date(2005, 1, 4)
+        end = datetime.date(2200, 1, 1)
+        secs = [(x, x, x, start, end, "stock") for x in self.stocks]
+        secs.extend([(x, x, x, start, end, "index") for x in self.indexes])
+        return np.array(secs, dtype=security_list_dtype)
+
+
+async def create_instance(**kwargs):
+    # account/password等真实账号的参数忽略
+    params = {
+        k: v
+        for k, v in kwargs.items()
+        if k in ("latency", "quota", "error_rate", "n_stocks", "n_indexes")
+    }
+    return FakeQuotesFetcher(**params)
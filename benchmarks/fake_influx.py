@@ -0,0 +1,278 @@
+"""进程内的influxdb替身，支持本项目用到的Flux子集和save/delete，数据保存在内存中
+
+只解析omicron.dal.influx.flux.Flux生成的语句：range, _measurement/_field/tag过滤,
+pivot, group, count, sort, limit, tail。查询结果和influxdb一样返回CSV（带表头，
+没有annotation），可以直接交给DataframeDeserializer/NumpyDeserializer解析。
+"""
+import datetime
+import logging
+import re
+from typing import Dict, List, Union
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def parse_time(value) -> np.datetime64:
+    if isinstance(value, (datetime.datetime, datetime.date, np.datetime64)):
+        return np.datetime64(value, "ns")
+
+    value = str(value).strip().strip('"').rstrip("Z")
+    return np.datetime64(value, "ns")
+
+
+def parse_flux(flux: str) -> dict:
+    query = {
+        "start": None,
+        "stop": None,
+        "measurement": None,
+        "fields": None,
+        "exclude_fields": None,
+        "tags": {},
+        "pivot": False,
+        "group": None,
+        "count": False,
+        "sort": None,
+        "limit": None,
+        "tail": None,
+    }
+
+    for line in str(flux).splitlines():
+        line = line.strip()
+        if "range(" in line:
+            query["start"] = parse_time(re.search(r"start:\s*([^,\)]+)", line)[1])
+            stop = re.search(r"stop:\s*([^,\)]+)", line)
+            if stop is not None:
+                query["stop"] = parse_time(stop[1])
+        elif '"_measurement"' in line:
+            query["measurement"] = re.search(r'==\s*"([^"]*)"', line)[1]
+        elif '"_field"' in line:
+            fields = re.findall(r'r\["_field"\]\s*[!=]=\s*"([^"]*)"', line)
+            if "!=" in line:
+                query["exclude_fields"] = fields
+            else:
+                query["fields"] = fields
+        elif "filter(" in line:
+            for tag, value in re.findall(r'r\["([^"]+)"\]\s*==\s*"([^"]*)"', line):
+                query["tags"].setdefault(tag, []).append(value)
+        elif "pivot(" in line:
+            query["pivot"] = True
+        elif "group(" in line:
+            query["group"] = re.findall(r'"([^"]+)"', line)
+        elif "count(" in line:
+            query["count"] = True
+        elif "sort(" in line:
+            desc = re.search(r"desc:\s*true", line) is not None
+            query["sort"] = (re.findall(r'"([^"]+)"', line), desc)
+        elif "limit(" in line:
+            query["limit"] = int(re.search(r"n:\s*(\d+)", line)[1])
+        elif "tail(" in line:
+            query["tail"] = int(re.search(r"n:\s*(\d+)", line)[1])
+
+    return query
+
+
+class Measurement(object):
+    """一个measurement的数据，写入时只追加，查询前合并并按(tags, _time)去重
+
+    和influxdb一样，同一个点重复写入时后写的字段覆盖先写的，没有写的字段保留原值。
+    """
+
+    def __init__(self):
+        self.tag_keys = []
+        self.chunks = []
+        self._data = None
+
+    def append(self, df: pd.DataFrame, tag_keys: List[str]):
+        for tag in tag_keys:
+            if tag not in self.tag_keys:
+                self.tag_keys.append(tag)
+        self.chunks.append(df)
+        self._data = None
+
+    @property
+    def data(self) -> pd.DataFrame:
+        if self._data is None:
+            if len(self.chunks) == 0:
+                return pd.DataFrame(columns=["_time"] + self.tag_keys)
+
+            df = pd.concat(self.chunks, ignore_index=True)
+            for tag in self.tag_keys:
+                if tag not in df.columns:
+                    df[tag] = ""
+            keys = self.tag_keys + ["_time"]
+            self._data = df.groupby(keys, sort=True, as_index=False).last()
+            self.chunks = [self._data]
+        return self._data
+
+    @property
+    def field_keys(self):
+        return [x for x in self.data.columns if x not in self.tag_keys + ["_time"]]
+
+    def delete(self, mask: np.ndarray):
+        self._data = self.data[~mask].reset_index(drop=True)
+        self.chunks = [self._data]
+
+
+class FakeInfluxClient(object):
+    """和omicron的InfluxClient接口一致的内存实现（query, save, delete, drop_measurement）"""
+
+    def __init__(self, bucket: str = "zillionare"):
+        self._bucket = bucket
+        self.measurements: Dict[str, Measurement] = {}
+        self.stats = {"queries": 0, "rows_written": 0, "deletes": 0}
+
+    def _get(self, measurement: str) -> Measurement:
+        if measurement not in self.measurements:
+            self.measurements[measurement] = Measurement()
+        return self.measurements[measurement]
+
+    async def save(
+        self,
+        data: Union[np.ndarray, pd.DataFrame],
+        measurement: str = None,
+        tag_keys: List[str] = None,
+        time_key: str = None,
+        global_tags: Dict = None,
+        chunk_size: int = None,
+        **kwargs,
+    ):
+        df = pd.DataFrame(data) if isinstance(data, np.ndarray) else data.copy()
+        if len(df) == 0:
+            return
+
+        if time_key is not None:
+            df = df.rename(columns={time_key: "_time"})
+        df["_time"] = pd.to_datetime(df["_time"]).values.astype("datetime64[ns]")
+
+        tag_keys = list(tag_keys or [])
+        for tag, value in (global_tags or {}).items():
+            df[tag] = value
+            tag_keys.append(tag)
+        for tag in tag_keys:
+            df[tag] = df[tag].astype(str)
+
+        self._get(measurement).append(df, tag_keys)
+        self.stats["rows_written"] += len(df)
+
+    async def delete(
+        self,
+        measurement: str,
+        stop: Union[datetime.datetime, datetime.date, str],
+        tags: Dict[str, str] = None,
+        start: Union[datetime.datetime, datetime.date, str] = None,
+        precision: str = "s",
+    ):
+        if measurement not in self.measurements:
+            return
+
+        m = self.measurements[measurement]
+        df = m.data
+        t = df["_time"].values
+        mask = t <= parse_time(stop)
+        if start is not None:
+            mask &= t >= parse_time(start)
+        for tag, value in (tags or {}).items():
+            mask &= (df[tag] == str(value)).values
+
+        m.delete(mask)
+        self.stats["deletes"] += 1
+
+    async def drop_measurement(self, measurement: str):
+        self.measurements.pop(measurement, None)
+
+    async def query(self, flux, deserializer=None):
+        self.stats["queries"] += 1
+        result = self._execute(parse_flux(str(flux))).encode("utf-8")
+        if deserializer is None:
+            return result
+        return deserializer(result)
+
+    def _select(self, query: dict):
+        m = self.measurements.get(query["measurement"])
+        if m is None or len(m.data) == 0:
+            return None, [], []
+
+        df = m.data
+        mask = np.ones(len(df), dtype=bool)
+        t = df["_time"].values
+        if query["start"] is not None:
+            mask &= t >= query["start"]
+        if query["stop"] is not None:
+            mask &= t < query["stop"]
+        for tag, values in query["tags"].items():
+            if tag not in df.columns:
+                return None, [], []
+            mask &= df[tag].isin(values).values
+
+        fields = m.field_keys
+        if query["fields"] is not None:
+            fields = [x for x in fields if x in query["fields"]]
+        if query["exclude_fields"] is not None:
+            fields = [x for x in fields if x not in query["exclude_fields"]]
+
+        df = df.loc[mask, ["_time"] + m.tag_keys + fields]
+        df = df[df[fields].notna().any(axis=1)]
+        return df, m.tag_keys, fields
+
+    def _execute(self, query: dict) -> str:
+        df, tag_keys, fields = self._select(query)
+        if df is None or len(df) == 0 or len(fields) == 0:
+            return "\r\n"
+
+        if query["pivot"]:
+            table_keys = list(tag_keys)
+        else:
+            # 没有pivot时每个字段是单独的一行
+            df = df.melt(
+                id_vars=["_time"] + tag_keys,
+                value_vars=fields,
+                var_name="_field",
+                value_name="_value",
+            ).dropna(subset=["_value"])
+            table_keys = tag_keys + ["_field"]
+
+        if query["group"] is not None:
+            table_keys = query["group"]
+
+        if query["count"]:
+            df = df.groupby(table_keys, sort=True).size().reset_index(name="_value")
+        else:
+            df = df.sort_values(table_keys + ["_time"], kind="stable")
+            if query["sort"] is not None:
+                columns, desc = query["sort"]
+                df = df.sort_values(
+                    table_keys + columns, ascending=not desc, kind="stable"
+                )
+            if query["limit"] is not None:
+                df = df.groupby(table_keys, sort=False).head(query["limit"])
+            if query["tail"] is not None:
+                df = df.groupby(table_keys, sort=False).tail(query["tail"])
+            df = df.copy()
+            df["_time"] = pd.to_datetime(df["_time"]).dt.strftime(TIME_FORMAT)
+
+        if len(df) == 0:
+            return "\r\n"
+
+        df.insert(0, "table", df.groupby(table_keys, sort=False).ngroup().values)
+        df.insert(0, "result", "_result")
+        df.insert(0, "", "")
+        return df.to_csv(index=False, lineterminator="\r\n") + "\r\n"
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats["measurements"] = {k: len(v.data) for k, v in self.measurements.items()}
+        return stats
+
+
+def install_fake_influx(client: FakeInfluxClient = None):
+    """替换omicron.models中的influx客户端，之后get_influx_client()返回这个替身"""
+    import omicron.models
+
+    client = client or FakeInfluxClient()
+    omicron.models._influx_client = client
+    return client
@@ -0,0 +1,189 @@
+"""redis缓存和minio的进程内替身，只实现本项目用到的命令"""
+import asyncio
+import datetime
+import logging
+from collections import defaultdict
+from typing import Tuple
+
+from omicron.dal.cache import cache
+
+import dfs
+from influx_data import security_list
+
+logger = logging.getLogger(__name__)
+
+
+def _str(value):
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    return str(value)
+
+
+class FakePipeline(object):
+    """单进程内没有并发写入，watch之后的命令直接执行，multi之后的命令缓存到execute"""
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+        self.immediate = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.commands = []
+
+    async def watch(self, *keys):
+        self.immediate = True
+
+    def multi(self):
+        self.immediate = False
+
+    def __getattr__(self, name):
+        func = getattr(self.redis, name)
+        if self.immediate:
+            return func
+
+        def add(*args, **kwargs):
+            self.commands.append((func, args, kwargs))
+            return self
+
+        return add
+
+    async def execute(self):
+        results = [await func(*args, **kwargs) for func, args, kwargs in self.commands]
+        self.commands = []
+        return results
+
+
+class FakeRedis(object):
+    """aioredis的子集，值都按字符串保存（和decode_responses=True一致）"""
+
+    def __init__(self):
+        self.values = {}
+        self.hashes = defaultdict(dict)
+        self.lists = defaultdict(list)
+        self.sets = defaultdict(set)
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def set(self, key, value, **kwargs):
+        self.values[key] = _str(value)
+        return True
+
+    async def delete(self, *keys):
+        n = 0
+        for key in keys:
+            for store in (self.values, self.hashes, self.lists, self.sets):
+                if key in store:
+                    del store[key]
+                    n += 1
+        return n
+
+    async def incr(self, key, amount: int = 1):
+        value = int(self.values.get(key, 0)) + amount
+        self.values[key] = str(value)
+        return value
+
+    async def hget(self, key, field):
+        return self.hashes.get(key, {}).get(_str(field))
+
+    async def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+    async def hset(self, key, field=None, value=None, mapping=None):
+        items = dict(mapping or {})
+        if field is not None:
+            items[field] = value
+        for k, v in items.items():
+            self.hashes[key][_str(k)] = _str(v)
+        return len(items)
+
+    async def hsetnx(self, key, field, value):
+        if _str(field) in self.hashes[key]:
+            return 0
+        self.hashes[key][_str(field)] = _str(value)
+        return 1
+
+    async def lpush(self, key, *values):
+        for value in values:
+            self.lists[key].insert(0, _str(value))
+        return len(self.lists[key])
+
+    async def lrange(self, key, start: int, end: int):
+        items = self.lists.get(key, [])
+        end = len(items) if end == -1 else end + 1
+        return items[start:end]
+
+    async def ltrim(self, key, start: int, end: int):
+        items = self.lists.get(key, [])
+        end = len(items) if end == -1 else end + 1
+        self.lists[key] = items[start:end]
+        return True
+
+    async def sadd(self, key, *values):
+        n = len(self.sets[key])
+        self.sets[key].update([_str(x) for x in values])
+        return len(self.sets[key]) - n
+
+    async def smembers(self, key):
+        return set(self.sets.get(key, set()))
+
+    def pipeline(self, transaction: bool = True):
+        return FakePipeline(self)
+
+
+class MemoryStorage(dfs.AbstractStorage):
+    """文件保存在内存中的dfs，统计写入的文件数和字节数"""
+
+    def __init__(self):
+        self.files = {}
+        self.bytes_written = 0
+
+    async def write(self, filename: str, bar: bytes):
+        await asyncio.sleep(0)
+        self.files[filename] = bytes(bar)
+        self.bytes_written += len(bar)
+        return True
+
+    async def read(self, filename: str):
+        return self.files.get(filename)
+
+    async def delete(self, filename: str):
+        self.files.pop(filename, None)
+        return True
+
+    async def delete_bucket(self):
+        self.files.clear()
+
+
+def install_fake_cache():
+    # 各个redis库共用一个替身即可，本项目的key不会冲突
+    redis = FakeRedis()
+    for name in ("sys", "security", "temp", "feature"):
+        setattr(cache, name, redis)
+    return redis
+
+
+def install_memory_storage():
+    storage = MemoryStorage()
+    dfs.Storage._Storage__instance = storage
+    return storage
+
+
+def prime_universe_cache(
+    target_date: datetime.date, universe: tuple, types: Tuple[str] = ("stock", "index")
+):
+    """直接写入某一天的证券列表，之后的查询不再访问数据库"""
+    key = (target_date, tuple(types))
+    security_list._universe_cache[key] = tuple([frozenset(x) for x in universe])
+    security_list._universe_cache.move_to_end(key)
+    if len(security_list._universe_cache) > security_list.UNIVERSE_CACHE_SIZE:
+        security_list._universe_cache.popitem(last=False)
+
+
+def clear_universe_cache():
+    security_list._universe_cache.clear()
+    security_list._universe_stats["hits"] = 0
+    security_list._universe_stats["misses"] = 0
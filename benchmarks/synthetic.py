@@ -0,0 +1,120 @@
+import datetime
+from typing import Dict, List
+
+import numpy as np
+from coretypes import bars_dtype
+
+from code_table import encode_codes
+from datascan.minute_check import my_bars_dtype
+from pack_data.pack_bars import dtype_bars_day, dtype_bars_min
+
+N_STOCKS = 5000
+N_INDEXES = 500
+
+
+def generate_codes(n_stocks: int = N_STOCKS, n_indexes: int = N_INDEXES):
+    """生成证券代码，股票按沪深两市各一半，指数放在上交所000xxx"""
+    half = n_stocks // 2
+    stocks = [f"{600000 + i:06d}.XSHG" for i in range(half)]
+    stocks.extend([f"{i + 1:06d}.XSHE" for i in range(n_stocks - half)])
+    indexes = [f"{i + 1:06d}.XSHG" for i in range(n_indexes)]
+    return stocks, indexes
+
+
+def get_minute_frames(dt: datetime.date):
+    # 9:31-11:30, 13:01-15:00，共240个
+    d = np.datetime64(dt, "m")
+    morning = d + np.arange(571, 691).astype("timedelta64[m]")
+    afternoon = d + np.arange(781, 901).astype("timedelta64[m]")
+    return np.concatenate([morning, afternoon]).astype("datetime64[s]")
+
+
+def generate_minute_bars(
+    codes: List[str], dt: datetime.date, seed: int = 78
+) -> Dict[str, np.ndarray]:
+    """每只证券240根1分钟线，价格为随机游走，和jq_fetcher的返回格式相同"""
+    rng = np.random.default_rng(seed)
+    frames = get_minute_frames(dt)
+    n = len(frames)
+
+    result = {}
+    for code in codes:
+        close = rng.uniform(3, 100) * np.exp(np.cumsum(rng.normal(0, 1e-3, n)))
+        open_ = np.append(close[0], close[:-1])
+        spread = np.abs(rng.normal(0, 2e-3, n)) * close
+
+        bars = np.empty(n, dtype=bars_dtype)
+        bars["frame"] = frames
+        bars["open"] = np.round(open_, 2)
+        bars["close"] = np.round(close, 2)
+        bars["high"] = np.round(np.maximum(open_, close) + spread, 2)
+        bars["low"] = np.round(np.minimum(open_, close) - spread, 2)
+        bars["volume"] = rng.integers(100, 100000, n) * 100
+        bars["amount"] = bars["volume"] * bars["close"]
+        bars["factor"] = 1.0
+        result[code] = bars
+
+    return result
+
+
+def generate_day_bars(codes: List[str], dt: datetime.date, seed: int = 78):
+    """日线和涨跌停价格，dtype_bars_day格式（pack_bars使用的整数代码）"""
+    rng = np.random.default_rng(seed)
+    n = len(codes)
+
+    bars = np.empty(n, dtype=dtype_bars_day)
+    close = np.round(rng.uniform(3, 100, n), 2)
+    bars["frame"] = np.datetime64(dt, "s")
+    bars["code"] = encode_codes(codes)
+    bars["open"] = np.round(close * rng.uniform(0.95, 1.05, n), 2)
+    bars["close"] = close
+    bars["high"] = np.maximum(bars["open"], close) * 1.01
+    bars["low"] = np.minimum(bars["open"], close) * 0.99
+    bars["high_limit"] = np.round(close * 1.1, 2)
+    bars["low_limit"] = np.round(close * 0.9, 2)
+    bars["volume"] = rng.integers(1000, 10000000, n) * 100
+    bars["amount"] = bars["volume"] * close
+    bars["factor"] = 1.0
+    return bars
+
+
+def to_packed_minutes(bars: Dict[str, np.ndarray]):
+    """{code: bars_dtype} -> dtype_bars_min数组（pack_bars的存档格式）"""
+    codes = list(bars.keys())
+    data = np.concatenate([bars[code] for code in codes])
+
+    result = np.empty(len(data), dtype=dtype_bars_min)
+    result["code"] = np.repeat(encode_codes(codes), [len(bars[x]) for x in codes])
+    for col in ("frame", "open", "high", "low", "close", "volume", "amount", "factor"):
+        result[col] = data[col]
+    return result
+
+
+def to_db_records(bars: Dict[str, np.ndarray]):
+    """{code: bars_dtype} -> my_bars_dtype数组（influxdb查询结果的格式）"""
+    codes = list(bars.keys())
+    data = np.concatenate([bars[code] for code in codes])
+
+    result = np.empty(len(data), dtype=my_bars_dtype)
+    result["_time"] = data["frame"]
+    result["code"] = np.repeat(encode_codes(codes), [len(bars[x]) for x in codes])
+    for col in ("open", "high", "low", "close", "volume"):
+        result[col] = data[col]
+    return result
+
+
+def generate_market_day(dt: datetime.date = datetime.date(2022, 7, 15)):
+    """一个交易日的全市场数据"""
+    stocks, indexes = generate_codes()
+    codes = stocks + indexes
+    bars_1m = generate_minute_bars(codes, dt)
+
+    return {
+        "dt": dt,
+        "stocks": stocks,
+        "indexes": indexes,
+        "bars_1m": bars_1m,
+        "bars_1d": generate_day_bars(codes, dt),
+        "packed_1m": to_packed_minutes(bars_1m),
+        "records_1m": to_db_records(bars_1m),
+    }
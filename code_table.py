@@ -0,0 +1,111 @@
+"""证券代码和int32编号的互相转换，以及按编号做的集合运算
+
+编号和pack_data中的存档格式一致：深市为1开头，沪市为2开头，后面是6位代码，
+比如000001.XSHE -> 1000001，600000.XSHG -> 2600000。编号由代码本身决定，不依赖
+加载顺序，不同进程、不同日期的数据可以直接比较。
+
+集合运算的输入输出都是排好序、去重后的int32数组（to_ids的结果）。
+"""
+import logging
+from typing import Iterable
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EXCHANGE_BASE = {"XSHE": 1_000_000, "XSHG": 2_000_000}
+EXCHANGE_NAMES = {1: "XSHE", 2: "XSHG"}
+
+ID_DTYPE = np.int32
+
+
+def encode_code(code: str) -> int:
+    items = code.split(".")
+    if len(items) != 2 or items[1] not in EXCHANGE_BASE:
+        raise ValueError("unknown exchange: %s" % code)
+    return EXCHANGE_BASE[items[1]] + int(items[0])
+
+
+def decode_code(code_id: int) -> str:
+    return "%06d.%s" % (code_id % 1_000_000, EXCHANGE_NAMES[code_id // 1_000_000])
+
+
+def encode_codes(codes: Iterable[str]) -> np.ndarray:
+    """批量转换，codes可以是列表、集合或者object/str数组"""
+    if isinstance(codes, (set, frozenset)):
+        codes = list(codes)
+    codes = np.asarray(codes, dtype="U11")
+    if codes.size == 0:
+        return np.array([], dtype=ID_DTYPE)
+
+    is_xshe = np.char.endswith(codes, ".XSHE")
+    is_xshg = np.char.endswith(codes, ".XSHG")
+    unknown = ~(is_xshe | is_xshg)
+    if np.any(unknown):
+        raise ValueError("unknown exchange: %s" % codes[unknown][:5].tolist())
+
+    # U11截断为U6即得到数字部分
+    numbers = codes.astype("U6").astype(ID_DTYPE)
+    base = np.where(is_xshe, EXCHANGE_BASE["XSHE"], EXCHANGE_BASE["XSHG"])
+    return (numbers + base).astype(ID_DTYPE)
+
+
+def decode_codes(code_ids: np.ndarray) -> np.ndarray:
+    code_ids = np.asarray(code_ids, dtype=ID_DTYPE)
+    if code_ids.size == 0:
+        return np.array([], dtype="U11")
+
+    numbers = np.char.zfill((code_ids % 1_000_000).astype("U6"), 6)
+    suffix = np.where(code_ids // 1_000_000 == 1, ".XSHE", ".XSHG")
+    return np.char.add(numbers, suffix)
+
+
+def to_ids(codes) -> np.ndarray:
+    """代码（或者编号）转为排序去重后的编号数组"""
+    if isinstance(codes, np.ndarray) and codes.dtype.kind in "iu":
+        return np.unique(codes.astype(ID_DTYPE))
+    return np.unique(encode_codes(codes))
+
+
+def difference(ids: np.ndarray, *others: np.ndarray) -> np.ndarray:
+    """在ids中，但不在others任何一个中的编号"""
+    for other in others:
+        ids = np.setdiff1d(ids, other, assume_unique=True)
+    return ids
+
+
+def intersect(ids: np.ndarray, other: np.ndarray) -> np.ndarray:
+    return np.intersect1d(ids, other, assume_unique=True)
+
+
+def union(*ids: np.ndarray) -> np.ndarray:
+    if len(ids) == 0:
+        return np.array([], dtype=ID_DTYPE)
+    return np.unique(np.concatenate(ids)).astype(ID_DTYPE)
+
+
+def contains(ids: np.ndarray, universe: np.ndarray) -> np.ndarray:
+    """ids中每个编号是否在universe中，返回bool数组"""
+    return np.isin(ids, universe, assume_unique=True)
+
+
+def code_difference(codes, *others) -> np.ndarray:
+    """在codes中，但不在others任何一个中的证券代码（排序后的str数组）
+
+    代码集合转换一次编号后做数组运算，替代set.difference的逐个比较。有未知交易所的
+    代码时退回set.difference，未知代码和原来一样作为差异返回，不中断扫描。
+    """
+    try:
+        result = difference(to_ids(codes), *[to_ids(x) for x in others])
+    except ValueError as e:
+        logger.warning("%s, fall back to set difference", e)
+        result = _to_code_set(codes).difference(*[_to_code_set(x) for x in others])
+        return np.array(sorted(result), dtype=str)
+
+    return decode_codes(result)
+
+
+def _to_code_set(codes) -> set:
+    if isinstance(codes, np.ndarray) and codes.dtype.kind in "iu":
+        return set(decode_codes(codes).tolist())
+    return set(codes)
@@ -12,13 +12,16 @@ from omicron.models.timeframe import TimeFrame
 from omicron.models.timeframe import TimeFrame as tf
 from sqlalchemy import true
 
-from datascan.jq_fetcher import get_sec_bars_min
+from datascan.bars_resample import get_sec_bars_min_local_first
 from dfs_tools import write_bars_dfs
+from download_bars.gap_refetch import repair_minute_gaps
 from fetchers.abstract_quotes_fetcher import AbstractQuotesFetcher
+from influx_data.bars_coverage import BarsCoverage
 from influx_data.security_bars_1d import get_security_day_bars
 from influx_data.security_bars_1m import get_security_minutes_data
 from influx_tools import remove_sec_in_bars_min
 from rebuild_minio.build_min_data import generate_minio_for_min
+from tracing import span
 
 logger = logging.getLogger(__name__)
 
@@ -30,7 +33,8 @@ async def get_min_data_from_jq(
     prefix: SecurityType,
 ):
     # download all data from jq
-    all_secs_data = await get_sec_bars_min(all_secs_today, target_date, ft)
+    # 1分钟线先下载，其它周期优先用1分钟线合成
+    all_secs_data = await get_sec_bars_min_local_first(all_secs_today, target_date, ft)
     logger.info(
         "total secs downloaded from bars:%s@jq, %d, %s",
         ft.value,
@@ -42,7 +46,9 @@ async def get_min_data_from_jq(
         logger.info("no valid price data from bars:%s@jq, %s", ft.value, target_date)
         return True
 
-    await Stock.persist_bars(ft, all_secs_data)
+    with span("persist_bars", rows=sum([len(x) for x in all_secs_data.values()])):
+        await Stock.persist_bars(ft, all_secs_data)
+    await BarsCoverage.update(target_date, ft, all_secs_data)
     logger.info(
         "get from bars:%s@jq and saved into db, %d",
         ft.value,
@@ -67,8 +73,18 @@ async def redownload_bars_mins_for_target_day():
         FrameType.MIN30,
         FrameType.MIN60,
     ):
-        # 下载全部分钟线数据
-        if len(all_stocks) > 0:
+        # 1分钟线只补齐缺失的时间段，其它周期优先用1分钟线合成
+        if ft == FrameType.MIN1:
+            remaining = await repair_minute_gaps(
+                all_stocks | all_indexes, target_day, ft
+            )
+            if len(remaining) > 0:
+                logger.error(
+                    "bars:%s, secs still incomplete after refetch: %s",
+                    ft.value,
+                    remaining,
+                )
+        elif len(all_stocks) > 0:
             rc = await get_min_data_from_jq(
                 all_stocks, target_day, ft, SecurityType.STOCK
             )
@@ -78,7 +94,7 @@ async def redownload_bars_mins_for_target_day():
                 )
                 return False
 
-        if len(all_indexes) > 0:
+        if ft != FrameType.MIN1 and len(all_indexes) > 0:
             rc = await get_min_data_from_jq(
                 all_indexes, target_day, ft, SecurityType.INDEX
             )
@@ -5,10 +5,11 @@ from coretypes import FrameType, SecurityType
 from omicron.models.stock import Stock
 from omicron.models.timeframe import TimeFrame
 
-from datascan.jq_fetcher import get_sec_bars_1w
+from datascan.bars_resample import get_sec_bars_period_local
 from dfs_tools import write_bars_dfs
-from influx_data.security_list import get_security_list
-from time_utils import split_securities
+from download_bars.get_week_month import get_period_universe
+from influx_data.bars_coverage import BarsCoverage
+from tracing import span
 
 logger = logging.getLogger(__name__)
 
@@ -18,21 +19,25 @@ async def get_1w_for_price(
 ):
     # d0: 本周第一天, target_date：本周最后一天
 
-    # download all data from jq
-    all_secs_data = await get_sec_bars_1w(all_secs_today, target_date, d0)
+    # 用数据库中的日线合成
+    all_secs_data = await get_sec_bars_period_local(
+        all_secs_today, target_date, d0, FrameType.WEEK
+    )
     logger.info(
-        "total secs downloaded from bars:1w@jq, %d, %s", len(all_secs_data), prefix
+        "total secs aggregated into bars:1w, %d, %s", len(all_secs_data), prefix
     )
 
     if len(all_secs_data) == 0:
         logger.error(
-            "failed to get price data from bars:1w@jq, %s (%s)", target_date, prefix
+            "failed to aggregate price data for bars:1w, %s (%s)", target_date, prefix
         )
         return False
 
-    await Stock.persist_bars(FrameType.WEEK, all_secs_data)
+    with span("persist_bars", rows=sum([len(x) for x in all_secs_data.values()])):
+        await Stock.persist_bars(FrameType.WEEK, all_secs_data)
+    await BarsCoverage.update(target_date, FrameType.WEEK, all_secs_data)
     logger.info(
-        "get from bars:1w@jq and saved into db, %s, %s, %d",
+        "aggregated bars:1w and saved into db, %s, %s, %d",
         prefix,
         FrameType.WEEK,
         len(all_secs_data),
@@ -52,32 +57,16 @@ async def redownload_bars1w_for_target_day():
     w1d0 = TimeFrame.day_shift(w0, 1)
     logger.info("first and last day of week: %s, %s", w1d0, target_day)
 
-    all_secs_in_w1d0 = await get_security_list(w1d0)
-    if all_secs_in_w1d0 is None:
-        logger.error("no security list in date %s", w1d0)
-        return False
-    all_secs_0, all_indexes_0 = split_securities(all_secs_in_w1d0)
-    if (all_secs_0 is None or len(all_secs_0) == 0) or (
-        all_indexes_0 is None or len(all_indexes_0) == 0
-    ):
-        logger.error("no security list (stock or index) in date %s", w1d0)
-        return False
-
-    all_secs_in_w1d1 = await get_security_list(target_day)
-    if all_secs_in_w1d1 is None:
-        logger.error("no security list in date %s", target_day)
+    # 本周任何一天处于上市状态的证券
+    universe = await get_period_universe(w1d0, target_day)
+    if universe is None:
+        logger.error("no security list in date %s, %s", w1d0, target_day)
         return False
-    all_secs_1, all_indexes_1 = split_securities(all_secs_in_w1d1)
-    if (all_secs_1 is None or len(all_secs_1) == 0) or (
-        all_indexes_1 is None or len(all_indexes_1) == 0
-    ):
+    all_stock, all_index = universe
+    if len(all_stock) == 0 or len(all_index) == 0:
         logger.error("no security list (stock or index) in date %s", w1d0)
         return False
 
-    # 合并本周第一天和最后一天的证券列表（不用判断两天是否为同一天）
-    all_stock = all_secs_0.union(all_secs_1)
-    all_index = all_indexes_0.union(all_indexes_1)
-
     rc = await get_1w_for_price(all_stock, target_day, w1d0, SecurityType.STOCK)
     if not rc:
         logger.error("failed to process stock price data (week): %s", target_day)
@@ -0,0 +1,317 @@
+import datetime
+import logging
+import random
+from typing import Dict, List
+
+import numpy as np
+from coretypes import FrameType, bars_dtype
+from omicron.dal.influx.flux import Flux
+from omicron.dal.influx.serialize import DataframeDeserializer
+from omicron.models import get_influx_client
+from omicron.models.timeframe import TimeFrame
+
+from datascan.jq_fetcher import get_sec_bars_min
+from influx_data.security_bars_1m import get_expected_bars_count
+from tracing import traced_deserialize, traced_query
+
+logger = logging.getLogger(__name__)
+
+RESAMPLE_MINUTES = {
+    FrameType.MIN5: 5,
+    FrameType.MIN15: 15,
+    FrameType.MIN30: 30,
+    FrameType.MIN60: 60,
+}
+
+
+def get_session_position(frames: np.ndarray):
+    # 1分钟线在当天的序号，9:31 -> 0, 11:30 -> 119, 13:01 -> 120, 15:00 -> 239
+    _frames = frames.astype("datetime64[m]")
+    minutes = (_frames - _frames.astype("datetime64[D]")).astype(int)
+    return np.where(minutes <= 690, minutes - 571, minutes - 781 + 120)
+
+
+def get_session_minutes(position: np.ndarray):
+    # get_session_position的逆运算，返回距离0点的分钟数
+    return np.where(position < 120, position + 571, position - 120 + 781)
+
+
+def resample_bars(bars: Dict[str, np.ndarray], ft: FrameType) -> Dict[str, np.ndarray]:
+    """用1分钟线合成5m/15m/30m/60m的分钟线
+
+    所有证券的数据合并后一次完成分组计算。分组不跨越11:30和15:00的收盘，
+    每根bar的时间取分组的结束时间（和远程服务一致，不管最后一分钟是否有数据）。
+
+    Args:
+        bars: {code: bars_dtype数组}，可以包含多天的数据
+        ft: 目标周期
+
+    Returns:
+        {code: bars_dtype数组}
+    """
+    if ft not in RESAMPLE_MINUTES:
+        raise ValueError("FrameType not supported, %s" % ft)
+    n = RESAMPLE_MINUTES[ft]
+
+    codes = [code for code in bars if len(bars[code]) > 0]
+    if len(codes) == 0:
+        return {}
+
+    data = np.concatenate([bars[code] for code in codes])
+    code_idx = np.repeat(np.arange(len(codes)), [len(bars[code]) for code in codes])
+
+    frames = data["frame"].astype("datetime64[m]")
+    order = np.lexsort((frames, code_idx))
+    data, code_idx, frames = data[order], code_idx[order], frames[order]
+
+    days = frames.astype("datetime64[D]")
+    group = get_session_position(frames) // n
+
+    # 同一天同一分组的bar合成一根，时间取分组的结束时间
+    end_minutes = get_session_minutes((group + 1) * n - 1)
+    end_frames = days + end_minutes.astype("timedelta64[m]")
+    return merge_bars(codes, data, code_idx, end_frames)
+
+
+def merge_bars(
+    codes: List[str], data: np.ndarray, code_idx: np.ndarray, end_frames: np.ndarray
+):
+    """data已经按(code_idx, frame)排序，相邻且code_idx和end_frames都相同的bar合成一根
+
+    Returns:
+        {code: bars_dtype数组}，合成后bar的时间为end_frames
+    """
+    change = np.ones(len(data), dtype=bool)
+    change[1:] = (code_idx[1:] != code_idx[:-1]) | (end_frames[1:] != end_frames[:-1])
+    starts = np.flatnonzero(change)
+    ends = np.append(starts[1:], len(data)) - 1
+
+    result = np.empty(len(starts), dtype=bars_dtype)
+    result["frame"] = end_frames[starts]
+    result["open"] = data["open"][starts]
+    result["high"] = np.fmax.reduceat(data["high"], starts)
+    result["low"] = np.fmin.reduceat(data["low"], starts)
+    result["close"] = data["close"][ends]
+    result["volume"] = np.add.reduceat(data["volume"], starts)
+    result["amount"] = np.add.reduceat(data["amount"], starts)
+    result["factor"] = data["factor"][ends]
+
+    result_codes = code_idx[starts]
+    splits = np.flatnonzero(result_codes[1:] != result_codes[:-1]) + 1
+    return {
+        codes[x[0]]: y
+        for x, y in zip(np.split(result_codes, splits), np.split(result, splits))
+    }
+
+
+def get_period_ends(days: np.ndarray, ft: FrameType, end: datetime.date = None):
+    """每个交易日所在周（月）的最后一个交易日，end之后的截止到end（当前周期还没结束）"""
+    unique_days, inverse = np.unique(days.astype("datetime64[D]"), return_inverse=True)
+    period_ends = np.array(
+        [TimeFrame.ceiling(x, ft) for x in unique_days.tolist()],
+        dtype="datetime64[D]",
+    )
+    if end is not None:
+        period_ends = np.minimum(period_ends, np.datetime64(end, "D"))
+
+    return period_ends[inverse]
+
+
+def aggregate_day_bars(
+    bars: Dict[str, np.ndarray], ft: FrameType, end: datetime.date = None
+) -> Dict[str, np.ndarray]:
+    """用日线合成周线和月线（不复权价格，factor取周期最后一天）
+
+    Args:
+        bars: {code: bars_dtype数组}，可以包含多个周期
+        ft: FrameType.WEEK或者FrameType.MONTH
+        end: 数据的截止日期，还没结束的周期以end为bar的时间
+
+    Returns:
+        {code: bars_dtype数组}，bar的时间为周期的最后一个交易日
+    """
+    if ft not in (FrameType.WEEK, FrameType.MONTH):
+        raise ValueError("FrameType not supported, %s" % ft)
+
+    codes = [code for code in bars if len(bars[code]) > 0]
+    if len(codes) == 0:
+        return {}
+
+    data = np.concatenate([bars[code] for code in codes])
+    code_idx = np.repeat(np.arange(len(codes)), [len(bars[code]) for code in codes])
+
+    days = data["frame"].astype("datetime64[D]")
+    order = np.lexsort((days, code_idx))
+    data, code_idx, days = data[order], code_idx[order], days[order]
+
+    return merge_bars(codes, data, code_idx, get_period_ends(days, ft, end))
+
+
+async def get_sec_bars_period_local(
+    secs_set: set, dt: datetime.date, d0: datetime.date, ft: FrameType
+):
+    """用数据库中[d0, dt]之间的日线合成周线（月线），不需要远程下载
+
+    d0: 周期第一天, dt: 周期最后一天（或者当前日期）
+    """
+    bars_1d = await get_security_day_full_bars(
+        secs_set,
+        datetime.datetime.combine(d0, datetime.time(0, 0, 0)),
+        datetime.datetime.combine(dt, datetime.time(23, 59, 59)),
+    )
+    return aggregate_day_bars(bars_1d, ft, dt)
+
+
+async def get_security_full_bars(
+    ft: FrameType,
+    start: datetime.datetime,
+    end: datetime.datetime,
+    codes: List[str] = None,
+):
+    """从数据库读取[start, end]之间的行情数据，codes为None时读取全部证券
+
+    Returns:
+        {code: bars_dtype数组}
+    """
+    client = get_influx_client()
+
+    flux = (
+        Flux()
+        .measurement("stock_bars_%s" % ft.value)
+        .range(start, end)
+        .bucket(client._bucket)
+        .fields(["open", "high", "low", "close", "volume", "amount", "factor"])
+    )
+    if codes is not None:
+        flux.tags({"code": list(codes)})
+
+    data = await traced_query(client, flux)
+    return deserialize_bars(data)
+
+
+async def get_security_minutes_full_bars(
+    codes: List[str], target_date: datetime.date, ft: FrameType = FrameType.MIN1
+):
+    # 当天的分钟线
+    _start = datetime.datetime.combine(target_date, datetime.time(9, 30, 0))
+    _end = datetime.datetime.combine(target_date, datetime.time(15, 0, 1))
+    return await get_security_full_bars(ft, _start, _end, codes)
+
+
+async def get_security_day_full_bars(
+    codes: List[str], start: datetime.datetime, end: datetime.datetime
+):
+    return await get_security_full_bars(FrameType.DAY, start, end, codes)
+
+
+def deserialize_bars(data) -> Dict[str, np.ndarray]:
+    # 查询结果转换成{code: bars_dtype数组}，每只证券按时间排序
+    if len(data) == 2:  # \r\n
+        return {}
+
+    cols = ["open", "high", "low", "close", "volume", "amount", "factor"]
+    ds = DataframeDeserializer(
+        sort_values=["code", "_time"],
+        usecols=["_time", "code"] + cols,
+        time_col="_time",
+        engine="c",
+    )
+    actual = traced_deserialize(ds, data)
+
+    bars = np.empty(len(actual), dtype=bars_dtype)
+    bars["frame"] = actual["_time"].values
+    for col in cols:
+        bars[col] = actual[col].values
+
+    all_codes = actual["code"].values
+    splits = np.flatnonzero(all_codes[1:] != all_codes[:-1]) + 1
+    return {
+        x[0]: y for x, y in zip(np.split(all_codes, splits), np.split(bars, splits))
+    }
+
+
+async def get_sec_bars_min_local_first(
+    secs_set: set, dt: datetime.date, ft: FrameType, verify_sample: int = 0
+):
+    """5m/15m/30m/60m的分钟线优先用数据库中的1分钟线合成，1分钟线不完整的证券再远程下载
+
+    verify_sample大于0时，抽取这么多只证券和远程数据比较（需要消耗quota）
+    """
+    if ft not in RESAMPLE_MINUTES:
+        return await get_sec_bars_min(secs_set, dt, ft)
+
+    bars_1m = await get_security_minutes_full_bars(secs_set, dt)
+    expected = get_expected_bars_count(FrameType.MIN1)
+    bars_1m = {k: v for k, v in bars_1m.items() if len(v) == expected}
+    all_valid_bars = resample_bars(bars_1m, ft)
+    if verify_sample > 0 and len(bars_1m) > 0:
+        await verify_resample(bars_1m, dt, ft, verify_sample)
+
+    missing = set(secs_set).difference(all_valid_bars.keys())
+    logger.info(
+        "bars:%s, %d secs resampled from bars:1m, %d secs to be downloaded, %s",
+        ft.value,
+        len(all_valid_bars),
+        len(missing),
+        dt,
+    )
+    if len(missing) > 0:
+        all_valid_bars.update(await get_sec_bars_min(missing, dt, ft))
+
+    return all_valid_bars
+
+
+def diff_bars(
+    actual: Dict[str, np.ndarray], expected: Dict[str, np.ndarray], rtol=1e-4
+):
+    # 返回不一致的证券，以及不一致的字段
+    diffs = {}
+    for code in expected:
+        if code not in actual:
+            diffs[code] = ["missing"]
+            continue
+
+        x, y = actual[code], expected[code]
+        if len(x) != len(y):
+            diffs[code] = ["count"]
+            continue
+        if np.any(x["frame"] != y["frame"]):
+            diffs[code] = ["frame"]
+            continue
+
+        cols = ["open", "high", "low", "close", "volume", "amount", "factor"]
+        cols = [
+            col
+            for col in cols
+            if not np.allclose(x[col], y[col], rtol=rtol, equal_nan=True)
+        ]
+        if len(cols) > 0:
+            diffs[code] = cols
+
+    return diffs
+
+
+async def verify_resample(
+    bars_1m: Dict[str, np.ndarray],
+    dt: datetime.date,
+    ft: FrameType,
+    sample_size: int = 20,
+):
+    """校验模式：随机抽取sample_size只证券，和远程服务的分钟线比较"""
+    codes = list(bars_1m.keys())
+    sample = set(random.sample(codes, min(sample_size, len(codes))))
+
+    resampled = resample_bars({k: bars_1m[k] for k in sample}, ft)
+    remote = await get_sec_bars_min(sample, dt, ft)
+
+    diffs = diff_bars(resampled, remote)
+    for code, cols in diffs.items():
+        logger.error("bars:%s resample mismatch, %s, %s, %s", ft.value, code, dt, cols)
+    logger.info(
+        "bars:%s resample verified, %d secs, %d mismatched, %s",
+        ft.value,
+        len(remote),
+        len(diffs),
+        dt,
+    )
+    return diffs
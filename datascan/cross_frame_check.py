@@ -0,0 +1,208 @@
+import datetime
+import logging
+from typing import Dict
+
+import numpy as np
+from coretypes import FrameType
+from omicron.models.timeframe import TimeFrame
+
+from datascan.bars_resample import (
+    RESAMPLE_MINUTES,
+    aggregate_day_bars,
+    get_security_day_full_bars,
+    get_security_full_bars,
+    get_security_minutes_full_bars,
+    merge_bars,
+    resample_bars,
+)
+from influx_data.security_bars_1m import get_expected_bars_count
+from tracing import traced_sync
+
+logger = logging.getLogger(__name__)
+
+# 价格和scanner_utils中一致，保留两位小数后允许0.01的误差
+PRICE_TOLERANCE = 1e-2
+FACTOR_TOLERANCE = 1e-5
+VOLUME_RTOL = 1e-6
+AFTER_HOURS_BOARDS = ("688", "689", "300", "301")
+
+
+def flatten_bars(bars: Dict[str, np.ndarray], codes: np.ndarray, unit: str):
+    """{code: bars}展开为一维数组，key由证券序号和时间（按unit截断）组成，用于两组数据对齐"""
+    _codes = [code for code in bars if len(bars[code]) > 0]
+    if len(_codes) == 0:
+        return np.array([], dtype=np.int64), None
+
+    data = np.concatenate([bars[code] for code in _codes])
+    code_idx = np.repeat(
+        np.searchsorted(codes, _codes), [len(bars[code]) for code in _codes]
+    )
+    ts = data["frame"].astype(f"datetime64[{unit}]").astype("datetime64[s]")
+    keys = (code_idx.astype(np.int64) << 40) | ts.astype(np.int64)
+    return keys, data
+
+
+@traced_sync("compare")
+def compare_bars_vectorized(
+    expected: Dict[str, np.ndarray], actual: Dict[str, np.ndarray], unit: str = "m"
+):
+    """比较两组行情数据，expected为合成的数据，actual为数据库中存储的数据
+
+    Returns:
+        {code: [不一致的字段]}，缺失的bar记为"missing"，多出的bar记为"extra"
+    """
+    codes = np.array(sorted(set(expected.keys()).union(actual.keys())), dtype="O")
+    if len(codes) == 0:
+        return {}
+
+    k1, d1 = flatten_bars(expected, codes, unit)
+    k2, d2 = flatten_bars(actual, codes, unit)
+    _, i1, i2 = np.intersect1d(k1, k2, assume_unique=True, return_indices=True)
+
+    violations = {}
+
+    def add(keys, field):
+        for idx in np.unique(keys >> 40):
+            violations.setdefault(codes[idx], []).append(field)
+
+    add(np.setdiff1d(k1, k2, assume_unique=True), "missing")
+    add(np.setdiff1d(k2, k1, assume_unique=True), "extra")
+    if len(i1) == 0:
+        return violations
+
+    x, y = d1[i1], d2[i2]
+    keys = k1[i1]
+    for col in ("open", "high", "low", "close"):
+        diff = ~np.isclose(
+            np.round(x[col], 2), np.round(y[col], 2), rtol=0, atol=PRICE_TOLERANCE
+        )
+        add(keys[diff], col)
+    for col in ("volume", "amount"):
+        add(keys[~np.isclose(x[col], y[col], rtol=VOLUME_RTOL, atol=0)], col)
+    add(keys[~np.isclose(x["factor"], y["factor"], atol=FACTOR_TOLERANCE)], "factor")
+
+    return violations
+
+
+def report_violations(violations: dict, src: FrameType, dst: FrameType, dt):
+    # 和远程校验一样，逐个证券输出不一致的字段
+    for code, fields in violations.items():
+        logger.error(
+            "[%s] not equal in bars:%s and bars:%s, %s, %s",
+            ",".join(fields),
+            src.value,
+            dst.value,
+            code,
+            dt,
+        )
+    if len(violations) > 0:
+        logger.error(
+            "bars:%s -> bars:%s, %d secs failed to validate, %s",
+            src.value,
+            dst.value,
+            len(violations),
+            dt,
+        )
+        return False
+
+    return True
+
+
+def aggregate_minute_bars_to_day(bars_1m: Dict[str, np.ndarray]):
+    # 1分钟线合成日线，bar的时间为当天0点
+    codes = [code for code in bars_1m if len(bars_1m[code]) > 0]
+    if len(codes) == 0:
+        return {}
+
+    data = np.concatenate([bars_1m[code] for code in codes])
+    code_idx = np.repeat(np.arange(len(codes)), [len(bars_1m[code]) for code in codes])
+    days = data["frame"].astype("datetime64[D]")
+    order = np.lexsort((data["frame"], code_idx))
+    return merge_bars(codes, data[order], code_idx[order], days[order])
+
+
+def exclude_after_hours_volume(violations: dict):
+    # 科创板和创业板有盘后固定价格交易，日线的成交量和成交额大于分钟线的合计
+    result = {}
+    for code, fields in violations.items():
+        if code[:3] in AFTER_HOURS_BOARDS:
+            fields = [x for x in fields if x not in ("volume", "amount")]
+        if len(fields) > 0:
+            result[code] = fields
+
+    return result
+
+
+async def validate_minutes_consistency(target_date: datetime.date):
+    """检查1分钟线合成的5m/15m/30m/60m和日线，和数据库中存储的数据是否一致"""
+    bars_1m = await get_security_minutes_full_bars(None, target_date)
+    if len(bars_1m) == 0:
+        logger.error("no bars:1m found, %s", target_date)
+        return False
+
+    # 1分钟线根数不完整的证券，合成结果肯定不一致，由分钟线的扫描处理
+    expected = get_expected_bars_count(FrameType.MIN1)
+    incomplete = [k for k, v in bars_1m.items() if len(v) != expected]
+    if len(incomplete) > 0:
+        logger.error(
+            "bars:1m incomplete, %d secs skipped, %s", len(incomplete), target_date
+        )
+    bars_1m = {k: v for k, v in bars_1m.items() if len(v) == expected}
+
+    rc = True
+    for ft in RESAMPLE_MINUTES:
+        actual = await get_security_minutes_full_bars(None, target_date, ft)
+        actual = {k: v for k, v in actual.items() if k in bars_1m}
+        violations = compare_bars_vectorized(resample_bars(bars_1m, ft), actual)
+        rc = report_violations(violations, FrameType.MIN1, ft, target_date) and rc
+
+    _start = datetime.datetime.combine(target_date, datetime.time(0, 0, 0))
+    _end = datetime.datetime.combine(target_date, datetime.time(23, 59, 59))
+    actual = await get_security_day_full_bars(None, _start, _end)
+    actual = {k: v for k, v in actual.items() if k in bars_1m}
+    violations = compare_bars_vectorized(
+        aggregate_minute_bars_to_day(bars_1m), actual, unit="D"
+    )
+    violations = exclude_after_hours_volume(violations)
+    rc = (
+        report_violations(violations, FrameType.MIN1, FrameType.DAY, target_date) and rc
+    )
+
+    return rc
+
+
+async def validate_period_consistency(target_date: datetime.date, ft: FrameType):
+    """检查target_date所在周（月）的日线合成结果和数据库中的周线（月线）是否一致"""
+    d1 = TimeFrame.ceiling(target_date, ft)
+    d0 = TimeFrame.day_shift(TimeFrame.shift(d1, -1, ft), 1)
+    d1 = min(d1, target_date)
+
+    _start = datetime.datetime.combine(d0, datetime.time(0, 0, 0))
+    _end = datetime.datetime.combine(d1, datetime.time(23, 59, 59))
+    bars_1d = await get_security_day_full_bars(None, _start, _end)
+    if len(bars_1d) == 0:
+        logger.error("no bars:1d found, %s - %s", d0, d1)
+        return False
+
+    _start = datetime.datetime.combine(d1, datetime.time(0, 0, 0))
+    actual = await get_security_full_bars(ft, _start, _end)
+    violations = compare_bars_vectorized(
+        aggregate_day_bars(bars_1d, ft, d1), actual, unit="D"
+    )
+    return report_violations(violations, FrameType.DAY, ft, d1)
+
+
+async def validate_cross_frames(target_date: datetime.date):
+    """不访问远程服务的一致性检查：分钟线之间、分钟线和日线、日线和周线月线
+
+    周线（月线）只在target_date是本周（本月）最后一个交易日时检查
+    """
+    logger.info("check cross-frame consistency: %s", target_date)
+    rc = await validate_minutes_consistency(target_date)
+
+    for ft in (FrameType.WEEK, FrameType.MONTH):
+        if TimeFrame.ceiling(target_date, ft) != target_date:
+            continue
+        rc = await validate_period_consistency(target_date, ft) and rc
+
+    return rc
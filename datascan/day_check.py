@@ -7,6 +7,7 @@ from omicron.dal.influx.serialize import DataframeDeserializer
 from omicron.models import get_influx_client
 from omicron.models.security import Security
 
+from code_table import code_difference
 from datascan.index_secs import get_index_sec_whitelist
 from datascan.jq_fetcher import get_sec_bars_1d, get_sec_bars_pricelimits
 from datascan.scanner_utils import (
@@ -14,6 +15,7 @@ from datascan.scanner_utils import (
     compare_bars_for_pricelimits,
     get_secs_from_bars,
 )
+from tracing import traced_deserialize, traced_query
 
 logger = logging.getLogger(__name__)
 
@@ -30,7 +32,7 @@ async def get_security_day_bars(start: datetime.datetime, end: datetime.datetime
         .fields(["open", "high", "low", "close", "volume", "factor"])
     )
 
-    data = await client.query(flux)
+    data = await traced_query(client, flux)
     if len(data) == 2:  # \r\n
         return []
 
@@ -40,7 +42,7 @@ async def get_security_day_bars(start: datetime.datetime, end: datetime.datetime
         time_col="_time",
         engine="c",
     )
-    actual = ds(data)
+    actual = traced_deserialize(ds, data)
     secs = actual.to_records(index=False)
     return secs
 
@@ -57,7 +59,7 @@ async def get_security_price_limits(start: datetime.datetime, end: datetime.date
         .fields(["high_limit", "low_limit"])
     )
 
-    data = await client.query(flux)
+    data = await traced_query(client, flux)
     if len(data) == 2:  # \r\n
         return []
 
@@ -67,7 +69,7 @@ async def get_security_price_limits(start: datetime.datetime, end: datetime.date
         time_col="_time",
         engine="c",
     )
-    actual = ds(data)
+    actual = traced_deserialize(ds, data)
     secs = actual.to_records(index=False)
     return secs
 
@@ -98,8 +100,7 @@ async def scan_bars_1d_pricelimits_for_seclist(target_date: datetime.date):
 
 def get_security_difference(secs_in_bars, all_stock, all_index):
     # 检查是否有多余的股票
-    x1 = secs_in_bars.difference(all_stock)
-    y1 = x1.difference(all_index)
+    y1 = code_difference(secs_in_bars, all_stock, all_index)
     if len(y1) > 0:  # 本地数据库中多余的股票或指数
         logger.error("secs in bars:1d but not in jq : %d", len(y1))
         return False
@@ -6,6 +6,7 @@ import numpy as np
 from coretypes import FrameType
 
 from fetchers.abstract_quotes_fetcher import AbstractQuotesFetcher
+from tracing import span
 
 logger = logging.getLogger(__name__)
 
@@ -14,7 +15,6 @@ async def get_sec_bars_min(secs_set: set, dt: datetime.date, ft: FrameType):
     secs = list(secs_set)
     all_valid_bars = {}
 
-    instance = AbstractQuotesFetcher.get_instance()
     end_dt = datetime.datetime.combine(dt, datetime.time(15, 0))
 
     if ft == FrameType.MIN1:
@@ -35,45 +35,34 @@ async def get_sec_bars_min(secs_set: set, dt: datetime.date, ft: FrameType):
     else:
         raise ValueError("invalid frametype: %s" % ft)
 
-    start = 0
-    left = len(secs)
-    while left > 0:
-        if left > max_secs:  # 一次15*240=3500根
-            end = start + max_secs
-            left -= max_secs
-        else:
-            end = start + left
-            left = 0
-
-        _sec_list = secs[start:end]
-        bars = await instance.get_bars_batch(
-            _sec_list, end_dt, n_bars, ft.value, include_unclosed=True
-        )
-        for code in list(bars.keys()):
-            if not len(bars[code]):
-                del bars[code]
-                print("delete empty bar: ", code)
-                continue
-            if np.any(np.isnan(bars[code]["amount"])) or np.any(
-                np.isnan(bars[code]["volume"])
-            ):
-                del bars[code]
-                print("delete bar with nan amount/volume: ", code)
-                continue
-            _date_in_bar = bars[code]["frame"][0].item()
-            if _date_in_bar.date() != dt:
-                del bars[code]
-                logger.info(
-                    "delete bar with earlier date (bars:%s): %s, %s",
-                    ft.value,
-                    code,
-                    _date_in_bar,
-                )
-                continue
-
-            all_valid_bars[code] = bars[code]
-
-        start = end
+    # 一次15*240=3500根，分批后在多个账号间并行下载
+    batches = [secs[i : i + max_secs] for i in range(0, len(secs), max_secs)]
+    bars = await AbstractQuotesFetcher.get_bars_batches(
+        batches, end_dt, n_bars, ft.value, include_unclosed=True
+    )
+    for code in list(bars.keys()):
+        if not len(bars[code]):
+            del bars[code]
+            print("delete empty bar: ", code)
+            continue
+        if np.any(np.isnan(bars[code]["amount"])) or np.any(
+            np.isnan(bars[code]["volume"])
+        ):
+            del bars[code]
+            print("delete bar with nan amount/volume: ", code)
+            continue
+        _date_in_bar = bars[code]["frame"][0].item()
+        if _date_in_bar.date() != dt:
+            del bars[code]
+            logger.info(
+                "delete bar with earlier date (bars:%s): %s, %s",
+                ft.value,
+                code,
+                _date_in_bar,
+            )
+            continue
+
+        all_valid_bars[code] = bars[code]
 
     return all_valid_bars
 
@@ -82,46 +71,33 @@ async def get_sec_bars_1d(secs_set: set, dt: datetime.date):
     secs = list(secs_set)
     all_valid_bars = {}
 
-    instance = AbstractQuotesFetcher.get_instance()
     end_dt = datetime.datetime.combine(dt, datetime.time(15, 0))
 
-    start = 0
-    left = len(secs)
-    while left > 0:
-        if left > 3000:
-            end = start + 3000
-            left -= 3000
-        else:
-            end = start + left
-            left = 0
-
-        _sec_list = secs[start:end]
-        bars = await instance.get_bars_batch(
-            _sec_list, end_dt, 1, "1d", include_unclosed=True
-        )
-        for code in list(bars.keys()):
-            if not len(bars[code]):
-                del bars[code]
-                print("delete empty bar: ", code)
-                continue
-            if np.any(np.isnan(bars[code]["amount"])) or np.any(
-                np.isnan(bars[code]["volume"])
-            ):
-                del bars[code]
-                print("delete bar with nan amount/volume: ", code)
-                continue
-            _date_in_bar = bars[code]["frame"][0].item().date()
-            if _date_in_bar != dt:
-                del bars[code]
-                logger.info(
-                    "delete bar with earlier date (bars:1d): %s, %s", code, _date_in_bar
-                )
-                continue
-
-            # print("sec added: ", code)
-            all_valid_bars[code] = bars[code]
-
-        start = end
+    batches = [secs[i : i + 3000] for i in range(0, len(secs), 3000)]
+    bars = await AbstractQuotesFetcher.get_bars_batches(
+        batches, end_dt, 1, "1d", include_unclosed=True
+    )
+    for code in list(bars.keys()):
+        if not len(bars[code]):
+            del bars[code]
+            print("delete empty bar: ", code)
+            continue
+        if np.any(np.isnan(bars[code]["amount"])) or np.any(
+            np.isnan(bars[code]["volume"])
+        ):
+            del bars[code]
+            print("delete bar with nan amount/volume: ", code)
+            continue
+        _date_in_bar = bars[code]["frame"][0].item().date()
+        if _date_in_bar != dt:
+            del bars[code]
+            logger.info(
+                "delete bar with earlier date (bars:1d): %s, %s", code, _date_in_bar
+            )
+            continue
+
+        # print("sec added: ", code)
+        all_valid_bars[code] = bars[code]
 
     return all_valid_bars
 
@@ -133,7 +109,8 @@ async def get_sec_bars_pricelimits(secs_set: set, dt: datetime.date):
 
     end = datetime.datetime.combine(dt, datetime.time(15, 0))
 
-    bars = await instance.get_trade_price_limits(secs, end)
+    with span("fetch.get_trade_price_limits", rows=len(secs)):
+        bars = await instance.get_trade_price_limits(secs, end)
     bars = bars[~np.isnan(bars["low_limit"])]
     bars = bars[~np.isnan(bars["high_limit"])]
     bars = bars[bars["frame"] == dt]
@@ -145,48 +122,35 @@ async def get_sec_bars_1w(secs_set: set, dt: datetime.date, d0: datetime.date):
     secs = list(secs_set)
     all_valid_bars = {}
 
-    instance = AbstractQuotesFetcher.get_instance()
     end_dt = datetime.datetime.combine(dt, datetime.time(15, 0))
 
-    start = 0
-    left = len(secs)
-    while left > 0:
-        if left > 3000:
-            end = start + 3000
-            left -= 3000
-        else:
-            end = start + left
-            left = 0
-
-        _sec_list = secs[start:end]
-        bars = await instance.get_bars_batch(
-            _sec_list, end_dt, 1, "1w", include_unclosed=True, fq_ref_enabled=False
-        )
-        for code in list(bars.keys()):
-            if not len(bars[code]):
-                del bars[code]
-                print("delete empty bar: ", code)
-                continue
-            if np.any(np.isnan(bars[code]["amount"])) or np.any(
-                np.isnan(bars[code]["volume"])
-            ):
-                del bars[code]
-                print("delete bar with nan amount/volume: ", code)
-                continue
-            _date_in_bar = bars[code]["frame"][0].item().date()
-            if _date_in_bar < d0 or _date_in_bar > dt:
-                del bars[code]
-                logger.info(
-                    "delete bar with invalid date (not in this week): %s, %s",
-                    code,
-                    _date_in_bar,
-                )
-                continue
-
-            # print("sec added: ", code)
-            all_valid_bars[code] = bars[code]
-
-        start = end
+    batches = [secs[i : i + 3000] for i in range(0, len(secs), 3000)]
+    bars = await AbstractQuotesFetcher.get_bars_batches(
+        batches, end_dt, 1, "1w", include_unclosed=True, fq_ref_enabled=False
+    )
+    for code in list(bars.keys()):
+        if not len(bars[code]):
+            del bars[code]
+            print("delete empty bar: ", code)
+            continue
+        if np.any(np.isnan(bars[code]["amount"])) or np.any(
+            np.isnan(bars[code]["volume"])
+        ):
+            del bars[code]
+            print("delete bar with nan amount/volume: ", code)
+            continue
+        _date_in_bar = bars[code]["frame"][0].item().date()
+        if _date_in_bar < d0 or _date_in_bar > dt:
+            del bars[code]
+            logger.info(
+                "delete bar with invalid date (not in this week): %s, %s",
+                code,
+                _date_in_bar,
+            )
+            continue
+
+        # print("sec added: ", code)
+        all_valid_bars[code] = bars[code]
 
     return all_valid_bars
 
@@ -195,47 +159,34 @@ async def get_sec_bars_1M(secs_set: set, dt: datetime.date, d0: datetime.date):
     secs = list(secs_set)
     all_valid_bars = {}
 
-    instance = AbstractQuotesFetcher.get_instance()
     end_dt = datetime.datetime.combine(dt, datetime.time(15, 0))
 
-    start = 0
-    left = len(secs)
-    while left > 0:
-        if left > 3000:
-            end = start + 3000
-            left -= 3000
-        else:
-            end = start + left
-            left = 0
-
-        _sec_list = secs[start:end]
-        bars = await instance.get_bars_batch(
-            _sec_list, end_dt, 1, "1M", include_unclosed=True, fq_ref_enabled=False
-        )
-        for code in list(bars.keys()):
-            if not len(bars[code]):
-                del bars[code]
-                print("delete empty bar: ", code)
-                continue
-            if np.any(np.isnan(bars[code]["amount"])) or np.any(
-                np.isnan(bars[code]["volume"])
-            ):
-                del bars[code]
-                print("delete bar with nan amount/volume: ", code)
-                continue
-            _date_in_bar = bars[code]["frame"][0].item().date()
-            if _date_in_bar < d0 or _date_in_bar > dt:
-                del bars[code]
-                logger.info(
-                    "delete bar with invalid date (not in this month): %s, %s",
-                    code,
-                    _date_in_bar,
-                )
-                continue
-
-            # print("sec added: ", code)
-            all_valid_bars[code] = bars[code]
-
-        start = end
+    batches = [secs[i : i + 3000] for i in range(0, len(secs), 3000)]
+    bars = await AbstractQuotesFetcher.get_bars_batches(
+        batches, end_dt, 1, "1M", include_unclosed=True, fq_ref_enabled=False
+    )
+    for code in list(bars.keys()):
+        if not len(bars[code]):
+            del bars[code]
+            print("delete empty bar: ", code)
+            continue
+        if np.any(np.isnan(bars[code]["amount"])) or np.any(
+            np.isnan(bars[code]["volume"])
+        ):
+            del bars[code]
+            print("delete bar with nan amount/volume: ", code)
+            continue
+        _date_in_bar = bars[code]["frame"][0].item().date()
+        if _date_in_bar < d0 or _date_in_bar > dt:
+            del bars[code]
+            logger.info(
+                "delete bar with invalid date (not in this month): %s, %s",
+                code,
+                _date_in_bar,
+            )
+            continue
+
+        # print("sec added: ", code)
+        all_valid_bars[code] = bars[code]
 
     return all_valid_bars
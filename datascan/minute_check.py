@@ -12,9 +12,11 @@ from omicron.models import get_influx_client
 from omicron.models.security import Security
 from omicron.models.timeframe import TimeFrame
 
+from code_table import code_difference, encode_codes
 from datascan.jq_fetcher import get_sec_bars_min
 from datascan.scanner_utils import get_secs_from_bars
 from fetchers.abstract_quotes_fetcher import AbstractQuotesFetcher
+from tracing import traced_deserialize, traced_query
 
 logger = logging.getLogger(__name__)
 
@@ -37,7 +39,7 @@ my_bars_dtype = np.dtype(
     [
         # use datetime64 may improve performance/memory usage, but it's hard to talk with other modules, like TimeFrame
         ("_time", "datetime64[s]"),
-        ("code", "O"),
+        ("code", "i4"),  # code_table中的编号
         ("open", "f4"),
         ("high", "f4"),
         ("low", "f4"),
@@ -62,7 +64,7 @@ async def get_security_minutes_bars_bysecs(
         .tags({"code": sec_list})
     )
 
-    data = await client.query(flux)
+    data = await traced_query(client, flux)
     if len(data) == 2:  # \r\n
         return []
 
@@ -72,7 +74,8 @@ async def get_security_minutes_bars_bysecs(
         time_col="_time",
         engine="c",
     )
-    actual = ds(data)
+    actual = traced_deserialize(ds, data)
+    actual["code"] = encode_codes(actual["code"].values)
     secs = actual.to_records(index=False).astype(my_bars_dtype)
     return secs
 
@@ -91,7 +94,7 @@ async def get_security_minutes_bars(
         .fields(["open", "close", "high", "volume"])
     )
 
-    data = await client.query(flux)
+    data = await traced_query(client, flux)
     if len(data) == 2:  # \r\n
         return []
 
@@ -101,15 +104,14 @@ async def get_security_minutes_bars(
         time_col="_time",
         engine="c",
     )
-    actual = ds(data)
+    actual = traced_deserialize(ds, data)
     secs = actual.to_records(index=False)
     return secs
 
 
 def get_security_difference(secs_in_bars, all_stock, all_index, ft):
     # 检查是否有多余的股票
-    x1 = secs_in_bars.difference(all_stock)
-    y1 = x1.difference(all_index)
+    y1 = code_difference(secs_in_bars, all_stock, all_index)
     if len(y1) > 0:  # 本地数据库中多余的股票或指数
         logger.error("secs in bars:%s but not in jq : %d", ft.value, len(y1))
         return False
@@ -119,12 +121,12 @@ def get_security_difference(secs_in_bars, all_stock, all_index, ft):
 
 def compare_seclist_difference(secs_in_day, secs_in_min, ft: FrameType):
     # 检查是否有多余的股票
-    x1 = secs_in_min.difference(secs_in_day)
+    x1 = code_difference(secs_in_min, secs_in_day)
     if len(x1) > 0:  # 分钟线有，但日线啊没有
         logger.error("secs in bars:%s but not in bars:1d, %d", ft.value, len(x1))
         return False
 
-    y1 = secs_in_day.difference(secs_in_min)
+    y1 = code_difference(secs_in_day, secs_in_min)
     if len(y1) > 0:  # 日线有，但分钟线没有
         logger.error("secs in bars:1d but not in bars:%s, %d", ft.value, len(y1))
         return False
@@ -0,0 +1,235 @@
+"""分钟线数值的抽样校验
+
+全量比较分钟线需要下载全天的数据（1分钟线每只证券240根），quota无法承受。这里按板块和
+时段分层，随机抽取(证券, 时间)样本，每个时间点只下载一根bar（n_bars=1），消耗的quota
+等于样本数。由样本的不一致比例估计当天该周期的错误率，并给出置信区间。
+"""
+import datetime
+import json
+import logging
+import math
+from typing import Dict, List
+
+import cfg4py
+import numpy as np
+from coretypes import FrameType
+from omicron.dal.cache import cache
+from omicron.models.timeframe import TimeFrame
+
+from datascan.bars_resample import get_security_minutes_full_bars
+from datascan.cross_frame_check import PRICE_TOLERANCE, VOLUME_RTOL, flatten_bars
+from fetchers.abstract_quotes_fetcher import AbstractQuotesFetcher
+
+logger = logging.getLogger(__name__)
+
+# 每个周期每天的样本数（等于消耗的quota）
+DEFAULT_SAMPLE_BUDGET = 2000
+# 开盘30分钟、盘中、收盘30分钟，数据问题多集中在开盘和收盘
+TIME_STRATA_MINUTES = (30, 210, 30)
+TIMESTAMPS_PER_STRATUM = 3
+# 95%置信区间
+Z_SCORE = 1.96
+# 错误率置信区间的上界超过这个值才判定当天的数据有问题
+DEFAULT_MAX_ERROR_RATE = 0.01
+
+
+def get_max_error_rate():
+    cfg = cfg4py.get_instance()
+    _cfg = getattr(cfg, "minute_sampling", None)
+    if _cfg is None or getattr(_cfg, "max_error_rate", None) is None:
+        return DEFAULT_MAX_ERROR_RATE
+    return _cfg.max_error_rate
+
+
+def get_board(code: str, all_index: set) -> str:
+    if code in all_index:
+        return "index"
+    if code[:3] in ("688", "689"):
+        return "star"
+    if code[:3] in ("300", "301"):
+        return "chinext"
+    if code.endswith(".XSHG"):
+        return "sh"
+    return "sz"
+
+
+def get_frames_of_day(target_date: datetime.date, ft: FrameType) -> np.ndarray:
+    # TimeFrame.ticks中是当天的分钟数，比如571表示9:31
+    ticks = np.array(TimeFrame.ticks[ft], dtype="timedelta64[m]")
+    return (np.datetime64(target_date, "m") + ticks).astype("datetime64[s]")
+
+
+def split_time_strata(frames: np.ndarray) -> List[np.ndarray]:
+    # 按交易分钟数切分，不足一个bar的时段并入相邻时段
+    minutes = np.cumsum(TIME_STRATA_MINUTES)[:-1]
+    position = np.arange(len(frames)) * 240 // len(frames)
+    strata = np.split(frames, np.searchsorted(position, minutes))
+    return [x for x in strata if len(x) > 0]
+
+
+def allocate(sizes: Dict[str, int], budget: int) -> Dict[str, int]:
+    """按各层的大小比例分配样本数，每层至少1个（不超过该层大小）"""
+    total = sum(sizes.values())
+    if total == 0:
+        return {}
+
+    result = {}
+    for name, size in sizes.items():
+        n = int(round(budget * size / total))
+        result[name] = min(max(n, 1), size)
+    return result
+
+
+def draw_samples(
+    secs_by_board: Dict[str, np.ndarray],
+    frames: np.ndarray,
+    budget: int,
+    rng: np.random.Generator,
+):
+    """分层抽样，返回{时间点: {板块: [证券]}}"""
+    time_strata = split_time_strata(frames)
+    n_timestamps = sum([min(TIMESTAMPS_PER_STRATUM, len(x)) for x in time_strata])
+    per_timestamp = max(budget // max(n_timestamps, 1), 1)
+
+    sizes = {k: len(v) for k, v in secs_by_board.items()}
+    plan = {}
+    for stratum in time_strata:
+        n = min(TIMESTAMPS_PER_STRATUM, len(stratum))
+        for frame in rng.choice(stratum, n, replace=False):
+            plan[frame] = {
+                board: rng.choice(secs_by_board[board], k, replace=False)
+                for board, k in allocate(sizes, per_timestamp).items()
+            }
+    return plan
+
+
+def wilson_interval(errors: int, n: int, z: float = Z_SCORE):
+    """错误率的Wilson置信区间，样本中没有错误时上界仍然大于0"""
+    if n == 0:
+        return 0.0, 1.0
+
+    p = errors / n
+    denominator = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denominator
+    margin = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denominator
+    return max(center - margin, 0.0), min(center + margin, 1.0)
+
+
+def compare_samples(local: np.ndarray, remote: np.ndarray):
+    """逐个样本比较，两个数组已经按(证券, 时间)对齐，返回每个样本是否不一致"""
+    bad = np.zeros(len(local), dtype=bool)
+    for col in ("open", "high", "low", "close"):
+        bad |= ~np.isclose(
+            np.round(local[col], 2),
+            np.round(remote[col], 2),
+            rtol=0,
+            atol=PRICE_TOLERANCE,
+        )
+    bad |= ~np.isclose(local["volume"], remote["volume"], rtol=VOLUME_RTOL, atol=0)
+    return bad
+
+
+async def fetch_samples(plan, ft: FrameType):
+    """每个时间点只取一根bar，返回{(code, frame): bar}"""
+    result = {}
+    for frame, boards in plan.items():
+        codes = np.concatenate(list(boards.values())).tolist()
+        end = frame.astype(datetime.datetime)
+        bars = await AbstractQuotesFetcher.get_bars_batches(
+            [codes], end, 1, ft.value, include_unclosed=True
+        )
+        for code, bar in bars.items():
+            # 停牌的证券返回的是nan，不计入样本
+            bar = bar[bar["frame"] == frame]
+            bar = bar[~np.isnan(bar["volume"]) & ~np.isnan(bar["amount"])]
+            if len(bar) > 0:
+                result[(code, frame)] = bar[0]
+    return result
+
+
+async def validate_minute_values_sampled(
+    target_date: datetime.date,
+    all_stock: set,
+    all_index: set,
+    ft: FrameType,
+    budget: int = DEFAULT_SAMPLE_BUDGET,
+    seed: int = None,
+):
+    """抽样比较数据库和远程的分钟线数值，返回报告（同时保存在cache中）
+
+    远程没有返回的样本不计入（停牌等），数据库中缺失的样本记为错误。错误率置信区间的
+    上界不超过get_max_error_rate()时passed为True。
+    """
+    rng = np.random.default_rng(seed)
+    secs_by_board = {}
+    for code in sorted(all_stock | all_index):
+        secs_by_board.setdefault(get_board(code, all_index), []).append(code)
+    secs_by_board = {k: np.array(v, dtype="O") for k, v in secs_by_board.items()}
+
+    plan = draw_samples(secs_by_board, get_frames_of_day(target_date, ft), budget, rng)
+    remote = await fetch_samples(plan, ft)
+    if len(remote) == 0:
+        logger.error("no samples from remote, bars:%s, %s", ft.value, target_date)
+        return None
+
+    codes = sorted({code for code, _ in remote.keys()})
+    local_bars = await get_security_minutes_full_bars(codes, target_date, ft)
+
+    # 样本和数据库中的bar按(证券序号, 时间)对齐
+    keys = list(remote.keys())
+    codes = np.array(codes, dtype="O")
+    remote_rows = np.array([remote[k] for k in keys], dtype=remote[keys[0]].dtype)
+    sample_keys = (
+        np.searchsorted(codes, [code for code, _ in keys]).astype(np.int64) << 40
+    ) | remote_rows["frame"].astype("datetime64[s]").astype(np.int64)
+
+    missing = np.ones(len(keys), dtype=bool)
+    bad = np.zeros(len(keys), dtype=bool)
+    local_keys, local_data = flatten_bars(local_bars, codes, "m")
+    if local_data is not None:
+        order = np.argsort(local_keys)
+        local_keys, local_data = local_keys[order], local_data[order]
+        pos = np.clip(np.searchsorted(local_keys, sample_keys), 0, len(local_keys) - 1)
+        missing = local_keys[pos] != sample_keys
+        bad = ~missing & compare_samples(local_data[pos], remote_rows)
+    bad |= missing
+
+    boards = np.array([get_board(code, all_index) for code, _ in keys], dtype="O")
+    strata = {}
+    for board in np.unique(boards):
+        mask = boards == board
+        strata[board] = {"samples": int(mask.sum()), "errors": int(bad[mask].sum())}
+
+    errors = int(bad.sum())
+    low, high = wilson_interval(errors, len(keys))
+    threshold = get_max_error_rate()
+    report = {
+        "date": target_date.strftime("%Y-%m-%d"),
+        "frame": ft.value,
+        "samples": len(keys),
+        "errors": errors,
+        "missing": int(missing.sum()),
+        "error_rate": errors / len(keys),
+        "lower": low,
+        "upper": high,
+        "threshold": threshold,
+        "passed": high <= threshold,
+        "strata": strata,
+    }
+
+    await cache.sys.hset(
+        "datascan:minute_sampling:%s" % ft.value, report["date"], json.dumps(report)
+    )
+    for code, frame in np.array(keys, dtype="O")[bad][:20]:
+        logger.error("bars:%s sample mismatch: %s, %s", ft.value, code, frame)
+    logger.info(
+        "bars:%s sampled validation, %s: %d/%d errors, rate %.4f [%.4f, %.4f]",
+        ft.value,
+        target_date,
+        errors,
+        len(keys),
+        report["error_rate"],
+        low,
+        high,
+    )
+    return report
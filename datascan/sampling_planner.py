@@ -0,0 +1,164 @@
+import datetime
+import logging
+from typing import Dict, List
+
+import numpy as np
+from coretypes import FrameType
+from omicron.dal.cache import cache
+from omicron.dal.influx.flux import Flux
+from omicron.dal.influx.serialize import DataframeDeserializer
+from omicron.models import get_influx_client
+from omicron.models.timeframe import TimeFrame
+
+from influx_data.bars_coverage import BarsCoverage
+from influx_data.listing_index import get_listing_index
+from tracing import traced_deserialize, traced_query
+
+logger = logging.getLogger(__name__)
+
+ISSUES_KEY = "datascan:data_integrity_results"
+VERIFIED_KEY = "datascan:verified_days"
+
+# 各个信号的权重，没有任何信号的日期得分为0，只按是否验证过排序
+WEIGHT_PREVIOUS_FAILURE = 100.0
+WEIGHT_COVERAGE_GAP = 10.0
+WEIGHT_LISTING_CHANGE = 5.0
+WEIGHT_XRXD = 3.0
+WEIGHT_NEVER_VERIFIED = 1.0
+
+
+async def get_days_with_issues() -> set:
+    """本地扫描或者远程校验失败，之后还没有验证通过的日期"""
+    items = await cache.sys.lrange(ISSUES_KEY, 0, -1)
+    verified = await get_verified_days()
+    return {x for x in [_parse_day(x) for x in items or []] if x not in verified}
+
+
+async def get_verified_days() -> Dict[datetime.date, str]:
+    items = await cache.sys.hgetall(VERIFIED_KEY)
+    return {_parse_day(k): v for k, v in (items or {}).items()}
+
+
+async def mark_verified(target_date: datetime.date):
+    # 记录远程校验通过的日期，历史的覆盖范围只增不减
+    await cache.sys.hset(
+        VERIFIED_KEY,
+        target_date.strftime("%Y-%m-%d"),
+        datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    )
+
+
+def _parse_day(value: str) -> datetime.date:
+    return datetime.datetime.strptime(value[:10], "%Y-%m-%d").date()
+
+
+async def get_coverage_scores(d0: datetime.date, d1: datetime.date):
+    """1分钟线相对日线缺失或者不完整的证券数，按log计分"""
+    try:
+        await BarsCoverage.load(FrameType.DAY)
+        await BarsCoverage.load(FrameType.MIN1)
+        gaps = BarsCoverage.find_gaps(d0, d1, FrameType.MIN1)
+    except Exception as e:
+        logger.warning("failed to load coverage, signal ignored: %s", e)
+        return {}
+
+    return {dt: np.log1p(len(secs)) for dt, secs in gaps.items()}
+
+
+async def get_listing_change_days(days: List[datetime.date]) -> set:
+    """有证券上市或者退市的日期，以及前后各一个交易日"""
+    index = await get_listing_index()
+    if index is None:
+        return set()
+
+    _days = np.array(days, dtype="datetime64[D]")
+    changed = np.isin(_days, index.start) | np.isin(_days, index.end)
+
+    result = set()
+    for dt in _days[changed].astype(datetime.date).tolist():
+        result.update([TimeFrame.day_shift(dt, -1), dt, TimeFrame.day_shift(dt, 1)])
+    return result
+
+
+async def get_xrxd_counts(d0: datetime.date, d1: datetime.date):
+    """[d0, d1]之间每天的除权除息公告数"""
+    client = get_influx_client()
+    flux = (
+        Flux()
+        .measurement("security_xrxd_reports")
+        .range(
+            datetime.datetime.combine(d0, datetime.time(0, 0, 0)),
+            datetime.datetime.combine(d1, datetime.time(23, 59, 59)),
+        )
+        .bucket(client._bucket)
+        .fields(["info"])
+    )
+
+    try:
+        data = await traced_query(client, flux)
+        if len(data) == 2:  # \r\n
+            return {}
+
+        ds = DataframeDeserializer(usecols=["_time", "code"], time_col="_time")
+        reports = traced_deserialize(ds, data)
+    except Exception as e:
+        logger.warning("failed to query xrxd reports, signal ignored: %s", e)
+        return {}
+
+    days, counts = np.unique(
+        reports["_time"].values.astype("datetime64[D]"), return_counts=True
+    )
+    return dict(zip(days.astype(datetime.date).tolist(), counts.tolist()))
+
+
+async def score_days(days: List[datetime.date]) -> Dict[datetime.date, float]:
+    """按本地的元数据给候选日期打分，分数越高越需要远程校验"""
+    if len(days) == 0:
+        return {}
+
+    d0, d1 = min(days), max(days)
+    issues = await get_days_with_issues()
+    verified = await get_verified_days()
+    gaps = await get_coverage_scores(d0, d1)
+    listing = await get_listing_change_days(days)
+    xrxd = await get_xrxd_counts(d0, d1)
+
+    scores = {}
+    for dt in days:
+        score = 0.0
+        if dt in issues:
+            score += WEIGHT_PREVIOUS_FAILURE
+        score += WEIGHT_COVERAGE_GAP * gaps.get(dt, 0.0)
+        if dt in listing:
+            score += WEIGHT_LISTING_CHANGE
+        score += WEIGHT_XRXD * np.log1p(xrxd.get(dt, 0))
+        if dt not in verified:
+            score += WEIGHT_NEVER_VERIFIED
+        scores[dt] = score
+
+    return scores
+
+
+async def plan_scanning_days(
+    days: List[datetime.date], budget: int = 2, include_issues: bool = True
+) -> List[datetime.date]:
+    """从候选日期中选出budget个风险最高的日期
+
+    include_issues为True时，days中之前失败且还没有验证通过的日期不占用budget，总是
+    加入计划。只限于days中的日期，一直无法通过的日期不会挤掉其它日期，覆盖范围仍然
+    每次增长。分数相同时按日期从新到旧选择，保证未验证的日期被依次覆盖，而不是随机抽取。
+    """
+    if len(days) == 0:
+        return []
+
+    scores = await score_days(days)
+    ranked = sorted(set(days), key=lambda x: (scores[x], x), reverse=True)
+    plan = ranked[:budget]
+    if include_issues:
+        issues = await get_days_with_issues()
+        plan.extend([x for x in ranked[budget:] if x in issues])
+
+    for dt in plan:
+        logger.info("planned for scanning: %s, score %.2f", dt, scores[dt])
+
+    return plan
@@ -10,23 +10,22 @@ from omicron.extensions.decimals import math_round
 from omicron.models.security import Security
 from omicron.models.timeframe import TimeFrame
 
+from code_table import code_difference
 from datascan.index_secs import get_index_sec_whitelist
+from tracing import traced_sync
 
 logger = logging.getLogger(__name__)
 
 
 def get_secs_from_bars(all_secs_in_bars):
-    secs_in_bars = set()
-    for sec in all_secs_in_bars:
-        code = sec[1]
-        secs_in_bars.add(code)
-
-    return secs_in_bars
+    # 第二列为证券代码，整列去重，不再逐条遍历
+    codes = all_secs_in_bars[all_secs_in_bars.dtype.names[1]]
+    return set(np.unique(codes.astype("U11")).tolist())
 
 
 def _compare_secs(secs_in_db, secs_in_jq):
     # 检查是否有多余的股票
-    x1 = secs_in_db.difference(secs_in_jq)
+    x1 = set(code_difference(secs_in_db, secs_in_jq).tolist())
     if len(x1) > 0:  # 本地数据库中多余的股票或指数
         if "000985.XSHG" in x1:
             logger.info("skip index 000985.XSHG...")
@@ -35,7 +34,7 @@ def _compare_secs(secs_in_db, secs_in_jq):
             logger.info(x1)
             return False
 
-    y1 = secs_in_jq.difference(secs_in_db)
+    y1 = set(code_difference(secs_in_jq, secs_in_db).tolist())
     if len(y1) > 0:  # 本地数据库中多余的股票或指数
         logger.error("secs in jq but not in bars:1d, %s", y1)
         if y1 in get_index_sec_whitelist():
@@ -111,6 +110,7 @@ def _compare_sec_data_pricelimits(sec_data_db, sec_data_jq, is_index):
     return True
 
 
+@traced_sync("compare")
 def compare_bars_for_openclose(
     secs_in_db, data_in_db, data_in_jq, all_index, index_whitelist
 ):
@@ -146,6 +146,7 @@ def compare_bars_for_openclose(
     return True
 
 
+@traced_sync("compare")
 def compare_bars_for_pricelimits(
     secs_in_db, data_in_db, data_in_jq, all_index, index_whitelist
 ):
@@ -246,6 +247,7 @@ def _compare_sec_data_mW(sec_data_db, sec_data_jq):
     return True
 
 
+@traced_sync("compare")
 def compare_bars_wM_for_openclose(secs_in_db, data_in_db, data_in_jq):
     # influxdb取回的数据是f8，并且是rec.array的数组
     # jq fetcher取回的数据是字典，key为股票代码，value是np.array，f4
@@ -14,31 +14,29 @@ from omicron.models.timeframe import TimeFrame as tf
 
 from datascan.index_secs import get_index_sec_whitelist
 from fetchers.abstract_quotes_fetcher import AbstractQuotesFetcher
+from influx_data.security_list import get_security_list
 
 logger = logging.getLogger(__name__)
 
 
 def split_securities_by_type_nparray(all_secs_in_cache):
-    all_secs = set()
-    all_indexes = set()
-    for sec in all_secs_in_cache:
-        code = sec[0]
-        _type = sec[5]
-        if _type == "stock":
-            all_secs.add(code)
-        elif _type == "index":
-            all_indexes.add(code)
+    # 第一列为代码，第六列为类型，按列过滤
+    names = all_secs_in_cache.dtype.names
+    codes = all_secs_in_cache[names[0]].astype("U11")
+    types = all_secs_in_cache[names[5]].astype("U8")
 
+    all_secs = set(codes[types == "stock"].tolist())
+    all_indexes = set(codes[types == "index"].tolist())
     return all_secs, all_indexes
 
 
 async def get_security_list_db(target_date: datetime.date, sec_type: str):
-    all_secs_in_cache = await Security.select(target_date).types([sec_type]).eval()
-    if all_secs_in_cache is None or len(all_secs_in_cache) < 10:
+    all_secs_in_cache = await get_security_list(target_date, sec_type)
+    if all_secs_in_cache is None:
         logger.error("failed to query securities from db, %s", target_date)
         return None
 
-    return set(all_secs_in_cache)
+    return all_secs_in_cache
 
 
 async def get_security_list_jq(target_date: datetime.date):
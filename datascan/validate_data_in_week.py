@@ -3,17 +3,22 @@ import logging
 import os
 
 import arrow
-import numpy as np
 from coretypes import FrameType
 from omicron.dal.cache import cache
 from omicron.models.timeframe import TimeFrame
 
+from datascan.cross_frame_check import validate_cross_frames
 from datascan.day_check import get_all_secs_in_bars1d_db, validate_day_bars
 from datascan.minute_check import validate_minute_bars, validate_minute_bars_simple
+from datascan.minute_sampling import validate_minute_values_sampled
 from datascan.month_check import validate_data_bars1M
+from datascan.sampling_planner import mark_verified, plan_scanning_days
 from datascan.security_list_check import validate_security_list
 from datascan.week_check import validate_data_bars1w
 from fetchers.abstract_quotes_fetcher import AbstractQuotesFetcher
+from fetchers.quota_budget import quota_budget
+from scheduler import is_shutdown_requested
+from tracing import count
 
 logger = logging.getLogger(__name__)
 
@@ -55,17 +60,14 @@ async def check_running_conditions(instance):
     dt2 = datetime.time(23, 0, 0)
 
     now = datetime.datetime.now()
-    now = datetime.datetime(2022, 7, 15, 18, 1, 0)
     nowtime = now.time()
 
     if nowtime < dt1 or nowtime > dt2:
         return False
 
-    quota = await instance.get_quota()
-    # quota = {"spare": 5000000}
-    logger.info("current quota: %d", quota["spare"])
-    if quota["spare"] < 10 * 10000:
-        logger.error("quota less than 10,0000, break...")
+    spare = await quota_budget.get_spare(AbstractQuotesFetcher._instances)
+    if spare < quota_budget.min_reserve:
+        logger.error("quota less than %d, break...", quota_budget.min_reserve)
         return False
 
     return True
@@ -80,8 +82,7 @@ async def get_scope_for_first_running(scanning_type: int, start: datetime.date):
         w0d1 = TimeFrame.day_shift(start, -6)
 
     days = TimeFrame.get_frames(w0d0, w0d1, FrameType.DAY)
-    _nplist = np.random.choice(days, 2, replace=False)
-    return _nplist.tolist()
+    return await plan_scanning_days([TimeFrame.int2date(x) for x in days])
 
 
 async def get_scope_for_next_running(
@@ -92,8 +93,8 @@ async def get_scope_for_next_running(
         days = TimeFrame.get_frames(_new_start, last_trade_day, FrameType.DAY)
         if days is None or len(days) < 5:  # 必须最少5天的间隔
             return None
-        _nplist = np.random.choice(days, 2, replace=False)  # 随机取两天
-        return _nplist.tolist()
+        # 按本地信号选出风险最高的两天
+        return await plan_scanning_days([TimeFrame.int2date(x) for x in days])
     else:
         if last_scanning_day < datetime.date(2005, 1, 31):
             return None  # 不再检查
@@ -101,12 +102,11 @@ async def get_scope_for_next_running(
         w0d0 = TimeFrame.day_shift(last_scanning_day, -6)  # 6个交易日之前
         w0d1 = TimeFrame.day_shift(last_scanning_day, -1)
         days = TimeFrame.get_frames(w0d0, w0d1, FrameType.DAY)
-        _nplist = np.random.choice(days, 2, replace=False)
-        return _nplist.tolist()
+        return await plan_scanning_days([TimeFrame.int2date(x) for x in days])
 
 
 async def get_time_scope_for_scanning(scanning_type: int, last_day: datetime.date):
-    # 每个星期随机抽取两天，返回时间节点数组
+    # 每个星期抽取风险最高的两天，返回日期数组
     key = get_scanning_date_cursor(scanning_type)
     date_str = await cache.sys.get(key)
     if not date_str:  # first time running
@@ -189,6 +189,54 @@ async def validate_data_all(target_date: datetime.date):
             logger.error("failed to get bars:%s for date %s", ft.value, target_date)
             return False
 
+        # 证券集合一致之后，抽样比较分钟线的数值
+        report = await validate_minute_values_sampled(
+            target_date, all_stock, all_index, ft
+        )
+        # 个别样本不一致不判定失败，按错误率置信区间的上界判断
+        if report is None or not report["passed"]:
+            logger.error(
+                "sampled validation failed for bars:%s, %s", ft.value, target_date
+            )
+            return False
+
+    return True
+
+
+async def local_scanner_handler(max_days: int = 5):
+    """本地一致性扫描，不消耗quota，发现问题的日期记入data_integrity_results，
+    留给远程扫描重点检查
+    """
+    key = "datascan:cursor:local_check"
+    last_trade_day = TimeFrame.day_shift(datetime.datetime.now(), -1)
+
+    date_str = await cache.sys.get(key)
+    if not date_str:
+        target_day = TimeFrame.day_shift(last_trade_day, 1 - max_days)
+    else:
+        target_day = TimeFrame.day_shift(arrow.get(date_str).date(), 1)
+
+    days = TimeFrame.get_frames(target_day, last_trade_day, FrameType.DAY)
+    for _day in days[:max_days]:
+        _day = TimeFrame.int2date(_day)
+        try:
+            rc = await validate_cross_frames(_day)
+        except Exception as e:
+            logger.error("validate_cross_frames(%s) exception: %s", _day, e)
+            rc = False
+
+        if not rc:
+            await save_days_with_issues(_day)
+            logger.error("cross-frame check failed: %s", _day)
+        else:
+            logger.info("cross-frame check success: %s", _day)
+
+        await cache.sys.set(key, _day.strftime("%Y-%m-%d"))
+        count("days")
+        if is_shutdown_requested():
+            logger.info("shutdown requested, exit")
+            break
+
     return True
 
 
@@ -247,14 +295,7 @@ async def reverse_scanner_handler(scanning_type: int):
                 scanning_type,
             )
             return True
-        # days.sort()
-
-        days = []
-        dt_start = datetime.date(2023, 1, 16)
-        dt_end = datetime.date(2023, 1, 20)
-        while dt_start <= dt_end:
-            days.append(dt_start)
-            dt_start = TimeFrame.day_shift(dt_start, 1)
+        days.sort()
 
         for _day in days:
             # _day = TimeFrame.int2date(_day)
@@ -268,19 +309,21 @@ async def reverse_scanner_handler(scanning_type: int):
                 rc = False
 
             if not rc:
-                # await save_days_with_issues(_day)
+                await save_days_with_issues(_day)
                 logger.error("failed to validate data of %s", _day)
             else:
+                await mark_verified(_day)
                 logger.info("data integrity check success: %s", _day)
 
             # save timestamp
-            # await update_scanning_date(scanning_type, _day)
+            await update_scanning_date(scanning_type, _day)
+            count("days")
 
             # input("next day...")
             # break
 
-        if os.path.exists("/home/app/zillionare/data_scanner/break.txt"):
-            logger.info("break flag detected, exit")
+        if is_shutdown_requested():
+            logger.info("shutdown requested, exit")
             break
 
     return True
@@ -12,6 +12,7 @@ from omicron.models import get_influx_client
 from omicron.models.security import Security
 from omicron.models.timeframe import TimeFrame
 
+from code_table import code_difference
 from datascan.jq_fetcher import get_sec_bars_1w
 from datascan.scanner_utils import compare_bars_wM_for_openclose, get_secs_from_bars
 from datascan.security_list_check import (
@@ -19,6 +20,7 @@ from datascan.security_list_check import (
     split_securities_by_type_nparray,
 )
 from fetchers.abstract_quotes_fetcher import AbstractQuotesFetcher
+from tracing import traced_deserialize, traced_query
 
 logger = logging.getLogger(__name__)
 
@@ -35,7 +37,7 @@ async def get_security_week_bars(start: datetime.datetime, end: datetime.datetim
         .fields(["open", "high", "low", "close", "volume"])
     )
 
-    data = await client.query(flux)
+    data = await traced_query(client, flux)
     if len(data) == 2:  # \r\n
         return []
 
@@ -45,7 +47,7 @@ async def get_security_week_bars(start: datetime.datetime, end: datetime.datetim
         time_col="_time",
         engine="c",
     )
-    actual = ds(data)
+    actual = traced_deserialize(ds, data)
     secs = actual.to_records(index=False)
     return secs
 
@@ -64,8 +66,7 @@ async def scan_bars_1w_for_seclist(d0: datetime.date, d1: datetime.date):
 
 def get_security_difference(secs_in_bars, all_stock, all_index):
     # 检查是否有多余的股票
-    x1 = secs_in_bars.difference(all_stock)
-    y1 = x1.difference(all_index)
+    y1 = code_difference(secs_in_bars, all_stock, all_index)
     if len(y1) > 0:  # 本地数据库中多余的股票或指数
         logger.error("secs in bars:1d but not in jq : %d", len(y1))
         return False
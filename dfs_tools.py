@@ -9,6 +9,7 @@ from coretypes import FrameType, SecurityType
 from omicron.models.timeframe import TimeFrame
 
 from dfs import Storage
+from tracing import span
 
 logger = logging.getLogger(__name__)
 
@@ -76,7 +77,8 @@ async def write_bars_dfs(
         len(binary),
         filename,
     )
-    await dfs.write(filename, binary)
+    with span("dfs.write", rows=len(bars), nbytes=len(binary)):
+        await dfs.write(filename, binary)
 
 
 async def write_price_limits_dfs(
@@ -98,4 +100,5 @@ async def write_price_limits_dfs(
         len(binary),
         filename,
     )
-    await dfs.write(filename, binary)
+    with span("dfs.write", rows=len(bars), nbytes=len(binary)):
+        await dfs.write(filename, binary)
@@ -8,9 +8,11 @@ from omicron.models.timeframe import TimeFrame
 
 from download_bars.get_days import retrieve_bars_1d
 from fetchers.abstract_quotes_fetcher import AbstractQuotesFetcher
-from influx_data.security_list import get_security_list
+from influx_data.security_list import get_security_universe
 from rapidscan.fix_minutes import validate_bars_min
-from time_utils import check_running_conditions, split_securities
+from scheduler import is_shutdown_requested
+from time_utils import check_running_conditions
+from tracing import count
 
 logger = logging.getLogger(__name__)
 
@@ -46,12 +48,12 @@ async def scanner_handler_day():
         logger.info("fetchbars1d, from jq: %s", target_day)
 
         # 读取当天的证券列表
-        all_secs_in_cache = await get_security_list(target_day)
-        if all_secs_in_cache is None:
+        universe = await get_security_universe(target_day)
+        if universe is None:
             logger.error("no security list in date %s", target_day)
             return False
 
-        all_secs, all_indexes = split_securities(all_secs_in_cache)
+        all_secs, all_indexes = universe
         if len(all_secs) == 0 or len(all_indexes) == 0:
             logger.error("no stock or index list in date %s", target_day)
             return False
@@ -63,10 +65,10 @@ async def scanner_handler_day():
 
         # save timestamp
         await cache.sys.set(key, target_day.strftime("%Y-%m-%d"))
-        input("next day...")
+        count("days")
 
-        if os.path.exists("/home/app/zillionare/omega_scanner/break.txt"):
-            logger.info("break flag detected, exit, last day: %s", target_day)
+        if is_shutdown_requested():
+            logger.info("shutdown requested, exit, last day: %s", target_day)
             break
 
     return True
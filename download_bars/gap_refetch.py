@@ -0,0 +1,153 @@
+"""分钟线缺口的定向补齐
+
+数据库中某只证券当天的分钟线不完整时，只下载缺失的时间段，而不是整天重新下载。
+缺失时间段相同的证券合并成一批请求：请求的end为缺口的最后一根bar，n_bars为缺口的
+根数，消耗的quota和缺失的根数成正比。
+"""
+import datetime
+import logging
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+import numpy as np
+from coretypes import FrameType
+from omicron.models.stock import Stock
+
+from datascan.bars_resample import get_security_minutes_full_bars
+from datascan.minute_sampling import get_frames_of_day
+from fetchers.abstract_quotes_fetcher import AbstractQuotesFetcher
+from influx_data.bars_coverage import BarsCoverage
+from tracing import count, span
+
+logger = logging.getLogger(__name__)
+
+# 单次请求的最大根数，和jq_fetcher中的分批大小一致（15*240）
+MAX_BARS_PER_CALL = 3600
+
+# (缺口在当天网格中的起始位置, 结束位置)，左闭右开
+Window = Tuple[int, int]
+
+
+def find_missing_windows(grid: np.ndarray, frames: np.ndarray) -> Tuple[Window]:
+    """grid为当天应有的时间点，frames为数据库中已有的时间点，返回缺失的连续区间"""
+    missing = ~np.isin(grid, frames.astype(grid.dtype))
+    if not np.any(missing):
+        return ()
+
+    # 缺失标志的上升沿和下降沿即为区间的起止
+    edges = np.diff(np.concatenate(([0], missing.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    return tuple(zip(starts.tolist(), ends.tolist()))
+
+
+def find_minute_gaps(
+    codes: List[str], bars: Dict[str, np.ndarray], grid: np.ndarray
+) -> Dict[str, Tuple[Window]]:
+    """每只证券的缺失区间，数据库中完全没有的证券缺失整个交易时段"""
+    full_day = ((0, len(grid)),)
+    gaps = {}
+    for code in codes:
+        if code not in bars or len(bars[code]) == 0:
+            gaps[code] = full_day
+            continue
+
+        windows = find_missing_windows(grid, bars[code]["frame"])
+        if len(windows) > 0:
+            gaps[code] = windows
+    return gaps
+
+
+def plan_refetch(gaps: Dict[str, Tuple[Window]]):
+    """按缺失区间分组，返回[(区间, [[证券]])]，每个区间内的证券再按请求大小分批"""
+    groups = defaultdict(list)
+    for code, windows in gaps.items():
+        for window in windows:
+            groups[window].append(code)
+
+    plan = []
+    for window in sorted(groups.keys()):
+        n_bars = window[1] - window[0]
+        max_secs = max(MAX_BARS_PER_CALL // n_bars, 1)
+        secs = sorted(groups[window])
+        batches = [secs[i : i + max_secs] for i in range(0, len(secs), max_secs)]
+        plan.append((window, batches))
+    return plan
+
+
+async def refetch_windows(plan, grid: np.ndarray, ft: FrameType):
+    """按计划下载，只保留落在缺失区间内的bar，返回{code: [bars]}"""
+    result = defaultdict(list)
+    for (start, end), batches in plan:
+        n_bars = end - start
+        end_dt = grid[end - 1].astype(datetime.datetime)
+        bars = await AbstractQuotesFetcher.get_bars_batches(
+            batches, end_dt, n_bars, ft.value, include_unclosed=True
+        )
+
+        window = grid[start:end]
+        for code, _bars in bars.items():
+            if len(_bars) == 0:
+                continue
+            _bars = _bars[np.isin(_bars["frame"].astype(grid.dtype), window)]
+            _bars = _bars[~np.isnan(_bars["volume"]) & ~np.isnan(_bars["amount"])]
+            if len(_bars) > 0:
+                result[code].append(_bars)
+    return result
+
+
+async def repair_minute_gaps(codes: set, target_date: datetime.date, ft: FrameType):
+    """只补齐codes当天缺失的分钟线，返回补齐之后仍然不完整的证券
+
+    远程也没有数据的时间段（停牌等）无法补齐，由调用者决定如何处理。
+    """
+    grid = get_frames_of_day(target_date, ft)
+    bars = await get_security_minutes_full_bars(list(codes), target_date, ft)
+    gaps = find_minute_gaps(sorted(codes), bars, grid)
+    if len(gaps) == 0:
+        logger.info("bars:%s, no gaps found, %s", ft.value, target_date)
+        return set()
+
+    plan = plan_refetch(gaps)
+    n_missing = sum([y - x for windows in gaps.values() for x, y in windows])
+    logger.info(
+        "bars:%s, %d secs with gaps, %d missing bars in %d windows, %s",
+        ft.value,
+        len(gaps),
+        n_missing,
+        len(plan),
+        target_date,
+    )
+    count("missing_bars", n_missing)
+
+    fetched = await refetch_windows(plan, grid, ft)
+    data = {code: np.concatenate(items) for code, items in fetched.items()}
+    if len(data) > 0:
+        with span("persist_bars", rows=sum([len(x) for x in data.values()])):
+            await Stock.persist_bars(ft, data)
+
+        # 覆盖记录按补齐之后的根数更新
+        merged = {}
+        for code, new_bars in data.items():
+            frames = new_bars["frame"].astype(grid.dtype)
+            if code in bars:
+                frames = np.concatenate(
+                    (bars[code]["frame"].astype(grid.dtype), frames)
+                )
+            merged[code] = np.unique(frames)
+        await BarsCoverage.update(target_date, ft, merged)
+
+    remaining = set()
+    for code, windows in gaps.items():
+        n_fetched = len(data[code]) if code in data else 0
+        if n_fetched < sum([y - x for x, y in windows]):
+            remaining.add(code)
+
+    logger.info(
+        "bars:%s, gaps repaired for %d secs, %d secs still incomplete, %s",
+        ft.value,
+        len(gaps) - len(remaining),
+        len(remaining),
+        target_date,
+    )
+    return remaining
@@ -12,13 +12,23 @@ from omicron.models.stock import Stock
 from omicron.models.timeframe import TimeFrame
 from omicron.models.timeframe import TimeFrame as tf
 
+from datascan.bars_resample import get_security_day_full_bars
 from datascan.jq_fetcher import get_sec_bars_1d, get_sec_bars_pricelimits
 from dfs import Storage
 from dfs_tools import get_trade_limit_filename, write_bars_dfs, write_price_limits_dfs
+from download_bars.journal import ProgressJournal
+from download_bars.pipeline import (
+    log_pipeline_stats,
+    run_branches,
+    run_download_pipeline,
+    run_stage,
+)
+from influx_data.bars_coverage import BarsCoverage
 from influx_data.security_bars_1d import (
     get_security_day_bars,
     get_security_price_limits,
 )
+from tracing import span
 
 logger = logging.getLogger(__name__)
 
@@ -27,7 +37,26 @@ async def get_1d_for_price(
     all_secs_today, target_date: datetime.date, prefix: SecurityType
 ):
     # download all data from jq
-    all_secs_data = await get_sec_bars_1d(all_secs_today, target_date)
+    async def persist(data):
+        with span("persist_bars", rows=sum([len(x) for x in data.values()])):
+            await Stock.persist_bars(FrameType.DAY, data)
+        await BarsCoverage.update(target_date, FrameType.DAY, data)
+
+    async def reload(secs):
+        _start = datetime.datetime.combine(target_date, datetime.time(0, 0, 0))
+        _end = datetime.datetime.combine(target_date, datetime.time(23, 59, 59))
+        return await get_security_day_full_bars(list(secs), _start, _end)
+
+    # 分块下载和入库，入库的同时下载下一块，最后整个周期的数据一次写入dfs
+    # 中途退出后重新运行时，已经入库的块从数据库读回，不再消耗quota
+    journal = ProgressJournal(target_date, FrameType.DAY, prefix)
+    all_secs_data, stats = await run_download_pipeline(
+        all_secs_today,
+        lambda secs: get_sec_bars_1d(secs, target_date),
+        persist,
+        journal=journal,
+        reload=reload,
+    )
     logger.info(
         "total secs downloaded from bars:1d@jq, %d, %s", len(all_secs_data), prefix
     )
@@ -38,7 +67,6 @@ async def get_1d_for_price(
         )
         return False
 
-    await Stock.persist_bars(FrameType.DAY, all_secs_data)
     logger.info(
         "get from bars:1d@jq and saved into db, %s, %s, %d",
         prefix,
@@ -46,7 +74,14 @@ async def get_1d_for_price(
         len(all_secs_data),
     )
 
-    await write_bars_dfs(target_date, FrameType.DAY, all_secs_data, prefix)
+    await run_stage(
+        stats,
+        "dfs",
+        len(all_secs_data),
+        write_bars_dfs(target_date, FrameType.DAY, all_secs_data, prefix),
+    )
+    log_pipeline_stats(stats, "bars:1d")
+    await journal.compact()
 
     logger.info("finished processing bars:1d for %s (%s)", target_date, prefix)
     return True
@@ -82,22 +117,26 @@ async def get_1d_for_pricelimits(
 
 
 async def retrieve_bars_1d(target_day, all_secs, all_indexes):
-    rc = await get_1d_for_price(all_secs, target_day, SecurityType.STOCK)
-    if not rc:
-        logger.error("failed to process stock price data: %s", target_day)
-        return False
-
-    rc = await get_1d_for_price(all_indexes, target_day, SecurityType.INDEX)
-    if not rc:
-        logger.error("failed to process index price data: %s", target_day)
-        return False
-
-    rc = await get_1d_for_pricelimits(all_secs, target_day, SecurityType.STOCK)
+    # 四个分支互相独立，并发执行，任何一个失败则取消其它分支
+    rc = await run_branches(
+        [
+            ("stock price", get_1d_for_price(all_secs, target_day, SecurityType.STOCK)),
+            (
+                "index price",
+                get_1d_for_price(all_indexes, target_day, SecurityType.INDEX),
+            ),
+            (
+                "stock price limits",
+                get_1d_for_pricelimits(all_secs, target_day, SecurityType.STOCK),
+            ),
+            (
+                "index price limits",
+                get_1d_for_pricelimits(all_indexes, target_day, SecurityType.INDEX),
+            ),
+        ]
+    )
     if not rc:
-        logger.error("failed to process stock price limits data: %s", target_day)
+        logger.error("failed to process bars:1d data: %s", target_day)
         return False
 
-    rc = await get_1d_for_pricelimits(all_indexes, target_day, SecurityType.INDEX)
-    if not rc:
-        logger.error("failed to process index price limits data: %s", target_day)
-        return False
+    return True
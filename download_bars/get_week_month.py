@@ -12,50 +12,87 @@ from omicron.models.stock import Stock
 from omicron.models.timeframe import TimeFrame
 from omicron.models.timeframe import TimeFrame as tf
 
-from datascan.jq_fetcher import (
-    get_sec_bars_1d,
-    get_sec_bars_1M,
-    get_sec_bars_1w,
-    get_sec_bars_pricelimits,
-)
+from datascan.bars_resample import get_sec_bars_period_local
+from datascan.jq_fetcher import get_sec_bars_1d, get_sec_bars_pricelimits
 from dfs import Storage
 from dfs_tools import get_trade_limit_filename, write_bars_dfs, write_price_limits_dfs
+from download_bars.pipeline import (
+    log_pipeline_stats,
+    run_branches,
+    run_download_pipeline,
+    run_stage,
+)
+from influx_data.bars_coverage import BarsCoverage
+from influx_data.listing_index import get_listing_index
 from influx_data.security_bars_1d import (
     get_security_day_bars,
     get_security_price_limits,
 )
-from influx_data.security_list import get_security_list
+from influx_data.security_list import get_security_universe
 from time_utils import split_securities
+from tracing import span
 
 logger = logging.getLogger(__name__)
 
 
+async def get_period_universe(d0: datetime.date, d1: datetime.date):
+    """[d0, d1]之间任何一天处于上市状态的股票和指数，包括期间退市的证券
+
+    优先使用上市区间索引，不需要查询数据库，否则合并第一天和最后一天的证券列表
+    """
+    listing = await get_listing_index()
+    if listing is not None:
+        return listing.universe_between(d0, d1)
+
+    universe_0 = await get_security_universe(d0)
+    universe_1 = await get_security_universe(d1)
+    if universe_0 is None or universe_1 is None:
+        return None
+
+    return tuple([x.union(y) for x, y in zip(universe_0, universe_1)])
+
+
 async def get_1w_for_price(
     all_secs_today, target_date: datetime.date, d0: datetime.date, prefix: SecurityType
 ):
     # d0: 本周第一天, target_date：本周最后一天
 
-    # download all data from jq
-    all_secs_data = await get_sec_bars_1w(all_secs_today, target_date, d0)
+    # 用数据库中的日线合成，不需要远程下载
+    async def persist(data):
+        with span("persist_bars", rows=sum([len(x) for x in data.values()])):
+            await Stock.persist_bars(FrameType.WEEK, data)
+        await BarsCoverage.update(target_date, FrameType.WEEK, data)
+
+    # 分块下载和入库，入库的同时下载下一块，最后整个周期的数据一次写入dfs
+    all_secs_data, stats = await run_download_pipeline(
+        all_secs_today,
+        lambda secs: get_sec_bars_period_local(secs, target_date, d0, FrameType.WEEK),
+        persist,
+    )
     logger.info(
-        "total secs downloaded from bars:1w@jq, %d, %s", len(all_secs_data), prefix
+        "total secs aggregated into bars:1w, %d, %s", len(all_secs_data), prefix
     )
 
     if len(all_secs_data) == 0:
         logger.error(
-            "failed to get price data from bars:1w@jq, %s (%s)", target_date, prefix
+            "failed to aggregate price data for bars:1w, %s (%s)", target_date, prefix
         )
         return False
 
-    await Stock.persist_bars(FrameType.WEEK, all_secs_data)
     logger.info(
-        "get from bars:1w@jq and saved into db, %s, %s, %d",
+        "aggregated bars:1w and saved into db, %s, %s, %d",
         prefix,
         FrameType.WEEK,
         len(all_secs_data),
     )
 
-    await write_bars_dfs(target_date, FrameType.WEEK, all_secs_data, prefix)
+    await run_stage(
+        stats,
+        "dfs",
+        len(all_secs_data),
+        write_bars_dfs(target_date, FrameType.WEEK, all_secs_data, prefix),
+    )
+    log_pipeline_stats(stats, "bars:1w")
 
     logger.info("finished processing bars:1w for %s (%s)", target_date, prefix)
     return True
@@ -74,14 +111,11 @@ async def retrieve_bars_1w(target_day, all_secs, all_indexes):
     logger.info("first and last day of week: %s, %s", w1d0, target_day)
 
     if w1d0 != target_day:
-        all_secs_0 = await get_security_list(w1d0, "stock")
-        if all_secs_0 is None:
-            logger.error("no security list in date %s", w1d0)
-            return False
-        all_indexes_0 = await get_security_list(w1d0, "index")
-        if all_indexes_0 is None:
+        universe = await get_period_universe(w1d0, target_day)
+        if universe is None:
             logger.error("no security list in date %s", w1d0)
             return False
+        all_secs_0, all_indexes_0 = universe
 
         if len(all_secs_0) == 0 or len(all_indexes_0) == 0:
             logger.error("no stock or index list in date %s", w1d0)
@@ -91,16 +125,22 @@ async def retrieve_bars_1w(target_day, all_secs, all_indexes):
         all_stock_secs = all_secs.union(all_secs_0)
         all_index_secs = all_indexes.union(all_indexes_0)
 
-    print(len(all_stock_secs), len(all_index_secs))
-
-    rc = await get_1w_for_price(all_secs, target_day, w1d0, SecurityType.STOCK)
-    if not rc:
-        logger.error("failed to process stock price data (week): %s", target_day)
-        return False
-
-    rc = await get_1w_for_price(all_indexes, target_day, w1d0, SecurityType.INDEX)
+    logger.info("secs in week: %d, %d", len(all_stock_secs), len(all_index_secs))
+
+    rc = await run_branches(
+        [
+            (
+                "stock price",
+                get_1w_for_price(all_stock_secs, target_day, w1d0, SecurityType.STOCK),
+            ),
+            (
+                "index price",
+                get_1w_for_price(all_index_secs, target_day, w1d0, SecurityType.INDEX),
+            ),
+        ]
+    )
     if not rc:
-        logger.error("failed to process index price data (week): %s", target_day)
+        logger.error("failed to process price data (week): %s", target_day)
         return False
 
     return True
@@ -111,27 +151,42 @@ async def get_1M_for_price(
 ):
     # d0: 本月第一天, target_date：本月最后一天
 
-    # download all data from jq
-    all_secs_data = await get_sec_bars_1M(all_secs_today, target_date, d0)
+    # 用数据库中的日线合成，不需要远程下载
+    async def persist(data):
+        with span("persist_bars", rows=sum([len(x) for x in data.values()])):
+            await Stock.persist_bars(FrameType.MONTH, data)
+        await BarsCoverage.update(target_date, FrameType.MONTH, data)
+
+    # 分块下载和入库，入库的同时下载下一块，最后整个周期的数据一次写入dfs
+    all_secs_data, stats = await run_download_pipeline(
+        all_secs_today,
+        lambda secs: get_sec_bars_period_local(secs, target_date, d0, FrameType.MONTH),
+        persist,
+    )
     logger.info(
-        "total secs downloaded from bars:1M@jq, %d, %s", len(all_secs_data), prefix
+        "total secs aggregated into bars:1M, %d, %s", len(all_secs_data), prefix
     )
 
     if len(all_secs_data) == 0:
         logger.error(
-            "failed to get price data from bars:1M@jq, %s (%s)", target_date, prefix
+            "failed to aggregate price data for bars:1M, %s (%s)", target_date, prefix
         )
         return False
 
-    await Stock.persist_bars(FrameType.MONTH, all_secs_data)
     logger.info(
-        "get from bars:1M@jq and saved into db, %s, %s, %d",
+        "aggregated bars:1M and saved into db, %s, %s, %d",
         prefix,
         FrameType.MONTH,
         len(all_secs_data),
     )
 
-    await write_bars_dfs(target_date, FrameType.MONTH, all_secs_data, prefix)
+    await run_stage(
+        stats,
+        "dfs",
+        len(all_secs_data),
+        write_bars_dfs(target_date, FrameType.MONTH, all_secs_data, prefix),
+    )
+    log_pipeline_stats(stats, "bars:1M")
 
     logger.info("finished processing bars:1M for %s (%s)", target_date, prefix)
     return True
@@ -150,15 +205,11 @@ async def retrieve_bars_month(target_day, all_secs, all_indexes):
     print("first and last day of month: ", m1d0, target_day)
 
     if m1d0 != target_day:
-        all_secs_0 = await get_security_list(m1d0, "stock")
-        if all_secs_0 is None:
-            logger.error("no security list in date %s", m1d0)
-            return False
-
-        all_indexes_0 = await get_security_list(m1d0, "index")
-        if all_indexes_0 is None:
+        universe = await get_period_universe(m1d0, target_day)
+        if universe is None:
             logger.error("no security list in date %s", m1d0)
             return False
+        all_secs_0, all_indexes_0 = universe
 
         if len(all_secs_0) == 0 or len(all_indexes_0) == 0:
             logger.error("no stock or index list in date %s", m1d0)
@@ -168,16 +219,22 @@ async def retrieve_bars_month(target_day, all_secs, all_indexes):
         all_stock_secs = all_secs.union(all_secs_0)
         all_index_secs = all_indexes.union(all_indexes_0)
 
-    print(len(all_stock_secs), len(all_index_secs))
-
-    rc = await get_1M_for_price(all_secs, target_day, m1d0, SecurityType.STOCK)
-    if not rc:
-        logger.error("failed to process stock price data (week): %s", target_day)
-        return False
-
-    rc = await get_1M_for_price(all_indexes, target_day, m1d0, SecurityType.INDEX)
+    logger.info("secs in month: %d, %d", len(all_stock_secs), len(all_index_secs))
+
+    rc = await run_branches(
+        [
+            (
+                "stock price",
+                get_1M_for_price(all_stock_secs, target_day, m1d0, SecurityType.STOCK),
+            ),
+            (
+                "index price",
+                get_1M_for_price(all_index_secs, target_day, m1d0, SecurityType.INDEX),
+            ),
+        ]
+    )
     if not rc:
-        logger.error("failed to process index price data (week): %s", target_day)
+        logger.error("failed to process price data (month): %s", target_day)
         return False
 
     return True
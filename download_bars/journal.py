@@ -0,0 +1,60 @@
+import datetime
+import hashlib
+import logging
+from typing import List, Set
+
+from coretypes import FrameType, SecurityType
+from omicron.dal.cache import cache
+from omicron.models.timeframe import TimeFrame
+
+logger = logging.getLogger(__name__)
+
+
+def get_journal_keyname(dt: datetime.date, ft: FrameType, prefix: SecurityType):
+    return "datascan:journal:%s:%s:%d" % (
+        ft.value,
+        prefix.value,
+        TimeFrame.date2int(dt),
+    )
+
+
+def get_chunk_id(secs: List[str]):
+    # 块的内容决定id，证券列表或者分块大小变化后不会误用旧的记录
+    _secs = sorted(secs)
+    digest = hashlib.md5(",".join(_secs).encode("utf-8")).hexdigest()[:12]
+    return "%s:%d:%s" % (_secs[0], len(_secs), digest)
+
+
+class ProgressJournal(object):
+    """记录某一天某个周期已经入库的块，中途退出后重新运行时跳过这些块
+
+    每块入库之后用一条hset记录（单条命令，原子写入），当天的数据全部完成后删除整个记录。
+    """
+
+    def __init__(self, dt: datetime.date, ft: FrameType, prefix: SecurityType):
+        self.dt = dt
+        self.ft = ft
+        self.key = get_journal_keyname(dt, ft, prefix)
+        self.completed: Set[str] = set()
+
+    async def load(self):
+        items = await cache.sys.hgetall(self.key)
+        self.completed = set(items.keys()) if items else set()
+        if len(self.completed) > 0:
+            logger.info(
+                "journal %s: %d chunks completed before", self.key, len(self.completed)
+            )
+        return self.completed
+
+    def is_completed(self, secs: List[str]):
+        return get_chunk_id(secs) in self.completed
+
+    async def mark(self, secs: List[str]):
+        chunk_id = get_chunk_id(secs)
+        await cache.sys.hset(self.key, chunk_id, len(secs))
+        self.completed.add(chunk_id)
+
+    async def compact(self):
+        # 当天完成之后由游标记录进度，块的记录不再需要
+        await cache.sys.delete(self.key)
+        self.completed = set()
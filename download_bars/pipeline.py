@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class StageStats(object):
+    def __init__(self, name: str):
+        self.name = name
+        self.chunks = 0
+        self.secs = 0
+        self.elapsed = 0.0
+
+    def add(self, secs: int, elapsed: float):
+        self.chunks += 1
+        self.secs += secs
+        self.elapsed += elapsed
+
+    def throughput(self):
+        if self.elapsed == 0:
+            return 0.0
+        return self.secs / self.elapsed
+
+    def __str__(self):
+        return "%s: %d chunks, %d secs, %.2fs, %.1f secs/s" % (
+            self.name,
+            self.chunks,
+            self.secs,
+            self.elapsed,
+            self.throughput(),
+        )
+
+
+async def run_download_pipeline(
+    secs: set,
+    fetch: Callable[[set], Awaitable[Dict[str, np.ndarray]]],
+    persist: Callable[[Dict[str, np.ndarray]], Awaitable],
+    chunk_size: int = 1000,
+    max_pending: int = 2,
+    journal=None,
+    reload: Callable[[set], Awaitable[Dict[str, np.ndarray]]] = None,
+):
+    """分块下载并保存数据，保存第N块的同时下载第N+1块
+
+    队列中最多缓存max_pending块还没保存的数据，下载太快时会等待保存完成。
+    指定journal（ProgressJournal）时，每块入库后记入journal，journal中已完成的块
+    不再下载，用reload从数据库读回（用于最后写入dfs）。
+
+    Returns:
+        所有块合并后的数据（用于最后写入dfs）和各阶段的统计
+    """
+    _secs = sorted(secs)
+    chunks = [_secs[i : i + chunk_size] for i in range(0, len(_secs), chunk_size)]
+
+    queue = asyncio.Queue(maxsize=max_pending)
+    stats = {"fetch": StageStats("fetch"), "persist": StageStats("persist")}
+    all_data = {}
+
+    if journal is not None:
+        await journal.load()
+
+    async def producer():
+        for chunk in chunks:
+            t0 = time.time()
+            if (
+                journal is not None
+                and reload is not None
+                and journal.is_completed(chunk)
+            ):
+                data = await reload(set(chunk))
+                get_stage_stats(stats, "reload").add(len(data), time.time() - t0)
+                await queue.put((chunk, data, False))
+                continue
+
+            data = await fetch(set(chunk))
+            stats["fetch"].add(len(data), time.time() - t0)
+            await queue.put((chunk, data, True))
+
+        # 出错时不放入结束标志，consumer由下面的cancel结束
+        await queue.put(None)
+
+    async def consumer():
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            chunk, data, need_persist = item
+            if len(data) == 0:
+                continue
+
+            if need_persist:
+                t0 = time.time()
+                await persist(data)
+                stats["persist"].add(len(data), time.time() - t0)
+                if journal is not None:
+                    await journal.mark(chunk)
+            all_data.update(data)
+
+    # 任何一个阶段出错都会取消另外一个，等待取消完成后再返回，不留下阻塞的task
+    tasks = [asyncio.ensure_future(producer()), asyncio.ensure_future(consumer())]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+    return all_data, stats
+
+
+def get_stage_stats(stats: Dict[str, StageStats], name: str):
+    if name not in stats:
+        stats[name] = StageStats(name)
+    return stats[name]
+
+
+async def run_stage(stats: Dict[str, StageStats], name: str, secs: int, coro):
+    # 流水线之外的阶段（比如写入dfs）也记入统计
+    t0 = time.time()
+    result = await coro
+    get_stage_stats(stats, name).add(secs, time.time() - t0)
+    return result
+
+
+def log_pipeline_stats(stats: Dict[str, StageStats], name: str):
+    for stage in stats.values():
+        logger.info("pipeline %s, %s", name, stage)
+
+
+async def run_branches(branches: List, max_concurrency: int = 4):
+    """并发执行几个互相独立的下载分支（股票/指数，价格/涨跌停）
+
+    Args:
+        branches: [(name, coro), ...]，coro返回False或者抛出异常都算失败
+        max_concurrency: 同时运行的分支数
+
+    任何一个分支失败都会取消其它分支，最后统一汇报所有失败的分支。
+    """
+    sem = asyncio.Semaphore(max_concurrency)
+
+    async def run_branch(coro):
+        try:
+            async with sem:
+                return await coro
+        finally:
+            coro.close()  # 在等待sem时被取消的分支，避免coroutine never awaited
+
+    tasks = {asyncio.ensure_future(run_branch(coro)): name for name, coro in branches}
+    errors = []
+
+    pending = set(tasks.keys())
+    while len(pending) > 0 and len(errors) == 0:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is not None:
+                errors.append((tasks[task], task.exception()))
+            elif not task.result():
+                errors.append((tasks[task], "returned False"))
+
+    if len(pending) > 0:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    for name, e in errors:
+        logger.error("branch failed: %s, %s", name, e)
+    if len(pending) > 0:
+        logger.error("branches cancelled: %s", [tasks[x] for x in pending])
+
+    return len(errors) == 0
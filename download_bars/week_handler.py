@@ -7,9 +7,10 @@ from omicron.dal.cache import cache
 from omicron.models.timeframe import TimeFrame
 
 from download_bars.get_week_month import retrieve_bars_1w, retrieve_bars_month
-from fetchers.abstract_quotes_fetcher import AbstractQuotesFetcher
-from influx_data.security_list import get_security_list
-from time_utils import check_running_conditions, get_cache_keyname
+from influx_data.security_list import get_security_universe
+from scheduler import is_shutdown_requested
+from time_utils import get_cache_keyname
+from tracing import count
 
 logger = logging.getLogger(__name__)
 
@@ -24,17 +25,11 @@ async def week_download_handler():
     else:
         target_day = arrow.get(start_str).date()
 
-    instance = AbstractQuotesFetcher.get_instance()
-
     while True:
         if target_day <= datetime.date(2005, 1, 7):  # 第一周
             logger.info("all weeks re-downloaded: %s", target_day)
             break
 
-        rc = await check_running_conditions(instance)
-        if rc is False:
-            return False
-
         if not TimeFrame.is_trade_day(target_day):  # 节假日取临近的交易日，启动日期永远是周末
             target_day = TimeFrame.day_shift(target_day, 0)
         else:
@@ -42,14 +37,11 @@ async def week_download_handler():
         logger.info("fetchbars1w, from jq: %s", target_day)
 
         # 读取当天的证券列表
-        all_secs = await get_security_list(target_day, "stock")
-        if all_secs is None:
-            logger.error("no security list in date %s", target_day)
-            return False
-        all_indexes = await get_security_list(target_day, "index")
-        if all_indexes is None:
+        universe = await get_security_universe(target_day)
+        if universe is None:
             logger.error("no security list in date %s", target_day)
             return False
+        all_secs, all_indexes = universe
 
         if len(all_secs) == 0 or len(all_indexes) == 0:
             logger.error("no stock or index list in date %s", target_day)
@@ -63,8 +55,13 @@ async def week_download_handler():
 
         # save timestamp
         await cache.sys.set(key, target_day.strftime("%Y-%m-%d"))
+        count("days")
         # input("next week day...")
 
+        if is_shutdown_requested():
+            logger.info("shutdown requested, exit, last day: %s", target_day)
+            break
+
     return True
 
 
@@ -78,17 +75,11 @@ async def month_download_handler():
     else:
         target_day = arrow.get(start_str).date()
 
-    instance = AbstractQuotesFetcher.get_instance()
-
     while True:
         if target_day <= datetime.date(2005, 1, 31):  # 第一月
             logger.info("all months re-downloaded: %s", target_day)
             break
 
-        rc = await check_running_conditions(instance)
-        if rc is False:
-            return False
-
         if not TimeFrame.is_trade_day(target_day):  # 节假日取临近的交易日，启动日期永远是周末
             target_day = TimeFrame.month_shift(target_day, 0)
         else:
@@ -96,14 +87,11 @@ async def month_download_handler():
         logger.info("fetchbars1M, from jq: %s", target_day)
 
         # 读取当天的证券列表
-        all_secs = await get_security_list(target_day, "stock")
-        if all_secs is None:
-            logger.error("no security list in date %s", target_day)
-            return False
-        all_indexes = await get_security_list(target_day, "index")
-        if all_indexes is None:
+        universe = await get_security_universe(target_day)
+        if universe is None:
             logger.error("no security list in date %s", target_day)
             return False
+        all_secs, all_indexes = universe
 
         if len(all_secs) == 0 or len(all_indexes) == 0:
             logger.error("no stock or index list in date %s", target_day)
@@ -117,6 +105,11 @@ async def month_download_handler():
 
         # save timestamp
         await cache.sys.set(key, target_day.strftime("%Y-%m-%d"))
+        count("days")
         # input("next month day...")
 
+        if is_shutdown_requested():
+            logger.info("shutdown requested, exit, last day: %s", target_day)
+            break
+
     return True
@@ -1,8 +1,8 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import datetime
 import importlib
 import logging
-import random
 from typing import Dict, List, Optional, Union
 
 import cfg4py
@@ -10,7 +10,11 @@ import numpy as np
 from coretypes import Frame, FrameType
 from omicron.models.timeframe import TimeFrame
 
+from fetchers.fetcher_pool import FetcherPool
+from fetchers.quota_budget import QuotaExhaustedError, quota_budget
+from fetchers.quotes_cache import CachedQuotesFetcher, QuotesCache
 from fetchers.quotes_fetcher import QuotesFetcher
+from tracing import span
 
 logger = logging.getLogger(__file__)
 
@@ -19,6 +23,8 @@ cfg = cfg4py.get_instance()
 
 class AbstractQuotesFetcher(QuotesFetcher):
     _instances = []
+    _pool = FetcherPool()
+    _cache = None
 
     @classmethod
     async def create_instance(cls, module_name, **kwargs):
@@ -32,16 +38,101 @@ class AbstractQuotesFetcher(QuotesFetcher):
 
         impl: QuotesFetcher = await factory_method(**kwargs)
         cls._instances.append(impl)
+        cls._pool.add(impl)
         logger.info("add one quotes worker implementor: %s", module_name)
 
+        if cls._cache is None:
+            cls._cache = QuotesCache.from_config()
+
+        return impl
+
     @classmethod
-    def get_instance(cls):
+    def get_instance(cls, bypass_cache=False):
         if len(cls._instances) == 0:
             raise IndexError("No fetchers available")
 
-        i = random.randint(0, len(cls._instances) - 1)
+        # 选择剩余quota最多、负载最低的账号
+        impl = cls._pool.select().impl
+
+        if cls._cache is None or bypass_cache:
+            return impl
+        return CachedQuotesFetcher(impl, cls._cache)
+
+    @classmethod
+    def _wrap(cls, impl):
+        if cls._cache is None:
+            return impl
+        return CachedQuotesFetcher(impl, cls._cache)
+
+    @classmethod
+    async def get_bars_batches(
+        cls,
+        batches: List[List[str]],
+        end: Frame,
+        n_bars: int,
+        frame_type: str,
+        include_unclosed=True,
+        fq_ref_enabled=False,
+    ) -> Dict[str, np.ndarray]:
+        """把多批证券并行分配到各个账号上下载，返回合并后的结果
+
+        额度不足时抛出QuotaExhaustedError，不能返回空结果，否则调用者会把剩下的
+        证券当作没有数据，把当天标记为已完成。
+        """
+        cost = sum([quota_budget.estimate_cost(n_bars, len(x)) for x in batches])
+        if not quota_budget.reserve(cost):
+            logger.error(
+                "not enough quota for %d rows, available: %d",
+                cost,
+                quota_budget.available(),
+            )
+            raise QuotaExhaustedError("not enough quota for %d rows" % cost)
+
+        async def fetch(secs):
+            _cost = quota_budget.estimate_cost(n_bars, len(secs))
+            fetchers = []
+
+            def wrap(impl):
+                fetcher = cls._wrap(impl)
+                fetchers.append(fetcher)
+                return fetcher
+
+            bars = await cls._pool.call(
+                "get_bars_batch",
+                secs,
+                end,
+                n_bars,
+                frame_type,
+                include_unclosed,
+                fq_ref_enabled,
+                cost=_cost,
+                wrap=wrap,
+            )
+            # 最后一个fetcher是成功的那次调用，命中本地缓存时不消耗quota
+            if not getattr(fetchers[-1], "cache_hit", False):
+                quota_budget.debit(_cost)
+            return bars
+
+        try:
+            results = await asyncio.gather(*[fetch(secs) for secs in batches])
+        finally:
+            quota_budget.release(cost)
+
+        all_bars = {}
+        for bars in results:
+            all_bars.update(bars)
+
+        return all_bars
+
+    @classmethod
+    def get_pool_stats(cls):
+        return cls._pool.get_stats()
 
-        return cls._instances[i]
+    @classmethod
+    def get_cache_stats(cls):
+        if cls._cache is None:
+            return {}
+        return cls._cache.get_stats()
 
     @classmethod
     async def get_security_list(cls, date: datetime.date) -> Union[None, np.ndarray]:
@@ -89,9 +180,12 @@ class AbstractQuotesFetcher(QuotesFetcher):
         include_unclosed=True,
         fq_ref_enabled=False,
     ) -> Dict[str, np.ndarray]:
-        return await cls.get_instance().get_bars_batch(
-            secs, end, n_bars, frame_type.value, include_unclosed, fq_ref_enabled
-        )
+        with span("fetch.get_bars_batch") as s:
+            bars = await cls.get_instance().get_bars_batch(
+                secs, end, n_bars, frame_type.value, include_unclosed, fq_ref_enabled
+            )
+            s.rows = len(bars) if bars is not None else 0
+            return bars
 
     @classmethod
     async def get_price(
@@ -120,13 +214,22 @@ class AbstractQuotesFetcher(QuotesFetcher):
             "sec": sec,
             "dt": dt,
         }
-        return await cls.get_instance().get_trade_price_limits(**params)
+        with span("fetch.get_trade_price_limits") as s:
+            limits = await cls.get_instance().get_trade_price_limits(**params)
+            s.rows = len(limits) if limits is not None else 0
+            return limits
 
     @classmethod
     async def get_quota_spare(cls):
         quota = await cls.get_instance().get_quota()
         return quota.get("spare")
 
+    @classmethod
+    async def get_total_quota_spare(cls):
+        """所有账号的剩余quota之和"""
+        quotas = await asyncio.gather(*[x.get_quota() for x in cls._instances])
+        return sum([x.get("spare") for x in quotas])
+
     @classmethod
     async def get_quota(cls):
         return await cls.get_instance().get_quota()
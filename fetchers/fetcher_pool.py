@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import time
+from typing import Callable, List
+
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# 错误信息中包含这些关键字时，认为是账号本身的问题（quota用完、认证失败等）
+ACCOUNT_ERROR_KEYWORDS = (
+    "quota",
+    "auth",
+    "login",
+    "token",
+    "超过",
+    "认证",
+    "登录",
+    "过期",
+)
+
+# 网络错误的重试次数和间隔（秒），不暂停账号
+NETWORK_RETRIES = 2
+NETWORK_RETRY_DELAY = 1
+
+
+def is_account_error(e: Exception):
+    """quota或者认证错误，账号暂停使用后换一个账号重试"""
+    msg = str(e).lower()
+    return any([x in msg for x in ACCOUNT_ERROR_KEYWORDS])
+
+
+def is_network_error(e: Exception):
+    """网络错误通常是暂时的，直接重试"""
+    return isinstance(e, (asyncio.TimeoutError, OSError))
+
+
+class FetcherState(object):
+    def __init__(self, impl):
+        self.impl = impl
+        self.spare = None  # 剩余quota，None表示还没有同步
+        self.in_flight = 0
+        self.disabled_until = 0.0
+        self.errors = 0
+
+    def is_available(self, now: float):
+        return now >= self.disabled_until
+
+    def headroom(self):
+        spare = self.spare if self.spare is not None else float("inf")
+        return spare / (1 + self.in_flight)
+
+
+class FetcherPool(object):
+    """多个行情账号组成的池，每个请求交给剩余quota最多、负载最低的账号
+
+    quota用完或者认证出错的账号暂停使用cool_down秒，之后重新同步quota再加入。
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = 2,
+        cool_down: int = 300,
+        quota_reserve: int = 10 * 10000,
+    ):
+        self.max_in_flight = max_in_flight
+        self.cool_down = cool_down
+        self.quota_reserve = quota_reserve
+        self.states: List[FetcherState] = []
+        self._released = None
+        self._loop = None
+
+    def __len__(self):
+        return len(self.states)
+
+    def add(self, impl):
+        self.states.append(FetcherState(impl))
+
+    def select(self) -> FetcherState:
+        """不等待，返回当前余量最多的账号"""
+        if len(self.states) == 0:
+            raise IndexError("No fetchers available")
+
+        now = time.time()
+        states = [x for x in self.states if x.is_available(now)]
+        if len(states) == 0:  # 全部在冷却中，仍然返回余量最多的
+            states = self.states
+
+        return max(states, key=lambda x: x.headroom())
+
+    def disable(self, state: FetcherState, reason: str):
+        state.disabled_until = time.time() + self.cool_down
+        state.spare = None
+        logger.warning(
+            "fetcher %s removed from rotation for %ds: %s",
+            state.impl.__class__.__name__,
+            self.cool_down,
+            reason,
+        )
+
+    def _get_released(self) -> asyncio.Event:
+        # 池在import时创建，Event要在使用时按当前的loop创建，否则会绑定到默认loop
+        loop = asyncio.get_running_loop()
+        if self._released is None or self._loop is not loop:
+            self._released = asyncio.Event()
+            self._loop = loop
+        return self._released
+
+    async def sync_quota(self, state: FetcherState):
+        quota = await state.impl.get_quota()
+        state.spare = quota["spare"]
+        return state.spare
+
+    async def acquire(self, cost: int = 0) -> FetcherState:
+        while True:
+            # 在检查之前清除，sync_quota期间的release不会丢失
+            released = self._get_released()
+            released.clear()
+            now = time.time()
+            states = [
+                x
+                for x in self.states
+                if x.is_available(now) and x.in_flight < self.max_in_flight
+            ]
+            for state in sorted(states, key=lambda x: x.headroom(), reverse=True):
+                if state.spare is None:
+                    await self.sync_quota(state)
+                if state.spare - cost < self.quota_reserve:
+                    self.disable(state, "quota exhausted")
+                    continue
+
+                state.in_flight += 1
+                return state
+
+            if len(self.states) == 0:
+                raise IndexError("No fetchers available")
+            now = time.time()
+            if all([not x.is_available(now) for x in self.states]):
+                raise IndexError("All fetchers are cooling down or out of quota")
+
+            await released.wait()
+
+    def release(self, state: FetcherState, cost: int = 0, error: Exception = None):
+        state.in_flight -= 1
+        if error is None:
+            if state.spare is not None:
+                state.spare -= cost
+        else:
+            state.errors += 1
+            self.disable(state, str(error))
+
+        if self._released is not None:
+            self._released.set()
+
+    async def call(
+        self, method: str, *args, cost: int = 0, wrap: Callable = None, **kwargs
+    ):
+        """在余量最多的账号上执行method
+
+        quota或者认证错误时暂停该账号并换一个账号重试，网络错误直接重试，其它错误（比如
+        参数错误）直接抛出。
+        """
+        last_error = None
+        for _ in range(max(len(self.states), 1) + NETWORK_RETRIES):
+            state = await self.acquire(cost)
+            fetcher = wrap(state.impl) if wrap is not None else state.impl
+            try:
+                with span("fetch.%s" % method) as s:
+                    result = await getattr(fetcher, method)(*args, **kwargs)
+                    s.rows = len(result) if hasattr(result, "__len__") else 0
+            except Exception as e:
+                last_error = e
+                if is_account_error(e):
+                    self.release(state, cost, e)
+                    continue
+
+                self.release(state, 0)
+                if is_network_error(e):
+                    logger.warning("network error, retry: %s", e)
+                    await asyncio.sleep(NETWORK_RETRY_DELAY)
+                    continue
+                raise
+
+            # 命中本地缓存时账号的余量不变
+            self.release(state, 0 if getattr(fetcher, "cache_hit", False) else cost)
+            return result
+
+        raise last_error
+
+    def get_stats(self):
+        return [
+            {
+                "impl": x.impl.__class__.__name__,
+                "spare": x.spare,
+                "in_flight": x.in_flight,
+                "errors": x.errors,
+                "disabled": not x.is_available(time.time()),
+            }
+            for x in self.states
+        ]
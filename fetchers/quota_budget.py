@@ -0,0 +1,91 @@
+import asyncio
+import datetime
+import logging
+import time
+from typing import List
+
+from omicron.models.timeframe import TimeFrame
+
+from tracing import count
+
+logger = logging.getLogger(__name__)
+
+
+class QuotaExhaustedError(Exception):
+    """预留额度失败，调用者不能把这种情况当作没有数据处理"""
+
+
+class QuotaBudget(object):
+    """本地维护的quota余量
+
+    每次下载按n_bars * len(secs)估算消耗并从本地计数中扣除，只有超过resync_interval
+    秒才向服务端同步一次。任务可以先预留额度，再根据可用额度规划每批的大小。
+    各个账号都从这里扣除，所以余量按所有账号的合计同步。
+    """
+
+    def __init__(
+        self,
+        resync_interval: int = 600,
+        day_reserve: int = 400 * 10000,
+        min_reserve: int = 10 * 10000,
+    ):
+        self.resync_interval = resync_interval
+        self.day_reserve = day_reserve  # 工作日开盘前需要保留给白天使用
+        self.min_reserve = min_reserve
+        self.spare = None
+        self.reserved = 0
+        self.last_sync = 0.0
+
+    @staticmethod
+    def estimate_cost(n_bars: int, n_secs: int):
+        return n_bars * n_secs
+
+    async def sync(self, instances: List):
+        quotas = await asyncio.gather(*[x.get_quota() for x in instances])
+        self.spare = sum([x["spare"] for x in quotas])
+        self.last_sync = time.time()
+        logger.info("current quota: %d, %d accounts", self.spare, len(quotas))
+        return self.spare
+
+    async def get_spare(self, instances: List, force: bool = False):
+        if force or self.spare is None:
+            return await self.sync(instances)
+        if time.time() - self.last_sync > self.resync_interval:
+            return await self.sync(instances)
+
+        return self.spare
+
+    def get_reserve_floor(self, now: datetime.datetime):
+        # 工作日9:32之前需要保留400万给白天使用（实际需要256万）
+        if TimeFrame.is_trade_day(now) and now.time() < datetime.time(9, 32, 0):
+            return self.day_reserve
+
+        return self.min_reserve
+
+    def available(self, now: datetime.datetime = None):
+        if self.spare is None:
+            return 0
+
+        now = now or datetime.datetime.now()
+        return max(self.spare - self.reserved - self.get_reserve_floor(now), 0)
+
+    def debit(self, rows: int):
+        if self.spare is not None:
+            self.spare -= rows
+        # 记在当前任务的trace中，并发运行的任务各自统计
+        count("quota_used", rows)
+
+    def reserve(self, rows: int, now: datetime.datetime = None):
+        """预留rows行的额度，余量不足时返回False，还没有同步过余量时不做限制"""
+        if self.spare is not None and rows > self.available(now):
+            return False
+
+        self.reserved += rows
+        return True
+
+    def release(self, rows: int):
+        # 任务结束（或者实际消耗已经debit）后归还预留的额度
+        self.reserved = max(self.reserved - rows, 0)
+
+
+quota_budget = QuotaBudget()
@@ -0,0 +1,222 @@
+import datetime
+import hashlib
+import logging
+import os
+import pickle
+from typing import Dict, List, Union
+
+import arrow
+import cfg4py
+import numpy as np
+from coretypes import Frame, FrameType
+
+logger = logging.getLogger(__name__)
+
+
+def is_closed_period(dt: Union[str, Frame]):
+    # 今天之前的数据不会再变化，可以缓存
+    _date = arrow.get(dt).date()
+    return _date < datetime.date.today()
+
+
+class QuotesCache(object):
+    """远程行情数据的本地磁盘缓存
+
+    按请求参数生成文件名，用pickle保存numpy数据。总大小超过max_size时，
+    按最近访问时间删除最早的文件。
+    """
+
+    def __init__(self, cache_dir: str, max_size: int = 2 * 1024**3):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.stats = {}
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.total_size = sum([os.path.getsize(x) for x in self._files()])
+
+    @classmethod
+    def from_config(cls):
+        """配置了quotes_cache.enabled为True时才启用，否则返回None"""
+        cfg = cfg4py.get_instance()
+        _cfg = getattr(cfg, "quotes_cache", None)
+        if _cfg is None or not getattr(_cfg, "enabled", False):
+            return None
+
+        cache_dir = getattr(_cfg, "dir", None)
+        if cache_dir is None:
+            cache_dir = os.path.join(os.getcwd(), "cache", "quotes")
+        return cls(cache_dir, getattr(_cfg, "max_size", 2 * 1024**3))
+
+    def _files(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for file in files:
+                yield os.path.join(root, file)
+
+    def _get_filename(self, method: str, params: tuple):
+        key = hashlib.sha1(repr((method, params)).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, method, key[:2], key + ".pik")
+
+    def _update_stats(self, method: str, item: str, value: int = 1):
+        if method not in self.stats:
+            self.stats[method] = {"hits": 0, "misses": 0, "bytes": 0}
+        self.stats[method][item] += value
+
+    def get(self, method: str, params: tuple):
+        filename = self._get_filename(method, params)
+        if not os.path.exists(filename):
+            self._update_stats(method, "misses")
+            return None
+
+        try:
+            with open(filename, "rb") as f:
+                binary = f.read()
+            data = pickle.loads(binary)
+            os.utime(filename)  # 记录访问时间，用于淘汰
+        except FileNotFoundError:  # 同时被淘汰
+            self._update_stats(method, "misses")
+            return None
+        except Exception as e:
+            # 不完整或者损坏的文件，删除后按未命中处理
+            logger.warning("bad cache file %s removed: %s", filename, e)
+            self._remove(filename)
+            self._update_stats(method, "misses")
+            return None
+
+        self._update_stats(method, "hits")
+        self._update_stats(method, "bytes", len(binary))
+        return data
+
+    def put(self, method: str, params: tuple, data):
+        filename = self._get_filename(method, params)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+        # 先写临时文件再改名，中途退出或者并发写入都不会留下不完整的文件
+        binary = pickle.dumps(data, protocol=4)
+        tmp_file = "%s.%d.%d.tmp" % (filename, os.getpid(), id(binary))
+        try:
+            old_size = os.path.getsize(filename)
+        except OSError:
+            old_size = 0
+
+        try:
+            with open(tmp_file, "wb") as f:
+                f.write(binary)
+            os.replace(tmp_file, filename)
+        except Exception as e:
+            logger.warning("failed to write cache file %s: %s", filename, e)
+            self._remove(tmp_file)
+            return
+
+        # 覆盖已有文件时减去原来的大小
+        self.total_size += len(binary) - old_size
+        if self.total_size > self.max_size:
+            self.evict()
+
+    def _remove(self, filename: str):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+    def evict(self):
+        # 删除最早访问的文件，直到总大小降到max_size的80%
+        files = sorted(
+            [(os.path.getmtime(x), os.path.getsize(x), x) for x in self._files()]
+        )
+        self.total_size = sum([x[1] for x in files])
+
+        target = self.max_size * 0.8
+        removed = 0
+        for _, size, filename in files:
+            if self.total_size <= target:
+                break
+            self._remove(filename)
+            self.total_size -= size
+            removed += 1
+
+        logger.info("quotes cache evicted %d files, %d bytes", removed, self.total_size)
+
+    def get_stats(self):
+        return {k: dict(v) for k, v in self.stats.items()}
+
+
+class CachedQuotesFetcher(object):
+    """给QuotesFetcher实例加上磁盘缓存，只缓存已经结束的历史周期"""
+
+    def __init__(self, impl, cache: QuotesCache):
+        self._impl = impl
+        self._cache = cache
+        # 每次调用都会新建实例，调用者据此判断是否消耗了quota
+        self.cache_hit = False
+
+    def __getattr__(self, name):
+        return getattr(self._impl, name)
+
+    async def get_bars_batch(
+        self,
+        secs: List[str],
+        end: Frame,
+        n_bars: int,
+        frame_type: Union[FrameType, str],
+        include_unclosed=True,
+        fq_ref_enabled=False,
+        bypass_cache=False,
+    ) -> Dict[str, np.ndarray]:
+        _frame_type = getattr(frame_type, "value", frame_type)
+        if bypass_cache or not is_closed_period(end):
+            return await self._impl.get_bars_batch(
+                secs, end, n_bars, _frame_type, include_unclosed, fq_ref_enabled
+            )
+
+        params = (
+            tuple(sorted(secs)),
+            str(end),
+            n_bars,
+            _frame_type,
+            include_unclosed,
+            fq_ref_enabled,
+        )
+        bars = self._cache.get("get_bars_batch", params)
+        if bars is not None:
+            self.cache_hit = True
+            return bars
+
+        bars = await self._impl.get_bars_batch(
+            secs, end, n_bars, _frame_type, include_unclosed, fq_ref_enabled
+        )
+        if bars is not None and len(bars) > 0:
+            self._cache.put("get_bars_batch", params, bars)
+        return bars
+
+    async def get_security_list(self, date: datetime.date, bypass_cache=False):
+        if bypass_cache or not is_closed_period(date):
+            return await self._impl.get_security_list(date)
+
+        params = (str(date),)
+        securities = self._cache.get("get_security_list", params)
+        if securities is not None:
+            self.cache_hit = True
+            return securities
+
+        securities = await self._impl.get_security_list(date)
+        if securities is not None and len(securities) > 0:
+            self._cache.put("get_security_list", params, securities)
+        return securities
+
+    async def get_trade_price_limits(
+        self, sec: Union[List, str], dt: Union[str, Frame], bypass_cache=False
+    ) -> np.ndarray:
+        if bypass_cache or not is_closed_period(dt):
+            return await self._impl.get_trade_price_limits(sec=sec, dt=dt)
+
+        _secs = (sec,) if isinstance(sec, str) else tuple(sorted(sec))
+        params = (_secs, str(dt))
+        limits = self._cache.get("get_trade_price_limits", params)
+        if limits is not None:
+            self.cache_hit = True
+            return limits
+
+        limits = await self._impl.get_trade_price_limits(sec=sec, dt=dt)
+        if limits is not None and len(limits) > 0:
+            self._cache.put("get_trade_price_limits", params, limits)
+        return limits
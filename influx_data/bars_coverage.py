@@ -0,0 +1,306 @@
+import base64
+import datetime
+import logging
+from typing import Dict, List, Set
+
+import numpy as np
+from aioredis.exceptions import WatchError
+from coretypes import FrameType
+from omicron.dal.cache import cache
+from omicron.dal.influx.flux import Flux
+from omicron.dal.influx.serialize import DataframeDeserializer
+from omicron.models import get_influx_client
+from omicron.models.timeframe import TimeFrame
+
+from influx_data.security_bars_1m import get_expected_bars_count
+from tracing import traced_deserialize, traced_query
+
+logger = logging.getLogger(__name__)
+
+# 合并时记录被其它分支改写的重试次数
+MAX_MERGE_RETRIES = 10
+
+
+def get_coverage_keyname(ft: FrameType):
+    return "datascan:coverage:%s" % ft.value
+
+
+def get_frame_bars_count(ft: FrameType):
+    # 日线、周线和月线每个周期只有一根
+    if ft in (FrameType.DAY, FrameType.WEEK, FrameType.MONTH):
+        return 1
+
+    return get_expected_bars_count(ft)
+
+
+def encode_coverage(present: np.ndarray, counts: Dict[int, int]):
+    # 位图（按code id排列）+ 根数异常的code，格式：base64;id:count,id:count
+    bitmap = np.packbits(present, bitorder="little")
+    items = ",".join([f"{k}:{v}" for k, v in sorted(counts.items())])
+    return "%s;%s" % (base64.b64encode(bitmap.tobytes()).decode("ascii"), items)
+
+
+def resize_bitmap(present: np.ndarray, size: int):
+    if len(present) < size:  # 写入之后新增的code
+        present = np.concatenate([present, np.zeros(size - len(present), bool)])
+
+    return present[:size].astype(bool)
+
+
+def decode_coverage(value: str, size: int):
+    bitmap_str, items = value.split(";")
+    bitmap = np.frombuffer(base64.b64decode(bitmap_str), dtype=np.uint8)
+    present = resize_bitmap(np.unpackbits(bitmap, bitorder="little"), size)
+
+    counts = {}
+    if len(items) > 0:
+        for item in items.split(","):
+            k, v = item.split(":")
+            counts[int(k)] = int(v)
+
+    return present, counts
+
+
+async def get_security_bars_count(
+    ft: FrameType, start: datetime.datetime, end: datetime.datetime
+):
+    client = get_influx_client()
+    measurement = "stock_bars_%s" % ft.value
+
+    flux = (
+        Flux(auto_pivot=False)
+        .measurement(measurement)
+        .range(start, end)
+        .bucket(client._bucket)
+        .fields(["close"])
+        .group(["code"])
+    )
+    query = "\n".join([str(flux), "  |> count()"])
+
+    data = await traced_query(client, query)
+    if len(data) == 2:  # \r\n
+        return {}
+
+    ds = DataframeDeserializer(usecols=["code", "_value"], engine="c")
+    actual = traced_deserialize(ds, data)
+    return dict(zip(actual["code"].tolist(), actual["_value"].astype(int).tolist()))
+
+
+class BarsCoverage(object):
+    """按(日期, 周期)记录库中有哪些证券以及各自的K线根数
+
+    证券代码映射为递增的整数id（保存在cache中，不会改变），每天的证券集合存为位图，
+    只记录根数和交易日历不一致的证券。缺失数据的查询可以在内存中完成，不需要读取influxdb。
+    """
+
+    _codes: List[str] = []
+    _code_ids: Dict[str, int] = {}
+    _coverage: Dict[FrameType, Dict[int, tuple]] = {}
+
+    @classmethod
+    async def load_codes(cls):
+        codes = await cache.sys.hgetall("datascan:coverage:codes")
+        size = max([int(_id) for _id in codes.values()], default=0) + 1
+        table = [None] * size
+        for code, _id in codes.items():
+            table[int(_id)] = code
+
+        cls._codes = table
+        cls._code_ids = {code: int(_id) for code, _id in codes.items()}
+
+    @classmethod
+    async def intern(cls, codes) -> np.ndarray:
+        """返回证券代码对应的id，新出现的代码分配新的id"""
+        if len(cls._code_ids) == 0:
+            await cls.load_codes()
+
+        ids = []
+        for code in codes:
+            _id = cls._code_ids.get(code)
+            if _id is None:
+                _id = await cls._add_code(code)
+            ids.append(_id)
+
+        return np.array(ids, dtype=np.int32)
+
+    @classmethod
+    async def _add_code(cls, code: str):
+        new_id = await cache.sys.incr("datascan:coverage:codes:seq")
+        rc = await cache.sys.hsetnx("datascan:coverage:codes", code, new_id)
+        if not rc:  # 其它进程已经添加
+            new_id = await cache.sys.hget("datascan:coverage:codes", code)
+        new_id = int(new_id)
+
+        if new_id >= len(cls._codes):
+            cls._codes.extend([None] * (new_id + 1 - len(cls._codes)))
+        cls._codes[new_id] = code
+        cls._code_ids[code] = new_id
+        return new_id
+
+    @classmethod
+    def decode(cls, ids) -> Set[str]:
+        return {cls._codes[i] for i in ids}
+
+    @classmethod
+    async def load(cls, ft: FrameType):
+        await cls.load_codes()
+
+        size = len(cls._codes)
+        items = await cache.sys.hgetall(get_coverage_keyname(ft))
+        cls._coverage[ft] = {
+            int(dt): decode_coverage(value, size) for dt, value in items.items()
+        }
+        logger.info("coverage of bars:%s loaded, %d days", ft.value, len(items))
+
+    @classmethod
+    async def save(
+        cls,
+        dt: datetime.date,
+        ft: FrameType,
+        bars_count: Dict[str, int],
+        merge: bool = True,
+    ):
+        """记录dt这天ft周期的证券和根数，merge为True时和已有记录合并
+
+        股票和指数的分支会同时更新同一天的记录，合并时用WATCH/MULTI保证读取和写入之间
+        没有其它写入，否则重新读取后再合并。
+        """
+        ids = await cls.intern(list(bars_count.keys()))
+        size = len(cls._codes)
+
+        key = get_coverage_keyname(ft)
+        field = str(TimeFrame.date2int(dt))
+        expected = get_frame_bars_count(ft)
+
+        for _ in range(MAX_MERGE_RETRIES):
+            async with cache.sys.pipeline(transaction=True) as pipe:
+                present = np.zeros(size, dtype=bool)
+                counts = {}
+                if merge:
+                    await pipe.watch(key)
+                    value = await pipe.hget(key, field)
+                    if value:
+                        present, counts = decode_coverage(value, size)
+
+                present[ids] = True
+                for _id, n in zip(ids.tolist(), bars_count.values()):
+                    if n != expected:
+                        counts[_id] = n
+                    else:
+                        counts.pop(_id, None)
+
+                pipe.multi()
+                pipe.hset(key, field, encode_coverage(present, counts))
+                try:
+                    await pipe.execute()
+                except WatchError:
+                    logger.info("coverage of bars:%s changed, retry, %s", ft.value, dt)
+                    continue
+
+            if ft in cls._coverage:
+                cls._coverage[ft][int(field)] = (present, counts)
+            return True
+
+        logger.error("failed to save coverage of bars:%s, %s", ft.value, dt)
+        return False
+
+    @classmethod
+    async def update(
+        cls,
+        dt: datetime.date,
+        ft: FrameType,
+        bars: Dict[str, np.ndarray],
+    ):
+        """Stock.persist_bars之后调用，bars为按code组织的数据"""
+        bars_count = {code: len(bars[code]) for code in bars.keys()}
+        if len(bars_count) == 0:
+            return
+
+        await cls.save(dt, ft, bars_count)
+        logger.info(
+            "coverage of bars:%s updated, %s, %d secs", ft.value, dt, len(bars_count)
+        )
+
+    @classmethod
+    async def rebuild(cls, d0: datetime.date, d1: datetime.date, ft: FrameType):
+        """从influxdb中重建[d0, d1]之间的记录"""
+        if ft in (FrameType.WEEK, FrameType.MONTH):
+            frames = TimeFrame.get_frames(d0, d1, ft)
+        else:
+            frames = TimeFrame.get_frames(d0, d1, FrameType.DAY)
+
+        for frame in frames:
+            dt = TimeFrame.int2date(frame)
+            if ft in (FrameType.WEEK, FrameType.MONTH):
+                p0, p1 = TimeFrame.get_frame_scope(dt, ft)
+            else:
+                p0, p1 = dt, dt
+            start = datetime.datetime.combine(p0, datetime.time(0, 0, 0))
+            end = datetime.datetime.combine(p1, datetime.time(23, 59, 59))
+
+            bars_count = await get_security_bars_count(ft, start, end)
+            if len(bars_count) == 0:
+                logger.error(
+                    "no bars:%s found when rebuilding coverage, %s", ft.value, dt
+                )
+                continue
+
+            await cls.save(dt, ft, bars_count, merge=False)
+            logger.info(
+                "coverage of bars:%s rebuilt, %s, %d secs",
+                ft.value,
+                dt,
+                len(bars_count),
+            )
+
+    @classmethod
+    def get_secs(cls, dt: datetime.date, ft: FrameType) -> Set[str]:
+        item = cls._coverage[ft].get(TimeFrame.date2int(dt))
+        if item is None:
+            return set()
+
+        return cls.decode(np.flatnonzero(item[0]))
+
+    @classmethod
+    def get_incomplete_secs(cls, dt: datetime.date, ft: FrameType) -> Dict[str, int]:
+        item = cls._coverage[ft].get(TimeFrame.date2int(dt))
+        if item is None:
+            return {}
+
+        return {cls._codes[_id]: n for _id, n in item[1].items()}
+
+    @classmethod
+    def find_gaps(
+        cls,
+        d0: datetime.date,
+        d1: datetime.date,
+        ft: FrameType,
+        base_ft: FrameType = FrameType.DAY,
+    ) -> Dict[datetime.date, Set[str]]:
+        """以base_ft（默认日线）的证券为基准，找出[d0, d1]之间ft周期缺失或者不完整的证券
+
+        调用之前需要先load(ft)和load(base_ft)。
+        """
+        size = len(cls._codes)
+        start = TimeFrame.date2int(d0)
+        end = TimeFrame.date2int(d1)
+
+        gaps = {}
+        for dt, (base, _) in cls._coverage[base_ft].items():
+            if dt < start or dt > end:
+                continue
+
+            base = resize_bitmap(base, size)
+            item = cls._coverage[ft].get(dt)
+            if item is None:
+                missing = base
+            else:
+                present, counts = item
+                missing = base & ~resize_bitmap(present, size)
+                if len(counts) > 0:
+                    missing[list(counts.keys())] = True
+
+            if np.any(missing):
+                gaps[TimeFrame.int2date(dt)] = cls.decode(np.flatnonzero(missing))
+
+        return gaps
@@ -0,0 +1,98 @@
+import datetime
+import logging
+from typing import Tuple
+
+import numpy as np
+from omicron.dal.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+class ListingIndex(object):
+    """证券上市区间索引，由证券列表（code, type, start, end）一次性构建
+
+    代码和类型都转换成整数，上市和退市日期存为datetime64[D]，按日期或日期区间取证券清单
+    只需要一次向量化的比较，不需要访问数据库。
+    """
+
+    def __init__(self, records):
+        # records: (code, alias, name, start, end, type)
+        codes = [x[0] for x in records]
+        types = [x[5] for x in records]
+
+        self.code_table, self.codes = np.unique(
+            np.array(codes, dtype="O"), return_inverse=True
+        )
+        self.type_table, self.types = np.unique(
+            np.array(types, dtype="O"), return_inverse=True
+        )
+        self.codes = self.codes.astype(np.int32)
+        self.types = self.types.astype(np.int8)
+        self.start = np.array([str(x[3])[:10] for x in records], dtype="datetime64[D]")
+        self.end = np.array([str(x[4])[:10] for x in records], dtype="datetime64[D]")
+
+    def __len__(self):
+        return len(self.codes)
+
+    def _type_id(self, _type: str):
+        idx = np.flatnonzero(self.type_table == _type)
+        if len(idx) == 0:
+            return -1
+        return idx[0]
+
+    def mask_between(self, d0: datetime.date, d1: datetime.date):
+        """[d0, d1]之间任何一天处于上市状态的证券"""
+        return (self.start <= np.datetime64(d1, "D")) & (
+            self.end >= np.datetime64(d0, "D")
+        )
+
+    def universe_between(
+        self,
+        d0: datetime.date,
+        d1: datetime.date,
+        types: Tuple[str] = ("stock", "index"),
+    ):
+        mask = self.mask_between(d0, d1)
+
+        universe = []
+        for _type in types:
+            ids = self.codes[mask & (self.types == self._type_id(_type))]
+            universe.append(set(self.code_table[ids].tolist()))
+
+        return tuple(universe)
+
+    def universe_on(
+        self, target_date: datetime.date, types: Tuple[str] = ("stock", "index")
+    ):
+        return self.universe_between(target_date, target_date, types)
+
+
+_listing_index = None
+_listing_date = None  # 构建索引时证券列表的日期（security:latest_date）
+
+
+async def get_listing_index(reload: bool = False):
+    """从缓存中的证券列表（security:all）构建索引
+
+    证券列表更新后（security:latest_date变化）重新构建，常驻进程中也能看到新上市和
+    退市的证券。
+    """
+    global _listing_index, _listing_date
+
+    latest_date = await cache.security.get("security:latest_date")
+    if _listing_index is not None and not reload and latest_date == _listing_date:
+        return _listing_index
+
+    secs = await cache.security.lrange("security:all", 0, -1)
+    if secs is None or len(secs) < 4000:
+        logger.error("cannot read security list from cache!")
+        return None
+
+    _listing_index = ListingIndex([x.split(",") for x in secs])
+    _listing_date = latest_date
+    logger.info(
+        "listing index built, %d secs, latest date: %s",
+        len(_listing_index),
+        latest_date,
+    )
+    return _listing_index
@@ -12,6 +12,8 @@ from omicron.models.stock import Stock
 from omicron.models.timeframe import TimeFrame
 from omicron.models.timeframe import TimeFrame as tf
 
+from tracing import traced_deserialize, traced_query
+
 logger = logging.getLogger(__name__)
 
 
@@ -27,7 +29,7 @@ async def get_security_day_bars(start: datetime.datetime, end: datetime.datetime
         .fields(["open", "close"])
     )
 
-    data = await client.query(flux)
+    data = await traced_query(client, flux)
     if len(data) == 2:  # \r\n
         return []
 
@@ -37,7 +39,7 @@ async def get_security_day_bars(start: datetime.datetime, end: datetime.datetime
         time_col="_time",
         engine="c",
     )
-    actual = ds(data)
+    actual = traced_deserialize(ds, data)
     secs = actual.to_records(index=False)
     return secs
 
@@ -54,7 +56,7 @@ async def get_security_price_limits(start: datetime.datetime, end: datetime.date
         .fields(["high_limit", "low_limit"])
     )
 
-    data = await client.query(flux)
+    data = await traced_query(client, flux)
     if len(data) == 2:  # \r\n
         return []
 
@@ -64,6 +66,6 @@ async def get_security_price_limits(start: datetime.datetime, end: datetime.date
         time_col="_time",
         engine="c",
     )
-    actual = ds(data)
+    actual = traced_deserialize(ds, data)
     secs = actual.to_records(index=False)
     return secs
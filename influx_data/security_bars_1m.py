@@ -12,66 +12,88 @@ from omicron.models.stock import Stock
 from omicron.models.timeframe import TimeFrame
 from omicron.models.timeframe import TimeFrame as tf
 
+from tracing import traced_deserialize, traced_query
+
 logger = logging.getLogger(__name__)
 
 
-async def get_security_minutes_data(ft: FrameType, target_date: datetime.date):
-    delta = datetime.timedelta(minutes=1)
-    if ft == FrameType.MIN1:
-        delta = datetime.timedelta(minutes=1)
-    elif ft == FrameType.MIN5:
-        delta = datetime.timedelta(minutes=5)
-    elif ft == FrameType.MIN30:
-        delta = datetime.timedelta(minutes=30)
-    elif ft == FrameType.MIN60:
-        delta = datetime.timedelta(minutes=60)
-    else:
+def get_expected_bars_count(ft: FrameType):
+    # 每个交易日的分钟线根数，由交易日历中的分钟节点确定（240/48/16/8/4）
+    if ft not in (
+        FrameType.MIN1,
+        FrameType.MIN5,
+        FrameType.MIN15,
+        FrameType.MIN30,
+        FrameType.MIN60,
+    ):
         raise ValueError("FrameType not supported, %s" % ft)
 
-    _start = datetime.datetime.combine(target_date, datetime.time(9, 30, 0))
-    _end = datetime.datetime.combine(target_date, datetime.time(9, 30, 1))
-    secs1 = await get_security_minutes_bars(ft, _start + delta, _end + delta)
-    len1 = len(secs1)
-
-    _start = datetime.datetime.combine(target_date, datetime.time(11, 30, 0))
-    _end = datetime.datetime.combine(target_date, datetime.time(11, 30, 1))
-    secs2 = await get_security_minutes_bars(ft, _start, _end)
-    len2 = len(secs2)
-    if len1 != len2:
-        logger.error(
-            "bars:%s data corrupt, 9:30+%s:00 != 11:30:00, %d, %d",
-            ft.value,
-            ft.value,
-            len1,
-            len2,
-        )
-        return None
+    return len(TimeFrame.ticks[ft])
 
-    _start = datetime.datetime.combine(target_date, datetime.time(13, 0, 0))
-    _end = datetime.datetime.combine(target_date, datetime.time(13, 0, 1))
-    secs3 = await get_security_minutes_bars(ft, _start + delta, _end + delta)
-    len3 = len(secs3)
-    if len2 != len3:
-        logger.error(
-            "bars:%s data corrupt, 11:30:00 != 13:01:00, %d, %d", ft.value, len2, len3
-        )
-        return None
 
-    _start = datetime.datetime.combine(target_date, datetime.time(15, 0, 0))
+async def get_security_minutes_count(ft: FrameType, target_date: datetime.date):
+    """统计当天每只证券的分钟线根数，在influxdb服务端按code分组后count()
+
+    Returns:
+        np.ndarray: dtype为[("code", "O"), ("count", "i4")]的数组，没有数据时返回[]
+    """
+    client = get_influx_client()
+    measurement = "stock_bars_%s" % ft.value
+
+    _start = datetime.datetime.combine(target_date, datetime.time(9, 30, 0))
     _end = datetime.datetime.combine(target_date, datetime.time(15, 0, 1))
-    secs4 = await get_security_minutes_bars(ft, _start, _end)
-    len4 = len(secs4)
-    if len3 != len4:
-        logger.info(
-            "bars:%s data corrupt, 13:00+%s:00 != 15:00:00, %d, %d",
-            ft.value,
+    flux = (
+        Flux(auto_pivot=False)
+        .measurement(measurement)
+        .range(_start, _end)
+        .bucket(client._bucket)
+        .fields(["close"])
+        .group(["code"])
+    )
+    query = "\n".join([str(flux), "  |> count()"])
+
+    data = await traced_query(client, query)
+    if len(data) == 2:  # \r\n
+        return []
+
+    ds = DataframeDeserializer(
+        sort_values="code",
+        usecols=["code", "_value"],
+        engine="c",
+    )
+    actual = traced_deserialize(ds, data)
+    secs = actual.to_records(index=False).astype([("code", "O"), ("count", "i4")])
+    return secs
+
+
+def get_incomplete_securities(secs_count, ft: FrameType):
+    # 根数和交易日历不一致的证券，包括中间缺失的情况
+    expected = get_expected_bars_count(ft)
+    if len(secs_count) == 0:
+        return {}
+
+    incomplete = secs_count[secs_count["count"] != expected]
+    return {x["code"]: int(x["count"]) for x in incomplete}
+
+
+async def get_security_minutes_data(ft: FrameType, target_date: datetime.date):
+    secs_count = await get_security_minutes_count(ft, target_date)
+    if len(secs_count) == 0:
+        logger.error("bars:%s no data found, %s", ft.value, target_date)
+        return secs_count
+
+    incomplete = get_incomplete_securities(secs_count, ft)
+    if len(incomplete) > 0:
+        logger.error(
+            "bars:%s data corrupt, %d secs not equal to %d bars, %s",
             ft.value,
-            len3,
-            len4,
+            len(incomplete),
+            get_expected_bars_count(ft),
+            target_date,
         )
-        return None
+        logger.info(incomplete)
 
-    return secs1
+    return secs_count
 
 
 async def get_security_minutes_bars(
@@ -88,7 +110,7 @@ async def get_security_minutes_bars(
         .fields(["open", "close"])
     )
 
-    data = await client.query(flux)
+    data = await traced_query(client, flux)
     if len(data) == 2:  # \r\n
         return []
 
@@ -98,6 +120,6 @@ async def get_security_minutes_bars(
         time_col="_time",
         engine="c",
     )
-    actual = ds(data)
+    actual = traced_deserialize(ds, data)
     secs = actual.to_records(index=False)
     return secs
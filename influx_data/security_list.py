@@ -1,5 +1,8 @@
+import asyncio
 import datetime
 import logging
+from collections import OrderedDict
+from typing import Tuple
 
 import cfg4py
 from coretypes import FrameType, bars_dtype
@@ -13,11 +16,67 @@ from omicron.models.timeframe import TimeFrame as tf
 
 logger = logging.getLogger(__name__)
 
+# 按(日期, 证券类型)缓存证券列表，同一天的股票和指数只查询一次
+UNIVERSE_CACHE_SIZE = 64
+_universe_cache = OrderedDict()
+_universe_stats = {"hits": 0, "misses": 0}
+
+
+async def get_security_universe(
+    target_date: datetime.date, types: Tuple[str] = ("stock", "index")
+):
+    """返回target_date这天各个类型的证券集合，顺序和types一致
+
+    结果保存在进程内的LRU缓存中，查询失败时返回None，不缓存。
+    """
+    key = (target_date, tuple(types))
+    if key in _universe_cache:
+        _universe_cache.move_to_end(key)
+        _universe_stats["hits"] += 1
+        return _universe_cache[key]
+
+    _universe_stats["misses"] += 1
+    results = await asyncio.gather(
+        *[Security.select(target_date).types([_type]).eval() for _type in types]
+    )
+
+    universe = []
+    for _type, secs in zip(types, results):
+        if secs is None or len(secs) < 10:
+            logger.error(
+                "failed to query securities (%s) from db, %s", _type, target_date
+            )
+            return None
+        universe.append(frozenset(secs))
+
+    universe = tuple(universe)
+    _universe_cache[key] = universe
+    if len(_universe_cache) > UNIVERSE_CACHE_SIZE:
+        _universe_cache.popitem(last=False)
+
+    return universe
+
+
+def get_universe_cache_stats():
+    return {
+        "hits": _universe_stats["hits"],
+        "misses": _universe_stats["misses"],
+        "size": len(_universe_cache),
+    }
+
 
 async def get_security_list(target_date: datetime.date, sec_type: str):
-    all_secs_in_cache = await Security.select(target_date).types([sec_type]).eval()
-    if all_secs_in_cache is None or len(all_secs_in_cache) < 10:
+    # 已经缓存了当天的股票和指数时直接使用，否则只查询（和检查）sec_type这一类
+    types = ("stock", "index")
+    key = (target_date, types)
+    if sec_type in types and key in _universe_cache:
+        _universe_cache.move_to_end(key)
+        _universe_stats["hits"] += 1
+        return _universe_cache[key][types.index(sec_type)]
+
+    universe = await get_security_universe(target_date, (sec_type,))
+    if universe is None:
         print("failed to query securities from db")
         return None
 
-    return set(all_secs_in_cache)
+    return universe[0]
@@ -1,8 +1,13 @@
+import asyncio
 import datetime
+import json
 import logging
+from typing import Callable
 
+import arrow
 import cfg4py
 from coretypes import FrameType, bars_dtype
+from omicron.dal.cache import cache
 from omicron.dal.influx.flux import Flux
 from omicron.dal.influx.influxclient import InfluxClient
 from omicron.dal.influx.serialize import EPOCH, DataframeDeserializer
@@ -11,66 +16,198 @@ from omicron.models.security import Security
 from omicron.models.timeframe import TimeFrame
 from omicron.models.timeframe import TimeFrame as tf
 
+from tracing import span, traced_deserialize, traced_query
+
 logger = logging.getLogger(__name__)
 
 
-async def remove_security_list():
+# 每个序列每天大约的数据点数，用于估算删除分区的大小
+POINTS_PER_DAY = {
+    "1m": 240,
+    "5m": 48,
+    "15m": 16,
+    "30m": 8,
+    "60m": 4,
+    "1d": 1,
+    "1w": 0.2,
+    "1M": 0.05,
+}
+
+
+def get_points_per_day(measurement: str):
+    suffix = measurement.split("_")[-1]
+    return POINTS_PER_DAY.get(suffix, 1)
+
+
+async def estimate_series_cardinality(
+    measurement: str, dt_start: datetime.date, dt_end: datetime.date, tags: dict = None
+):
+    client = get_influx_client()
+    predicate = [f'r._measurement == "{measurement}"']
+    for k, v in (tags or {}).items():
+        predicate.append(f'r.{k} == "{v}"')
+    start = datetime.datetime.combine(dt_start, datetime.time(0, 0, 0))
+    end = datetime.datetime.combine(dt_end, datetime.time(23, 59, 59))
+
+    query = "\n".join(
+        [
+            'import "influxdata/influxdb"',
+            "influxdb.cardinality(",
+            f'  bucket: "{client._bucket}",',
+            f"  start: {start.isoformat(timespec='seconds')}Z,",
+            f"  stop: {end.isoformat(timespec='seconds')}Z,",
+            f"  predicate: (r) => {' and '.join(predicate)},",
+            ")",
+        ]
+    )
+
+    try:
+        data = await traced_query(client, query)
+        if len(data) == 2:  # \r\n
+            return 0
+
+        ds = DataframeDeserializer(usecols=["_value"], engine="c")
+        return int(traced_deserialize(ds, data)["_value"].sum())
+    except Exception as e:
+        logger.warning("failed to estimate cardinality of %s: %s", measurement, e)
+        return 6000  # 按全市场证券数估计
+
+
+def split_delete_range(
+    dt_start: datetime.date,
+    dt_end: datetime.date,
+    cardinality: int,
+    points_per_day: float,
+    max_points: int = 5000000,
+):
+    """把[dt_start, dt_end]按每个分区最多max_points个数据点切分成互不重叠的分区"""
+    days = int(max_points / max(cardinality * points_per_day, 1))
+    days = min(max(days, 1), 366)
+
+    partitions = []
+    d0 = dt_start
+    while d0 <= dt_end:
+        d1 = min(d0 + datetime.timedelta(days=days - 1), dt_end)
+        partitions.append((d0, d1))
+        d0 = d1 + datetime.timedelta(days=1)
+
+    return partitions
+
+
+def get_delete_plan_keyname(
+    measurement: str, dt_start: datetime.date, dt_end: datetime.date, tags: dict
+):
+    _tags = ",".join([f"{k}={v}" for k, v in sorted((tags or {}).items())])
+    return "datascan:delete_plan:%s:%s:%s:%s" % (
+        measurement,
+        dt_start.strftime("%Y%m%d"),
+        dt_end.strftime("%Y%m%d"),
+        _tags,
+    )
+
+
+async def delete_range(
+    measurement: str,
+    dt_start: datetime.date,
+    dt_end: datetime.date,
+    tags: dict = None,
+    max_concurrency: int = 4,
+):
+    """删除measurement中[dt_start, dt_end]之间的数据，可以指定tags过滤
+
+    按序列数估算数据量，切分成互不重叠的分区并行删除。分区方案和已完成的分区都记录在
+    cache中，中途失败后再次调用沿用原来的分区（部分删除之后估算的序列数会变化），
+    跳过已完成的分区，全部完成后清除记录。
+    """
+    key = get_delete_plan_keyname(measurement, dt_start, dt_end, tags)
+    plan_key = "%s:partitions" % key
+
+    saved = await cache.sys.get(plan_key)
+    if saved:
+        partitions = [
+            (arrow.get(d0).date(), arrow.get(d1).date()) for d0, d1 in json.loads(saved)
+        ]
+        cardinality = None
+    else:
+        cardinality = await estimate_series_cardinality(
+            measurement, dt_start, dt_end, tags
+        )
+        partitions = split_delete_range(
+            dt_start, dt_end, cardinality, get_points_per_day(measurement)
+        )
+        await cache.sys.set(
+            plan_key,
+            json.dumps([(d0.isoformat(), d1.isoformat()) for d0, d1 in partitions]),
+        )
+
+    finished = await cache.sys.smembers(key)
+    logger.info(
+        "delete %s, %s - %s: %s series, %d partitions, %d finished",
+        measurement,
+        dt_start,
+        dt_end,
+        "resumed" if cardinality is None else cardinality,
+        len(partitions),
+        len(finished),
+    )
+
     client = get_influx_client()
-    measurement = "security_list"
-    year = 2007
-    while year < 2024:
-        print("deleting in security_list ", year)
-        await client.delete(measurement, datetime.datetime(year, 1, 1))
-        print("data deleted in security_list: ", year)
-        year += 1
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _delete(d0: datetime.date, d1: datetime.date):
+        name = "%s-%s" % (d0.strftime("%Y%m%d"), d1.strftime("%Y%m%d"))
+        if name in finished:
+            return
+
+        start = datetime.datetime.combine(d0, datetime.time(0, 0, 0))
+        end = datetime.datetime.combine(d1, datetime.time(23, 59, 59))
+        start_str = f"{start.isoformat(timespec='seconds')}Z"
+        async with semaphore:
+            with span("influx.delete"):
+                await client.delete(measurement, stop=end, start=start_str, tags=tags)
+
+        await cache.sys.sadd(key, name)
+        logger.info("data deleted in %s, %s - %s", measurement, d0, d1)
+
+    await asyncio.gather(*[_delete(d0, d1) for d0, d1 in partitions])
+    await cache.sys.delete(key, plan_key)
+
+    logger.info("delete %s, %s - %s: all finished.", measurement, dt_start, dt_end)
+    return True
+
+
+async def remove_security_list():
+    await delete_range(
+        "security_list", datetime.date(2005, 1, 1), datetime.date(2022, 12, 31)
+    )
 
 
 async def drop_bars_board_1d(board: str):
     client = get_influx_client()
     measurement = "board_bars_1d"  # day
-    await client.delete(measurement, datetime.datetime(2023, 1, 1))
+    with span("influx.delete"):
+        await client.delete(measurement, datetime.datetime(2023, 1, 1))
     print("all data deleted in bars:1d ", board)
 
     print("board_bars_1d: all finished.")
 
 
 async def drop_bars_1d():
-    client = get_influx_client()
-    measurement = "stock_bars_1d"  # day
-    year = 2006
-    while year < 2007:
-        print("deleting in bars:1d ", year)
-        await client.delete(measurement, datetime.datetime(year, 1, 1))
-        print("data deleted in bars:1d, ", year)
-        year += 1
-
-    print("drop_bars_1d: all finished.")
+    await delete_range(
+        "stock_bars_1d", datetime.date(2005, 1, 1), datetime.date(2005, 12, 31)
+    )
 
 
 async def drop_bars_1w():
-    client = get_influx_client()
-    measurement = "stock_bars_1w"  # week
-    year = 2006
-    while year < 2024:
-        print("deleting in bars:1w ", year - 1)
-        await client.delete(measurement, datetime.datetime(year, 1, 1))
-        print("data deleted in bars:1w, ", year - 1)
-        year += 1
-
-    print("drop_bars_1w: all finished.")
+    await delete_range(
+        "stock_bars_1w", datetime.date(2005, 1, 1), datetime.date(2022, 12, 31)
+    )
 
 
 async def drop_bars_1M():
-    client = get_influx_client()
-    measurement = "stock_bars_1M"  # month
-    year = 2006
-    while year < 2024:
-        print("deleting in bars:1M ", year - 1)
-        await client.delete(measurement, datetime.datetime(year, 1, 1))
-        print("data deleted in bars:1M, ", year - 1)
-        year += 1
-
-    print("drop_bars_1M: all finished.")
+    await delete_range(
+        "stock_bars_1M", datetime.date(2005, 1, 1), datetime.date(2022, 12, 31)
+    )
 
 
 async def drop_bars_via_scope(target_year, ft: FrameType):
@@ -89,7 +226,8 @@ async def drop_bars_via_scope(target_year, ft: FrameType):
     start_str = f"{start.isoformat(timespec='seconds')}Z"
 
     print("deleting in ", measurement, target_year)
-    await client.delete(measurement, stop=end, start=start_str)
+    with span("influx.delete"):
+        await client.delete(measurement, stop=end, start=start_str)
     print("data deleted in ", measurement, target_year)
 
     print("drop ", measurement, " all finished.")
@@ -105,7 +243,8 @@ async def remove_sec_in_bars1d(
 
     client = get_influx_client()
     measurement = "stock_bars_1d"
-    await client.delete(measurement, stop=end, start=start_str, tags={"code": code})
+    with span("influx.delete"):
+        await client.delete(measurement, stop=end, start=start_str, tags={"code": code})
 
 
 async def remove_allsecs_in_bars1d(target_date: datetime.date):
@@ -116,7 +255,8 @@ async def remove_allsecs_in_bars1d(target_date: datetime.date):
 
     client = get_influx_client()
     measurement = "stock_bars_1d"
-    await client.delete(measurement, stop=end, start=start_str)
+    with span("influx.delete"):
+        await client.delete(measurement, stop=end, start=start_str)
 
 
 async def remove_sec_in_bars_min(code: str, target_date: datetime.date, ft: FrameType):
@@ -127,5 +267,70 @@ async def remove_sec_in_bars_min(code: str, target_date: datetime.date, ft: Fram
 
     client = get_influx_client()
     measurement = "stock_bars_%s" % ft.value
-    await client.delete(measurement, stop=end, start=start_str, tags={"code": code})
+    with span("influx.delete"):
+        await client.delete(measurement, stop=end, start=start_str, tags={"code": code})
     logger.info("remove sec from %s: %s, %s", measurement, code, target_date)
+
+
+def get_delete_predicates(codes, fts, dt_start: datetime.date, dt_end: datetime.date):
+    # influxdb的删除条件只支持AND，不支持OR，所以每个(measurement, code)对应一次删除，
+    # 同一个code在整个时间段内只删除一次
+    start = datetime.datetime.combine(dt_start, datetime.time(0, 0, 0))
+    end = datetime.datetime.combine(dt_end, datetime.time(23, 59, 59))
+    start_str = f"{start.isoformat(timespec='seconds')}Z"
+
+    predicates = []
+    for ft in sorted(set(fts), key=lambda x: x.value):
+        measurement = "stock_bars_%s" % ft.value
+        for code in sorted(set(codes)):
+            predicates.append((measurement, start_str, end, {"code": code}))
+
+    return predicates
+
+
+async def remove_secs_in_bars(
+    codes,
+    fts,
+    dt_start: datetime.date,
+    dt_end: datetime.date,
+    max_concurrency: int = 4,
+    progress: Callable[[int, int], None] = None,
+):
+    """批量删除多个证券在[dt_start, dt_end]之间多个周期的数据
+
+    Args:
+        codes: 证券代码
+        fts: 周期，比如(FrameType.MIN1, FrameType.MIN5)
+        max_concurrency: 同时执行的删除请求数
+        progress: 回调函数，参数为已完成的数量和总数
+    """
+    predicates = get_delete_predicates(codes, fts, dt_start, dt_end)
+    total = len(predicates)
+    if total == 0:
+        return 0
+
+    client = get_influx_client()
+    semaphore = asyncio.Semaphore(max_concurrency)
+    finished = 0
+
+    async def _delete(measurement, start_str, end, tags):
+        nonlocal finished
+        async with semaphore:
+            with span("influx.delete"):
+                await client.delete(measurement, stop=end, start=start_str, tags=tags)
+
+        finished += 1
+        if progress is not None:
+            progress(finished, total)
+        if finished % 100 == 0 or finished == total:
+            logger.info("remove secs from bars: %d/%d", finished, total)
+
+    await asyncio.gather(*[_delete(*x) for x in predicates])
+    logger.info(
+        "remove %d secs from bars:%s, %s - %s",
+        len(set(codes)),
+        ",".join([ft.value for ft in set(fts)]),
+        dt_start,
+        dt_end,
+    )
+    return total
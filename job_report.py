@@ -0,0 +1,123 @@
+"""每个任务每次运行的结构化记录，保存在cache.sys的列表中（只保留最近MAX_REPORTS条）
+
+记录的内容来自本次运行的trace（见tracing.py）：
+    处理的天数、读取和写入的行数、上传的字节数、远程调用次数、消耗的quota、耗时
+
+消耗的quota是任务内quota_budget.debit的合计。运行前后的余量是所有账号的合计，
+其它任务并发运行时也会变化，只作为参考。
+"""
+import datetime
+import json
+import logging
+from typing import Callable, List
+
+from omicron.dal.cache import cache
+
+from fetchers.quota_budget import quota_budget
+from tracing import Trace, run_trace
+
+logger = logging.getLogger(__name__)
+
+REPORTS_KEY = "datascan:job_reports"
+MAX_REPORTS = 2000
+
+
+def get_quota_spare():
+    # 本地维护的余量，不额外查询服务端；还没有同步过时为None
+    return quota_budget.spare
+
+
+def _sum_stages(trace: Trace, prefix: str, key: str):
+    return sum(
+        [
+            getattr(summary, key)
+            for name, summary in trace.stages.items()
+            if name.startswith(prefix)
+        ]
+    )
+
+
+def build_report(
+    trace: Trace, rc, quota_before: int = None, quota_after: int = None
+) -> dict:
+    return {
+        "job": trace.name,
+        "started": trace.started.strftime("%Y-%m-%d %H:%M:%S"),
+        "seconds": round(trace.elapsed, 3),
+        "rc": bool(rc),
+        "days": trace.counters.get("days", 0),
+        "rows_read": _sum_stages(trace, "influx.deserialize", "rows"),
+        "rows_written": _sum_stages(trace, "persist_bars", "rows"),
+        "bytes_uploaded": _sum_stages(trace, "dfs.write", "nbytes"),
+        "remote_calls": _sum_stages(trace, "fetch.", "count"),
+        "remote_rows": _sum_stages(trace, "fetch.", "rows"),
+        "quota_before": quota_before,
+        "quota_after": quota_after,
+        "quota_used": trace.counters.get("quota_used", 0),
+    }
+
+
+async def save_report(report: dict):
+    try:
+        await cache.sys.lpush(REPORTS_KEY, json.dumps(report))
+        await cache.sys.ltrim(REPORTS_KEY, 0, MAX_REPORTS - 1)
+    except Exception as e:
+        logger.error("failed to save job report of %s: %s", report["job"], e)
+        return False
+
+    return True
+
+
+async def run_job_with_report(name: str, func: Callable, *args):
+    """执行任务并保存运行记录，异常照常抛出（记录中rc为False）"""
+    quota_before = get_quota_spare()
+
+    rc = False
+    tracer = run_trace(name)
+    try:
+        with tracer:
+            rc = await func(*args)
+    finally:
+        quota_after = get_quota_spare()
+        report = build_report(tracer.trace, rc, quota_before, quota_after)
+        await save_report(report)
+        logger.info("job report: %s", report)
+
+    return rc
+
+
+async def get_job_reports(
+    job: str = None, since: datetime.datetime = None, limit: int = 100
+) -> List[dict]:
+    """按时间倒序返回运行记录，job和since用于过滤"""
+    items = await cache.sys.lrange(REPORTS_KEY, 0, -1)
+
+    reports = []
+    for item in items:
+        report = json.loads(item)
+        if job is not None and report["job"] != job:
+            continue
+        if since is not None and report["started"] < since.strftime(
+            "%Y-%m-%d %H:%M:%S"
+        ):
+            break  # 列表按时间倒序，之后的记录都更早
+        reports.append(report)
+        if len(reports) >= limit:
+            break
+
+    return reports
+
+
+def summarize_reports(reports: List[dict]) -> dict:
+    """多次运行的合计，用于观察吞吐量的变化和估算quota"""
+    seconds = sum([x["seconds"] for x in reports])
+    rows = sum([x["rows_written"] for x in reports])
+    return {
+        "runs": len(reports),
+        "failed": len([x for x in reports if not x["rc"]]),
+        "days": sum([x["days"] for x in reports]),
+        "seconds": seconds,
+        "rows_written": rows,
+        "rows_per_sec": rows / seconds if seconds > 0 else 0.0,
+        "quota_used": sum([x["quota_used"] or 0 for x in reports]),
+    }
@@ -13,8 +13,10 @@ from omicron.models import get_influx_client
 from omicron.models.security import Security
 from omicron.models.timeframe import TimeFrame
 
+from code_table import decode_code, encode_code
 from datascan.index_secs import get_index_sec_whitelist
 from influx_data.security_list import get_security_list
+from tracing import traced_deserialize, traced_query
 
 logger = logging.getLogger(__name__)
 
@@ -69,11 +71,7 @@ dtype_sec_list = [
 
 
 def compact_sec_name(x):
-    items = x.split(".")
-    if items[1] == "XSHE":
-        return int("1" + items[0])
-    else:
-        return int("2" + items[0])
+    return encode_code(x)
 
 
 def compact_board_name(x):
@@ -82,11 +80,7 @@ def compact_board_name(x):
 
 
 def filter_secs(code_c: int, all_index_db, index_white_list):
-    if code_c > 2000000:
-        code = f"{code_c}.XSHG"
-    else:
-        code = f"{code_c}.XSHE"
-    code = code[1:]
+    code = decode_code(code_c)
 
     if code in all_index_db:
         if code in index_white_list:
@@ -130,7 +124,7 @@ async def get_security_day_bars(start: datetime.datetime, end: datetime.datetime
         converters={"code": lambda x: compact_sec_name(x)},
         parse_date=None,
     )
-    result = await client.query(flux, ds)
+    result = await traced_query(client, flux, ds)
     if result.size == 0:
         return None
 
@@ -170,7 +164,7 @@ async def get_security_other_bars(
         converters={"code": lambda x: compact_sec_name(x)},
         parse_date=None,
     )
-    result = await client.query(flux, ds)
+    result = await traced_query(client, flux, ds)
     if result.size == 0:
         return None
 
@@ -208,7 +202,7 @@ async def get_security_minutes_bars(
         converters={"code": lambda x: compact_sec_name(x)},
         parse_date=None,
     )
-    result = await client.query(flux, ds)
+    result = await traced_query(client, flux, ds)
     if result.size == 0:
         return None
 
@@ -227,7 +221,7 @@ async def get_sec_list(start: datetime.datetime, end: datetime.datetime):
         .fields(["info"])
     )
 
-    data = await client.query(flux)
+    data = await traced_query(client, flux)
     if len(data) == 2:  # \r\n
         return None
 
@@ -239,7 +233,7 @@ async def get_sec_list(start: datetime.datetime, end: datetime.datetime):
     )
 
     converted_list = []
-    secs = ds(data).to_records(index=False)
+    secs = traced_deserialize(ds, data).to_records(index=False)
     secs = secs.astype(
         [
             ("_time", "datetime64[s]"),
@@ -270,7 +264,7 @@ async def get_xrxd_list(start: datetime.datetime, end: datetime.datetime):
         .fields(["_time", "code", "info"])
     )
 
-    data = await client.query(flux)
+    data = await traced_query(client, flux)
     if len(data) == 2:  # \r\n
         return None
 
@@ -282,7 +276,7 @@ async def get_xrxd_list(start: datetime.datetime, end: datetime.datetime):
     )
 
     converted_list = []
-    secs = ds(data).to_records(index=False)
+    secs = traced_deserialize(ds, data).to_records(index=False)
     secs = secs.astype(
         [
             ("_time", "datetime64[s]"),
@@ -329,7 +323,7 @@ async def get_board_bars_1d(start: datetime.datetime, end: datetime.datetime):
         converters={"code": lambda x: compact_board_name(x)},
         parse_date=None,
     )
-    result = await client.query(flux, ds)
+    result = await traced_query(client, flux, ds)
     if result.size == 0:
         return None
 
@@ -12,6 +12,7 @@ from omicron.models.stock import Stock
 from omicron.models.timeframe import TimeFrame
 from omicron.models.timeframe import TimeFrame as tf
 
+from code_table import code_difference
 from dfs import Storage
 from dfs_tools import get_trade_limit_filename
 from influx_data.security_bars_1d import (
@@ -57,15 +58,14 @@ def get_security_difference(secs_in_bars, all_secs, all_indexes):
     all_index_secs = set(all_indexes)
 
     # 检查是否有多余的股票
-    x1 = secs_in_bars.difference(all_stock_secs)
-    y1 = x1.difference(all_index_secs)
+    y1 = code_difference(secs_in_bars, all_stock_secs, all_index_secs)
     if len(y1) > 0:  # 需要删除
         for sec in y1:
             print("to be removed: ", sec)
     print("secs to be removed: ", len(y1))
 
     _all_secs_set = all_stock_secs.union(all_index_secs)
-    to_be_added = _all_secs_set.difference(secs_in_bars)
+    to_be_added = code_difference(_all_secs_set, secs_in_bars)
     if len(to_be_added) > 0:
         for sec in to_be_added:
             print("to be added: ", sec)
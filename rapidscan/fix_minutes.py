@@ -12,11 +12,27 @@ from omicron.models.timeframe import TimeFrame
 from omicron.models.timeframe import TimeFrame as tf
 from sqlalchemy import true
 
-from datascan.jq_fetcher import get_sec_bars_min
+from datascan.bars_resample import (
+    get_sec_bars_min_local_first,
+    get_security_minutes_full_bars,
+)
 from dfs_tools import write_bars_dfs
+from download_bars.gap_refetch import repair_minute_gaps
+from download_bars.journal import ProgressJournal
+from download_bars.pipeline import (
+    log_pipeline_stats,
+    run_branches,
+    run_download_pipeline,
+    run_stage,
+)
+from influx_data.bars_coverage import BarsCoverage
 from influx_data.security_bars_1d import get_security_day_bars
-from influx_data.security_bars_1m import get_security_minutes_data
-from influx_tools import remove_sec_in_bars_min
+from influx_data.security_bars_1m import (
+    get_incomplete_securities,
+    get_security_minutes_data,
+)
+from influx_tools import remove_secs_in_bars
+from tracing import span
 
 logger = logging.getLogger(__name__)
 
@@ -29,7 +45,22 @@ async def get_min_for_price(
     save_to_dfs: bool,
 ):
     # download all data from jq
-    all_secs_data = await get_sec_bars_min(all_secs_today, target_date, ft)
+    async def persist(data):
+        with span("persist_bars", rows=sum([len(x) for x in data.values()])):
+            await Stock.persist_bars(ft, data)
+        await BarsCoverage.update(target_date, ft, data)
+
+    # 分块下载和入库，入库的同时下载下一块，最后当天的数据一次写入dfs
+    # 中途退出后重新运行时，已经入库的块从数据库读回，不再消耗quota
+    journal = ProgressJournal(target_date, ft, prefix)
+    all_secs_data, stats = await run_download_pipeline(
+        all_secs_today,
+        lambda secs: get_sec_bars_min_local_first(secs, target_date, ft),
+        persist,
+        chunk_size=300,
+        journal=journal,
+        reload=lambda secs: get_security_minutes_full_bars(list(secs), target_date, ft),
+    )
     logger.info(
         "total secs downloaded from bars:%s@jq, %d, %s",
         ft.value,
@@ -41,7 +72,6 @@ async def get_min_for_price(
         logger.info("no valid price data from bars:%s@jq, %s", ft.value, target_date)
         return True
 
-    await Stock.persist_bars(ft, all_secs_data)
     logger.info(
         "get from bars:%s@jq and saved into db, %d",
         ft.value,
@@ -49,37 +79,43 @@ async def get_min_for_price(
     )
 
     if save_to_dfs:
-        await write_bars_dfs(target_date, ft, all_secs_data, prefix)
+        await run_stage(
+            stats,
+            "dfs",
+            len(all_secs_data),
+            write_bars_dfs(target_date, ft, all_secs_data, prefix),
+        )
+    log_pipeline_stats(stats, "bars:%s" % ft.value)
+    await journal.compact()
 
     logger.info("finished processing bars:%s for %s, %s", ft.value, target_date, prefix)
     return True
 
 
 async def scan_bars_min_for_seclist(target_date: datetime.date, ft: FrameType):
+    """返回分钟线中的全部证券，以及其中根数不完整的证券"""
     all_secs_in_bars = await get_security_minutes_data(ft, target_date)
     if all_secs_in_bars is None:
-        return None
+        return None, None
 
-    secs_in_bars = set()
-    for sec in all_secs_in_bars:
-        code = sec[1]
-        secs_in_bars.add(code)
+    incomplete = get_incomplete_securities(all_secs_in_bars, ft)
+    secs_in_bars = {sec["code"] for sec in all_secs_in_bars}
 
-    return secs_in_bars
+    return secs_in_bars, set(incomplete)
 
 
 async def validate_bars_min(target_day, secs_in_bars1d, ft: FrameType):
     # 获取所有分钟线的证券清单
-    secs_in_bars = await scan_bars_min_for_seclist(target_day, ft)
-    if secs_in_bars is None:
+    all_secs, incomplete = await scan_bars_min_for_seclist(target_day, ft)
+    if all_secs is None:
         return False
 
-    # 检查是否有多余的股票
-    x1 = secs_in_bars.difference(secs_in_bars1d)
+    # 检查是否有多余的股票，不完整的也要删除
+    x1 = all_secs.difference(secs_in_bars1d)
     if len(x1) > 0:  # 需要删除
         for sec in x1:
             logger.info("bars:%s, to be removed: %s", ft.value, sec)
-            await remove_sec_in_bars_min(sec, target_day, ft)
+        await remove_secs_in_bars(x1, (ft,), target_day, target_day)
         logger.info(
             "RebuildMin1, bars:%s, secs to be removed: %d, %s",
             ft.value,
@@ -87,7 +123,8 @@ async def validate_bars_min(target_day, secs_in_bars1d, ft: FrameType):
             target_day,
         )
 
-    # 需要增补的股票
+    # 需要增补的股票，根数不完整的证券重新下载缺失的部分
+    secs_in_bars = all_secs.difference(incomplete)
     to_be_added = secs_in_bars1d.difference(secs_in_bars)
     if len(to_be_added) > 0:
         for sec in to_be_added:
@@ -101,24 +138,38 @@ async def validate_bars_min(target_day, secs_in_bars1d, ft: FrameType):
     else:
         return True
 
-    rc = await get_min_for_price(to_be_added, target_day, ft, SecurityType.STOCK, False)
-    if not rc:
-        logger.error("failed to process stock price data (%s): %s", ft, target_day)
-        return False
+    # 只下载缺失的时间段，完全没有数据的证券缺失整个交易时段
+    remaining = await repair_minute_gaps(to_be_added, target_day, ft)
+    if len(remaining) > 0:
+        logger.error(
+            "bars:%s, %d secs still incomplete after refetch, %s",
+            ft.value,
+            len(remaining),
+            target_day,
+        )
+        logger.info(remaining)
 
     return True
 
 
 async def retrieve_bars_min(target_day, all_stocks, all_indexes, ft: FrameType):
     # 下载全部分钟线数据
-    rc = await get_min_for_price(all_stocks, target_day, ft, SecurityType.STOCK, True)
-    if not rc:
-        logger.error("failed to process stock price data (%s): %s", ft, target_day)
-        return False
-
-    rc = await get_min_for_price(all_indexes, target_day, ft, SecurityType.INDEX, True)
+    rc = await run_branches(
+        [
+            (
+                "stock price",
+                get_min_for_price(all_stocks, target_day, ft, SecurityType.STOCK, True),
+            ),
+            (
+                "index price",
+                get_min_for_price(
+                    all_indexes, target_day, ft, SecurityType.INDEX, True
+                ),
+            ),
+        ]
+    )
     if not rc:
-        logger.error("failed to process index price data (%s): %s", ft, target_day)
+        logger.error("failed to process price data (%s): %s", ft, target_day)
         return False
 
     return True
@@ -8,15 +8,12 @@ from omicron.dal.cache import cache
 from omicron.models.timeframe import TimeFrame
 
 from fetchers.abstract_quotes_fetcher import AbstractQuotesFetcher
-from influx_data.security_list import get_security_list
+from influx_data.security_list import get_security_universe
 from rapidscan.fix_days import scan_bars_1d_for_seclist
 from rapidscan.fix_minutes import validate_bars_min
-from time_utils import (
-    check_running_conditions,
-    get_cache_keyname,
-    get_latest_day_str,
-    split_securities,
-)
+from scheduler import is_shutdown_requested
+from time_utils import check_running_conditions, get_cache_keyname, get_latest_day_str
+from tracing import count
 
 logger = logging.getLogger(__name__)
 
@@ -69,12 +66,12 @@ async def scanner_handler_minutes(ft: FrameType, reload_days: bool):
         # 从本地文件中读取有缺失记录的日期，逐天重新下载数据
         if reload_days:
             # 读取当天的证券列表
-            all_secs_in_cache = await get_security_list(target_day)
-            if all_secs_in_cache is None:
+            universe = await get_security_universe(target_day)
+            if universe is None:
                 logger.error("no security list in date %s", target_day)
                 return False
 
-            all_secs, all_indexes = split_securities(all_secs_in_cache)
+            all_secs, all_indexes = universe
             if len(all_secs) == 0 or len(all_indexes) == 0:
                 logger.error("no stock or index list in date %s", target_day)
                 return False
@@ -96,10 +93,10 @@ async def scanner_handler_minutes(ft: FrameType, reload_days: bool):
 
         # save timestamp
         await cache.sys.set(key, target_day.strftime("%Y-%m-%d"))
-        input("next day...")
+        count("days")
 
-        if os.path.exists("/home/app/zillionare/omega_scanner_min/break1m.txt"):
-            logger.info("break flag detected, exit, last day: %s", target_day)
+        if is_shutdown_requested():
+            logger.info("shutdown requested, exit, last day: %s", target_day)
             break
 
     return True
@@ -19,6 +19,7 @@ from datascan.scanner_utils import compare_sec_data_full
 from dfs_tools import write_bars_dfs
 from fetchers.abstract_quotes_fetcher import AbstractQuotesFetcher
 from influx_data.security_list import get_security_list
+from tracing import count, traced_query
 
 logger = logging.getLogger(__name__)
 
@@ -116,7 +117,7 @@ async def get_security_minutes_bars(
         converters={"_time": lambda x: ciso8601.parse_datetime(x)},
         parse_date=None,
     )
-    result = await client.query(flux, ds)
+    result = await traced_query(client, flux, ds)
     if result.size == 0:
         return None
 
@@ -253,6 +254,7 @@ async def rebuild_minio_for_min():
                 )
                 break
             logger.info("finished processing %s of %s", ft.value, target_date)
+            count("days")
             # break
 
     return True
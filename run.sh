@@ -1,12 +1,12 @@
-pid=`ps -ef | grep python | grep app1m.py`
-echo $pid
-if [ ! -n "$pid" ]; then
-    echo "process not found"
-else
+#
+# 常驻运行，由app.py内的调度器负责启动各个任务，kill -TERM后等待任务结束再退出
+# crontab每2分钟执行一次本脚本，进程退出（比如init_omicron失败）后重新启动
+pid=`ps -ef | grep python | grep "app.py daemon" | grep -v grep`
+if [ -n "$pid" ]; then
     echo "process is running"
     exit 0
 fi
 
 echo "start process again..."
 cd /home/app/zillionare/omega_scanner_1m
-nohup /home/app/miniconda3/envs/omega/bin/python app1m.py &
+nohup /home/app/miniconda3/envs/omega/bin/python app.py daemon > /dev/null 2>&1 &
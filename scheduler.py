@@ -0,0 +1,132 @@
+import asyncio
+import datetime
+import logging
+import time
+from typing import Callable, List, Tuple
+
+from fetchers.abstract_quotes_fetcher import AbstractQuotesFetcher
+from fetchers.quota_budget import quota_budget
+from job_report import run_job_with_report
+
+logger = logging.getLogger(__name__)
+
+_shutdown_requested = False
+# 在Scheduler.run中创建，import时创建会绑定到默认loop，asyncio.run()中无法使用
+_shutdown: asyncio.Event = None
+
+
+def is_shutdown_requested():
+    # 各个handler在处理完一天的数据后检查，代替原来的break.txt
+    return _shutdown_requested
+
+
+def request_shutdown():
+    global _shutdown_requested
+
+    if not _shutdown_requested:
+        logger.info("shutdown requested, waiting for running jobs...")
+    _shutdown_requested = True
+    if _shutdown is not None:
+        _shutdown.set()
+
+
+class Job(object):
+    def __init__(
+        self,
+        name: str,
+        func: Callable,
+        args: tuple = (),
+        windows: List[Tuple[datetime.time, datetime.time]] = None,
+        interval: int = 120,
+        need_quota: bool = True,
+    ):
+        """定时任务
+
+        Args:
+            func: 异步的handler，比如scanner_handler_day
+            windows: 允许启动的时间段，None表示任何时间
+            interval: 上次结束之后间隔多少秒再次启动
+            need_quota: 启动前是否检查quota余量
+        """
+        self.name = name
+        self.func = func
+        self.args = args
+        self.windows = windows
+        self.interval = interval
+        self.need_quota = need_quota
+        self.task = None
+        self.last_finished = 0.0
+
+    def in_window(self, now: datetime.datetime):
+        if self.windows is None:
+            return True
+
+        nowtime = now.time()
+        for start, end in self.windows:
+            if start <= nowtime < end:
+                return True
+        return False
+
+    def is_due(self, now: datetime.datetime):
+        if self.task is not None:  # 同一个任务不会同时运行两个
+            return False
+        if time.time() - self.last_finished < self.interval:
+            return False
+        return self.in_window(now)
+
+
+class Scheduler(object):
+    """常驻的异步任务调度器，替代crontab + run.sh"""
+
+    def __init__(self, tick: int = 10):
+        self.tick = tick
+        self.jobs: List[Job] = []
+
+    def register(self, job: Job):
+        self.jobs.append(job)
+        logger.info("job registered: %s", job.name)
+
+    async def has_quota(self):
+        if len(AbstractQuotesFetcher._instances) == 0:
+            return False
+
+        await quota_budget.get_spare(AbstractQuotesFetcher._instances)
+        return quota_budget.available() > 0
+
+    async def _run_job(self, job: Job):
+        logger.info("job started: %s", job.name)
+        try:
+            rc = await run_job_with_report(job.name, job.func, *job.args)
+            logger.info("job finished: %s, %s", job.name, rc)
+        except Exception as e:
+            logger.exception(e)
+            logger.error("job failed: %s, %s", job.name, e)
+        finally:
+            job.task = None
+            job.last_finished = time.time()
+
+    async def run(self):
+        global _shutdown
+
+        _shutdown = asyncio.Event()
+        if _shutdown_requested:
+            _shutdown.set()
+
+        while not is_shutdown_requested():
+            now = datetime.datetime.now()
+            for job in self.jobs:
+                if not job.is_due(now):
+                    continue
+                if job.need_quota and not await self.has_quota():
+                    continue
+                job.task = asyncio.create_task(self._run_job(job))
+
+            try:
+                await asyncio.wait_for(_shutdown.wait(), timeout=self.tick)
+            except asyncio.TimeoutError:
+                pass
+
+        tasks = [job.task for job in self.jobs if job.task is not None]
+        if len(tasks) > 0:
+            await asyncio.gather(*tasks)
+        logger.info("scheduler stopped.")
@@ -8,6 +8,7 @@ from omicron.dal.cache import cache
 from omicron.models.timeframe import TimeFrame
 
 from fetchers.abstract_quotes_fetcher import AbstractQuotesFetcher
+from fetchers.quota_budget import quota_budget
 
 logger = logging.getLogger(__name__)
 
@@ -53,31 +54,18 @@ async def check_running_conditions(instance):
     now = datetime.datetime.now()
     nowtime = now.time()
 
-    quota = await instance.get_quota()
-    # quota = {"spare": 5000000}
-    logger.info("current quota: %d", quota["spare"])
-
     # in trade day and saturday
     if nowtime > dt1 and nowtime < dt2:
         return False
     if nowtime > dt3 and nowtime < dt4:
         return False
 
-    if not TimeFrame.is_trade_day(now):
-        if quota["spare"] < 10 * 10000:
-            logger.error("quota less than 10,0000, break...")
-            return False
-        return True
-
-    # 工作日需要保留400万给白天使用（实际需要256万）
-    if nowtime < dt4:
-        if quota["spare"] < 400 * 10000:
-            logger.error("quota less than 4,000,000, break...")
-            return False
-    else:
-        if quota["spare"] < 10 * 10000:
-            logger.error("quota less than 10,0000, break...")
-            return False
+    # 本地扣减quota，定期才和服务端同步
+    spare = await quota_budget.get_spare(AbstractQuotesFetcher._instances)
+    reserve = quota_budget.get_reserve_floor(now)
+    if spare < reserve:
+        logger.error("quota less than %d, break...", reserve)
+        return False
 
     return True
 
@@ -0,0 +1,264 @@
+"""按阶段统计耗时、行数和字节数，汇总到当前任务的一次运行（trace）中
+
+    with span("influx.query") as s:
+        data = await client.query(flux)
+        s.nbytes = len(data)
+
+调度器为每个任务创建一个trace（保存在contextvar中，子task自动继承），任务结束时输出
+汇总表并写入json文件。没有trace时span不做任何记录，常驻开启的开销只有两次计时。
+"""
+import contextvars
+import datetime
+import functools
+import json
+import logging
+import os
+import time
+from typing import Callable
+
+import cfg4py
+
+logger = logging.getLogger(__name__)
+
+# 每次运行最多保存的span明细，超出后只更新汇总
+MAX_SPANS = 20000
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class StageSummary(object):
+    def __init__(self, name: str):
+        self.name = name
+        self.count = 0
+        self.errors = 0
+        self.elapsed = 0.0
+        self.max_elapsed = 0.0
+        self.rows = 0
+        self.nbytes = 0
+
+    def add(self, elapsed: float, rows: int, nbytes: int, error: bool):
+        self.count += 1
+        self.errors += int(error)
+        self.elapsed += elapsed
+        self.max_elapsed = max(self.max_elapsed, elapsed)
+        self.rows += rows
+        self.nbytes += nbytes
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "seconds": round(self.elapsed, 6),
+            "max_seconds": round(self.max_elapsed, 6),
+            "rows": self.rows,
+            "bytes": self.nbytes,
+        }
+
+
+class Trace(object):
+    """一个任务的一次运行"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = datetime.datetime.now()
+        self.t0 = time.perf_counter()
+        self.elapsed = None
+        self.stages = {}
+        self.spans = []
+        self.dropped = 0
+        self.counters = {}
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def record(
+        self, stage: str, start: float, elapsed: float, rows: int, nbytes: int, error
+    ):
+        summary = self.stages.get(stage)
+        if summary is None:
+            summary = self.stages[stage] = StageSummary(stage)
+        summary.add(elapsed, rows, nbytes, error)
+
+        if len(self.spans) < MAX_SPANS:
+            self.spans.append(
+                (stage, round(start - self.t0, 6), round(elapsed, 6), rows, nbytes)
+            )
+        else:
+            self.dropped += 1
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.t0
+
+    def summary_table(self):
+        lines = [
+            "%-28s %8s %6s %10s %10s %12s %14s"
+            % ("stage", "count", "errors", "seconds", "max", "rows", "bytes")
+        ]
+        stages = sorted(self.stages.values(), key=lambda x: x.elapsed, reverse=True)
+        for x in stages:
+            lines.append(
+                "%-28s %8d %6d %10.3f %10.3f %12d %14d"
+                % (
+                    x.name,
+                    x.count,
+                    x.errors,
+                    x.elapsed,
+                    x.max_elapsed,
+                    x.rows,
+                    x.nbytes,
+                )
+            )
+        return "\n".join(lines)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "started": self.started.isoformat(),
+            "seconds": self.elapsed,
+            "stages": {k: v.to_dict() for k, v in self.stages.items()},
+            "counters": self.counters,
+            "spans": [
+                dict(zip(("stage", "start", "seconds", "rows", "bytes"), x))
+                for x in self.spans
+            ],
+            "dropped_spans": self.dropped,
+        }
+
+
+class span(object):
+    """记录一个阶段的耗时，rows和nbytes可以在with块中补充"""
+
+    __slots__ = ("stage", "rows", "nbytes", "trace", "start")
+
+    def __init__(self, stage: str, rows: int = 0, nbytes: int = 0):
+        self.stage = stage
+        self.rows = rows
+        self.nbytes = nbytes
+
+    def __enter__(self):
+        self.trace = _current_trace.get()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.trace is not None:
+            self.trace.record(
+                self.stage,
+                self.start,
+                time.perf_counter() - self.start,
+                self.rows,
+                self.nbytes,
+                exc_type is not None,
+            )
+        return False
+
+
+def traced(stage: str, rows: Callable = None):
+    """异步函数的装饰器，rows(result)返回处理的行数"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(stage) as s:
+                result = await func(*args, **kwargs)
+                if rows is not None and result is not None:
+                    s.rows = rows(result)
+                return result
+
+        return wrapper
+
+    return decorator
+
+
+def traced_sync(stage: str):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+async def traced_query(client, flux, deserializer=None):
+    """client.query的替代，分别记录查询和反序列化"""
+    with span("influx.query") as s:
+        data = await client.query(flux)
+        s.nbytes = len(data)
+
+    if deserializer is None:
+        return data
+    return traced_deserialize(deserializer, data)
+
+
+def traced_deserialize(deserializer, data):
+    with span("influx.deserialize", nbytes=len(data)) as s:
+        result = deserializer(data)
+        s.rows = len(result) if result is not None else 0
+        return result
+
+
+def get_current_trace():
+    return _current_trace.get()
+
+
+def count(name: str, n: int = 1):
+    """当前trace的计数器，比如处理的天数"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.count(name, n)
+
+
+def get_trace_dir():
+    cfg = cfg4py.get_instance()
+    _cfg = getattr(cfg, "tracing", None)
+    if _cfg is None or getattr(_cfg, "dir", None) is None:
+        return os.path.join(os.getcwd(), "logs", "traces")
+    return _cfg.dir
+
+
+def save_trace(trace: Trace):
+    trace_dir = get_trace_dir()
+    filename = "%s-%s.json" % (
+        trace.name.replace(":", "_").replace("/", "_"),
+        trace.started.strftime("%Y%m%d-%H%M%S"),
+    )
+    try:
+        os.makedirs(trace_dir, exist_ok=True)
+        with open(os.path.join(trace_dir, filename), "w") as f:
+            json.dump(trace.to_dict(), f)
+    except Exception as e:
+        logger.error("failed to save trace %s: %s", filename, e)
+        return None
+
+    return os.path.join(trace_dir, filename)
+
+
+class run_trace(object):
+    """为一次任务运行创建trace，结束时输出汇总并保存json"""
+
+    def __init__(self, name: str, save: bool = True):
+        self.trace = Trace(name)
+        self.save = save
+        self.token = None
+
+    def __enter__(self):
+        self.token = _current_trace.set(self.trace)
+        return self.trace
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_trace.reset(self.token)
+        self.trace.finish()
+
+        if len(self.trace.stages) > 0:
+            logger.info(
+                "trace of %s (%.2fs):\n%s",
+                self.trace.name,
+                self.trace.elapsed,
+                self.trace.summary_table(),
+            )
+            if self.save:
+                save_trace(self.trace)
+        return False
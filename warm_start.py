@@ -0,0 +1,245 @@
+"""交易日历和证券列表的本地快照
+
+omicron.init()从redis中读取交易日历和证券列表，redis为空（新节点或者被清空）时无法启动。
+这里在每次正常启动后把这些key保存为本地快照，redis为空或者响应太慢时先用快照恢复，
+不需要等上游重新加载。快照带格式版本号和sha256校验，不一致时不使用。
+"""
+import asyncio
+import datetime
+import hashlib
+import json
+import logging
+import os
+import pickle
+
+import cfg4py
+from omicron.dal.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# 快照格式变化时递增，旧版本的快照不再使用
+SNAPSHOT_VERSION = 1
+
+CALENDAR_KEYS = [
+    "calendar:1Y",
+    "calendar:1Q",
+    "calendar:1M",
+    "calendar:1w",
+    "calendar:1d",
+]
+SECURITY_KEYS = ["security:all"]
+VALUE_KEYS = ["security:latest_date"]
+
+# 和pack_seclist_from_cache/pack_calendar_from_cache中的检查一致
+MIN_SECURITIES = 4000
+MIN_CALENDAR_ITEMS = 10
+
+# 快照超过这个时间后，正常启动时重新保存
+SNAPSHOT_MAX_AGE = datetime.timedelta(days=1)
+PROBE_TIMEOUT = 3.0
+
+
+def get_snapshot_dir():
+    cfg = cfg4py.get_instance()
+    _cfg = getattr(cfg, "warm_start", None)
+    if _cfg is None or getattr(_cfg, "dir", None) is None:
+        return os.path.join(os.getcwd(), "data", "snapshot")
+    return _cfg.dir
+
+
+def get_snapshot_files():
+    snapshot_dir = get_snapshot_dir()
+    name = "cache_snapshot_v%d" % SNAPSHOT_VERSION
+    return (
+        os.path.join(snapshot_dir, name + ".pik"),
+        os.path.join(snapshot_dir, name + ".json"),
+    )
+
+
+def _is_valid(lists: dict):
+    if len(lists.get("security:all") or []) < MIN_SECURITIES:
+        return False
+    for key in CALENDAR_KEYS:
+        if len(lists.get(key) or []) < MIN_CALENDAR_ITEMS:
+            return False
+    return True
+
+
+async def is_cache_ready(timeout: float = PROBE_TIMEOUT):
+    """redis中是否已经有交易日历和证券列表，超时按没有处理"""
+
+    async def probe():
+        n_secs = await cache.security.llen("security:all")
+        n_days = await cache.security.llen("calendar:1d")
+        return n_secs >= MIN_SECURITIES and n_days >= MIN_CALENDAR_ITEMS
+
+    try:
+        return await asyncio.wait_for(probe(), timeout)
+    except asyncio.TimeoutError:
+        logger.warning("cache probe timeout after %.1fs", timeout)
+        return False
+    except Exception as e:
+        logger.warning("failed to probe cache: %s", e)
+        return False
+
+
+async def save_snapshot():
+    lists = {}
+    for key in CALENDAR_KEYS + SECURITY_KEYS:
+        lists[key] = await cache.security.lrange(key, 0, -1)
+    if not _is_valid(lists):
+        logger.error("calendar or securities incomplete in cache, snapshot skipped")
+        return False
+
+    values = {}
+    for key in VALUE_KEYS:
+        value = await cache.security.get(key)
+        if value is not None:
+            values[key] = value
+
+    binary = pickle.dumps(
+        {"version": SNAPSHOT_VERSION, "lists": lists, "values": values}, protocol=4
+    )
+    manifest = {
+        "version": SNAPSHOT_VERSION,
+        "created": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "sha256": hashlib.sha256(binary).hexdigest(),
+        "size": len(binary),
+        "counts": {k: len(v) for k, v in lists.items()},
+    }
+
+    data_file, manifest_file = get_snapshot_files()
+    try:
+        os.makedirs(os.path.dirname(data_file), exist_ok=True)
+        # 先写临时文件再改名，中途退出不会留下不完整的快照
+        for filename, content, mode in (
+            (data_file, binary, "wb"),
+            (manifest_file, json.dumps(manifest, indent=2), "w"),
+        ):
+            with open(filename + ".tmp", mode) as f:
+                f.write(content)
+            os.replace(filename + ".tmp", filename)
+    except Exception as e:
+        logger.error("failed to save cache snapshot: %s", e)
+        return False
+
+    logger.info("cache snapshot saved: %s, %d bytes", data_file, len(binary))
+    return True
+
+
+def read_manifest():
+    _, manifest_file = get_snapshot_files()
+    if not os.path.exists(manifest_file):
+        return None
+
+    try:
+        with open(manifest_file, "r") as f:
+            return json.load(f)
+    except Exception as e:
+        logger.error("failed to read snapshot manifest: %s", e)
+        return None
+
+
+def load_snapshot():
+    """读取并校验快照，版本或者校验和不一致时返回None"""
+    manifest = read_manifest()
+    if manifest is None:
+        logger.warning("no cache snapshot found")
+        return None
+    if manifest.get("version") != SNAPSHOT_VERSION:
+        logger.error("snapshot version mismatch: %s", manifest.get("version"))
+        return None
+
+    data_file, _ = get_snapshot_files()
+    try:
+        with open(data_file, "rb") as f:
+            binary = f.read()
+    except Exception as e:
+        logger.error("failed to read cache snapshot: %s", e)
+        return None
+
+    if hashlib.sha256(binary).hexdigest() != manifest.get("sha256"):
+        logger.error("snapshot checksum mismatch, %s", data_file)
+        return None
+
+    snapshot = pickle.loads(binary)
+    if not _is_valid(snapshot["lists"]):
+        logger.error("snapshot incomplete, %s", data_file)
+        return None
+
+    logger.info("cache snapshot loaded, created at %s", manifest.get("created"))
+    return snapshot
+
+
+async def restore_snapshot(snapshot: dict):
+    """只恢复redis中不存在或者为空的key
+
+    探测超时时redis中可能已经有更新的数据，不能用快照覆盖，也不删除已有的key。
+    """
+    lists = list(snapshot["lists"].keys())
+    values = list(snapshot["values"].keys())
+
+    pl = cache.security.pipeline()
+    for key in lists:
+        pl.llen(key)
+    for key in values:
+        pl.exists(key)
+    existing = await pl.execute()
+
+    # 所有写入在一个pipeline中执行，只有一次往返
+    restored = []
+    pl = cache.security.pipeline()
+    for key, n in zip(lists + values, existing):
+        if n:
+            continue
+        if key in snapshot["lists"]:
+            items = snapshot["lists"][key]
+            if len(items) == 0:
+                continue
+            pl.rpush(key, *items)
+        else:
+            # 只在key不存在时写入，期间有其它进程写入时保留它们的值
+            pl.set(key, snapshot["values"][key], nx=True)
+        restored.append(key)
+
+    if len(restored) > 0:
+        await pl.execute()
+    logger.info("%d keys restored from snapshot: %s", len(restored), restored)
+
+
+async def warm_start():
+    """redis中没有交易日历和证券列表（或者响应太慢）时，用本地快照恢复
+
+    Returns:
+        True表示已经可以调用omicron.init()，False表示快照不可用
+    """
+    if await is_cache_ready():
+        return True
+
+    logger.warning("calendar and securities not ready in cache, try snapshot")
+    snapshot = load_snapshot()
+    if snapshot is None:
+        return False
+
+    try:
+        await restore_snapshot(snapshot)
+    except Exception as e:
+        logger.error("failed to restore snapshot: %s", e)
+        return False
+
+    return True
+
+
+async def refresh_snapshot():
+    """omicron初始化成功后调用，快照不存在或者已经过期时重新保存"""
+    manifest = read_manifest()
+    if manifest is not None:
+        created = datetime.datetime.strptime(manifest["created"], "%Y-%m-%d %H:%M:%S")
+        if datetime.datetime.now() - created < SNAPSHOT_MAX_AGE:
+            return True
+
+    try:
+        return await save_snapshot()
+    except Exception as e:
+        logger.error("failed to refresh cache snapshot: %s", e)
+        return False